@@ -11,6 +11,7 @@ from bisheng.api.errcode.assistant import (AssistantInitError, AssistantNameRepe
                                            ToolTypeEmptyError, ToolTypeNotExistsError, ToolTypeIsPresetError)
 from bisheng.api.errcode.base import UnAuthorizedError, NotFoundError
 from bisheng.api.services.assistant_agent import AssistantAgent
+from bisheng.api.services.assistant_agent_cache import AssistantAgentCache
 from bisheng.api.services.assistant_base import AssistantUtils
 from bisheng.api.services.audit_log import AuditLogService
 from bisheng.api.services.base import BaseService
@@ -201,6 +202,7 @@ class AssistantService(BaseService, AssistantUtils):
             return UnAuthorizedError.return_resp()
 
         AssistantDao.delete_assistant(assistant)
+        AssistantAgentCache.update_version(assistant.id)
         cls.delete_assistant_hook(request, login_user, assistant)
         return resp_200()
 
@@ -291,6 +293,7 @@ class AssistantService(BaseService, AssistantUtils):
             AssistantLinkDao.update_assistant_knowledge(assistant.id,
                                                         knowledge_list=req.knowledge_list,
                                                         flow_id='')
+        AssistantAgentCache.update_version(assistant.id)
         tool_list, flow_list, knowledge_list = cls.get_link_info(req.tool_list, req.flow_list,
                                                                  req.knowledge_list)
         cls.update_assistant_hook(request, login_user, assistant)
@@ -335,6 +338,7 @@ class AssistantService(BaseService, AssistantUtils):
                 return AssistantInitError.return_resp('助手编译报错：' + str(e))
         assistant.status = status
         AssistantDao.update_assistant(assistant)
+        AssistantAgentCache.update_version(assistant.id)
         cls.update_assistant_hook(request, login_user, assistant)
         return resp_200()
 
@@ -351,6 +355,7 @@ class AssistantService(BaseService, AssistantUtils):
 
         assistant.prompt = prompt
         AssistantDao.update_assistant(assistant)
+        AssistantAgentCache.update_version(assistant.id)
         return resp_200()
 
     @classmethod
@@ -366,6 +371,7 @@ class AssistantService(BaseService, AssistantUtils):
             return check_result
 
         AssistantLinkDao.update_assistant_flow(assistant_id, flow_list=flow_list)
+        AssistantAgentCache.update_version(assistant_id)
         return resp_200()
 
     @classmethod
@@ -420,6 +426,8 @@ class AssistantService(BaseService, AssistantUtils):
         # 更新工具类别下所有工具的配置
         tool_type.extra = json.dumps(extra, ensure_ascii=False)
         GptsToolsDao.update_tools_extra(tool_type_id, tool_type.extra)
+        # 工具可能被多个助手使用
+        AssistantAgentCache.update_version()
         return tool_type
 
     @classmethod
@@ -533,6 +541,7 @@ class AssistantService(BaseService, AssistantUtils):
 
         GptsToolsDao.update_tool_type(exist_tool_type, delete_tool_id_list,
                                       add_children, update_tool_list)
+        AssistantAgentCache.update_version()
 
         children = GptsToolsDao.get_list_by_type([exist_tool_type.id])
         res = GptsToolsTypeRead(**exist_tool_type.model_dump(), children=children)
@@ -551,6 +560,7 @@ class AssistantService(BaseService, AssistantUtils):
             return UnAuthorizedError.return_resp()
 
         GptsToolsDao.delete_tool_type(tool_type_id)
+        AssistantAgentCache.update_version()
         cls.delete_gpts_tool_hook(user, exist_tool_type)
         return resp_200()
 
@@ -574,6 +584,7 @@ class AssistantService(BaseService, AssistantUtils):
             return check_result
 
         AssistantLinkDao.update_assistant_tool(assistant_id, tool_list=tool_list)
+        AssistantAgentCache.update_version(assistant_id)
         return resp_200()
 
     @classmethod
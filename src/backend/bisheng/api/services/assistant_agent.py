@@ -1,12 +1,14 @@
 import asyncio
+import copy
 import json
 import os
 import time
 import uuid
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from uuid import UUID
 
+from bisheng.api.services.assistant_agent_cache import AssistantAgentCache
 from bisheng.api.services.assistant_base import AssistantUtils
 from bisheng.api.services.knowledge_imp import decide_vectorstores
 from bisheng.api.services.llm import LLMService
@@ -73,10 +75,36 @@ class AssistantAgent(AssistantUtils):
         self.knowledge_skill_data = None
         # 知识库检索相关参数
         self.knowledge_retriever = {'max_content': 15000, 'sort_by_source_and_index': False}
+        # 助手关联的工具、技能和知识库在数据库里的配置
+        self.tool_configs: Optional[Dict] = None
 
-    async def init_assistant(self, callbacks: Callbacks = None):
-        await self.init_llm()
-        await self.init_tools(callbacks)
+    # 可以在多个会话间共享的无状态部分: llm和它的配置、从数据库查询的工具配置
+    # 工具(技能里的chain有自己的memory)和agent每个会话单独构建
+    cache_fields = ('llm', 'llm_agent_executor', 'knowledge_retriever', 'tool_configs')
+
+    async def init_assistant(self, callbacks: Callbacks = None, use_cache: bool = False):
+        """
+        初始化助手的llm、工具和agent
+        use_cache: 是否使用进程内缓存的llm和工具配置, 省去模型初始化和数据库查询
+        """
+        if not use_cache:
+            await self.init_llm()
+            await self.init_tools(callbacks)
+            await self.init_agent()
+            return
+
+        cache_key = AssistantAgentCache.get_cache_key(self.assistant)
+        components = AssistantAgentCache.get(cache_key)
+        if components is None:
+            await self.init_llm()
+            self.tool_configs = self.load_tool_configs()
+            components = {key: getattr(self, key) for key in self.cache_fields}
+            AssistantAgentCache.set(cache_key, components)
+            logger.info(f'act=init_assistant build assistant_id={self.assistant.id.hex}')
+        else:
+            for key, value in components.items():
+                setattr(self, key, value)
+        await self.init_tools(callbacks, self.tool_configs)
         await self.init_agent()
 
     async def init_llm(self):
@@ -239,6 +267,15 @@ class AssistantAgent(AssistantUtils):
     ):
         """通过id初始化tool"""
         tools_model: List[GptsTools] = GptsToolsDao.get_list_by_ids(tool_ids)
+        return AssistantAgent.init_tools_by_model(tools_model, llm, callbacks)
+
+    @staticmethod
+    def init_tools_by_model(
+            tools_model: List[GptsTools],
+            llm: BaseLanguageModel,
+            callbacks: Callbacks = None,
+    ):
+        """通过工具的数据库记录初始化tool"""
         preset_tools = []
         personal_tools = []
         tools: List[BaseTool] = []
@@ -259,14 +296,10 @@ class AssistantAgent(AssistantUtils):
             tools += tool_langchain
         return tools
 
-    async def init_tools(self, callbacks: Callbacks = None):
-        """通过名称获取tool 列表
-           tools_name_param:: {name: params}
-        """
+    def load_tool_configs(self) -> Dict:
+        """ 查询助手关联的工具、技能和知识库, 只包含数据库里的配置, 不包含构建好的对象 """
         links: List[AssistantLink] = AssistantLinkDao.get_assistant_link(
             assistant_id=self.assistant.id)
-        # tool
-        tools: List[BaseTool] = []
         tool_ids = []
         flow_links = []
         for link in links:
@@ -274,17 +307,35 @@ class AssistantAgent(AssistantUtils):
                 tool_ids.append(link.tool_id)
             else:
                 flow_links.append(link)
-        if tool_ids:
-            tools = self.init_tools_by_toolid(tool_ids, self.llm, callbacks)
+        tools_model = GptsToolsDao.get_list_by_ids(tool_ids) if tool_ids else []
 
         # flow + knowledge 拿到了AssistantLink后本质还是去根据id查询知识库的信息
         flow_data = FlowDao.get_flow_by_ids([link.flow_id for link in flow_links if link.flow_id])
         knowledge_data = KnowledgeDao.get_list_by_ids(
             [link.knowledge_id for link in flow_links if link.knowledge_id])
-        knowledge_data = {knowledge.id: knowledge for knowledge in knowledge_data}
-        flow_id2data = {flow.id: flow for flow in flow_data}
+        return {
+            'tools_model': tools_model,
+            'flow_links': flow_links,
+            'flow_id2data': {flow.id: flow for flow in flow_data},
+            'knowledge_data': {knowledge.id: knowledge for knowledge in knowledge_data},
+        }
+
+    async def init_tools(self, callbacks: Callbacks = None, tool_configs: Dict = None):
+        """通过名称获取tool 列表
+           tools_name_param:: {name: params}
+           tool_configs: load_tool_configs 的结果, 不传时从数据库查询
+        """
+        if tool_configs is None:
+            tool_configs = self.load_tool_configs()
+        # tool
+        tools: List[BaseTool] = []
+        if tool_configs['tools_model']:
+            tools = self.init_tools_by_model(tool_configs['tools_model'], self.llm, callbacks)
 
-        for link in flow_links:
+        knowledge_data = tool_configs['knowledge_data']
+        flow_id2data = tool_configs['flow_id2data']
+        self.offline_flows = []
+        for link in tool_configs['flow_links']:
             knowledge_id = link.knowledge_id
             # todo 必须进行初始化init_knowledge_tool才能使用吗?? 
             if knowledge_id:
@@ -302,7 +353,8 @@ class AssistantAgent(AssistantUtils):
                     self.offline_flows.append(tool_name)
                     logger.warning('act=init_tools not online flow_id: {}', link.flow_id)
                     continue
-                flow_graph_data = one_flow_data.data
+                # 缓存的配置被多个会话共用, 构建时可能会修改技能数据
+                flow_graph_data = copy.deepcopy(one_flow_data.data)
                 tool_description = f'{one_flow_data.name}:{one_flow_data.description}'
 
                 try:
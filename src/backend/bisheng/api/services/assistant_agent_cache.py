@@ -0,0 +1,59 @@
+from typing import Any, Optional
+from uuid import UUID, uuid4
+
+from loguru import logger
+
+from bisheng.cache import InMemoryCache
+from bisheng.cache.redis import redis_client
+
+
+class AssistantAgentCache:
+    """
+    进程内缓存助手的无状态组件(llm、从数据库查询的工具技能知识库配置), 避免每次对话都重新初始化模型和查询数据库
+    工具和agent带有会话状态(技能里的memory), 每个会话根据缓存的配置单独构建
+    缓存key包含助手的版本号, 助手、关联的工具技能知识库、模型配置变更时更新redis里的版本号, 所有进程的旧缓存自动失效
+    """
+
+    # 单个进程最多缓存的助手数, 超过后淘汰最久未使用的
+    max_size = 64
+    # 缓存的最长有效期, 未通过版本号感知到的变更最多延迟多久生效(单位：秒)
+    expiration_time = 600
+
+    # 所有助手共享的版本号, 工具和模型配置变更时更新
+    GLOBAL_VERSION_KEY = 'assistant:agent:version'
+    # 单个助手的版本号, 助手信息和关联关系变更时更新
+    ASSISTANT_VERSION_KEY = 'assistant:agent:version:{}'
+
+    _cache: InMemoryCache = InMemoryCache(max_size=max_size, expiration_time=expiration_time)
+
+    @classmethod
+    def get_cache_key(cls, assistant: Any) -> tuple:
+        """ 根据助手信息和版本号生成缓存key """
+        global_version = redis_client.get(cls.GLOBAL_VERSION_KEY)
+        assistant_version = redis_client.get(cls.ASSISTANT_VERSION_KEY.format(assistant.id.hex))
+        # 温度可以被openai接口的请求参数覆盖
+        return (assistant.id.hex, assistant.update_time, assistant.temperature, global_version,
+                assistant_version)
+
+    @classmethod
+    def get(cls, key: tuple) -> Optional[Any]:
+        return cls._cache.get(key)
+
+    @classmethod
+    def set(cls, key: tuple, value: Any):
+        cls._cache.set(key, value)
+
+    @classmethod
+    def update_version(cls, assistant_id: UUID | str = None):
+        """ 助手相关配置变更后调用, 不传assistant_id表示所有助手的缓存都失效 """
+        try:
+            if assistant_id is None:
+                redis_client.set(cls.GLOBAL_VERSION_KEY, uuid4().hex, expiration=None)
+                cls._cache.clear()
+            else:
+                assistant_id = assistant_id.hex if isinstance(assistant_id, UUID) else assistant_id
+                redis_client.set(cls.ASSISTANT_VERSION_KEY.format(assistant_id), uuid4().hex,
+                                 expiration=None)
+        except Exception as e:
+            # 缓存失效失败不影响配置的保存, 最多expiration_time后生效
+            logger.exception(f'update assistant agent version error: {e}')
@@ -11,6 +11,7 @@ from bisheng.api.errcode.base import UnAuthorizedError, NotFoundError
 from bisheng.api.errcode.flow import NotFoundVersionError, CurVersionDelError, VersionNameExistsError, \
     NotFoundFlowError, \
     FlowOnlineEditError, WorkFlowOnlineEditError
+from bisheng.api.services.assistant_agent_cache import AssistantAgentCache
 from bisheng.api.services.audit_log import AuditLogService
 from bisheng.api.services.base import BaseService
 from bisheng.api.services.user_service import UserPayload
@@ -452,6 +453,9 @@ class FlowService(BaseService):
 
         # 写入logo缓存
         cls.get_logo_share_link(flow_info.logo)
+
+        # 技能上下线会影响引用它的助手
+        AssistantAgentCache.update_version()
         return True
 
     @classmethod
@@ -463,4 +467,5 @@ class FlowService(BaseService):
 
         # 将用户组下关联的技能删除
         GroupResourceDao.delete_group_resource_by_third_id(flow_info.id.hex, ResourceTypeEnum.FLOW)
+        AssistantAgentCache.update_version()
         return True
@@ -9,6 +9,7 @@ from uuid import uuid4
 from bisheng.api.errcode.base import NotFoundError, UnAuthorizedError
 from bisheng.api.errcode.knowledge import (KnowledgeChunkError, KnowledgeExistError,
                                            KnowledgeNoEmbeddingError)
+from bisheng.api.services.assistant_agent_cache import AssistantAgentCache
 from bisheng.api.services.audit_log import AuditLogService
 from bisheng.api.services.knowledge_imp import (KnowledgeUtils, decide_vectorstores,
                                                 delete_knowledge_file_vectors, process_file_task,
@@ -231,6 +232,9 @@ class KnowledgeService(KnowledgeUtils):
         GroupResourceDao.delete_group_resource_by_third_id(str(knowledge.id),
                                                            ResourceTypeEnum.KNOWLEDGE)
 
+        # 关联了此知识库的助手需要重新初始化
+        AssistantAgentCache.update_version()
+
     @classmethod
     def delete_knowledge_file_in_minio(cls, knowledge_id: int):
         # 每1000条记录去删除minio文件
@@ -1,15 +1,17 @@
 import json
 import re
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 from bisheng.api.errcode.knowledge import KnowledgeSimilarError
+from bisheng.api.services.knowledge_sink import ChunkBatch, KnowledgeSink
 from bisheng.api.services.llm import LLMService
 from bisheng.api.utils import md5_hash
 from bisheng.api.v1.schemas import FileProcessBase
 from bisheng.cache.redis import redis_client
-from bisheng.cache.utils import file_download
+from bisheng.cache.utils import minio_file_download
 from bisheng.database.base import session_getter
 from bisheng.database.models.knowledge import Knowledge, KnowledgeDao
 from bisheng.database.models.knowledge_file import (KnowledgeFile, KnowledgeFileDao,
@@ -20,7 +22,9 @@ from bisheng.interface.importing.utils import import_vectorstore
 from bisheng.interface.initialize.loading import instantiate_vectorstore
 from bisheng.settings import settings
 from bisheng.utils.embedding import decide_embeddings
+from bisheng.utils.llm_enrich import LLMEnricher
 from bisheng.utils.minio_client import MinioClient
+from bisheng.utils.pipeline import PipelineStage, StagedPipeline
 from bisheng_langchain.document_loaders import ElemUnstructuredLoader
 from bisheng_langchain.rag.extract_info import extract_title
 from bisheng_langchain.text_splitter import ElemCharacterTextSplitter
@@ -228,6 +232,15 @@ def decide_knowledge_llm() -> Any:
     return LLMService.get_bisheng_llm(model_id=knowledge_llm.extract_title_model_id)
 
 
+class IngestFile:
+    """ 入库流水线里流转的单个文件 """
+
+    def __init__(self, db_file: KnowledgeFile, preview_cache_key: str = None):
+        self.db_file = db_file
+        self.preview_cache_key = preview_cache_key
+        self.batch: Optional[ChunkBatch] = None
+
+
 def addEmbedding(collection_name: str,
                  index_name: str,
                  knowledge_id: int,
@@ -240,7 +253,10 @@ def addEmbedding(collection_name: str,
                  callback: str = None,
                  extra_meta: str = None,
                  preview_cache_keys: List[str] = None):
-    """  将文件加入到向量和es库内  """
+    """
+    将文件加入到向量和es库内
+    下载解析、计算向量、写入milvus和es分成三个阶段, 每个阶段多线程并发, 文件在阶段之间流转
+    """
 
     logger.info('start process files')
     minio_client = MinioClient()
@@ -252,41 +268,96 @@ def addEmbedding(collection_name: str,
     logger.info('start init ElasticKeywordsSearch')
     es_client = decide_vectorstores(index_name, 'ElasticKeywordsSearch', embeddings)
 
+    conf = settings.knowledge_ingest_conf
+    sink = new_knowledge_sink(vector_client, es_client, embeddings)
+    # collection不存在时第一次写入会创建collection, 需要避免并发创建
+    vector_init_lock = threading.Lock()
+
+    def _parse(ingest_file: IngestFile) -> IngestFile:
+        db_file = ingest_file.db_file
+        logger.info(f'process_file_begin file_id={db_file.id} file_name={db_file.file_name}')
+        texts, metadatas = parse_file_chunks(minio_client,
+                                             db_file,
+                                             separator,
+                                             separator_rule,
+                                             chunk_size,
+                                             chunk_overlap,
+                                             extra_meta=extra_meta,
+                                             preview_cache_key=ingest_file.preview_cache_key)
+        ingest_file.batch = ChunkBatch(texts, metadatas)
+        return ingest_file
+
+    def _embed(ingest_file: IngestFile) -> IngestFile:
+        db_file = ingest_file.db_file
+        logger.info(f'embed_texts file={db_file.id} file_name={db_file.file_name}')
+        sink.embed(ingest_file.batch)
+        return ingest_file
+
+    def _sink(ingest_file: IngestFile) -> IngestFile:
+        if vector_client and not isinstance(vector_client.col, Collection):
+            with vector_init_lock:
+                add_chunks_into_store(sink, ingest_file)
+        else:
+            add_chunks_into_store(sink, ingest_file)
+        return ingest_file
+
+    def _on_done(ingest_file: IngestFile):
+        ingest_file.db_file.status = KnowledgeFileStatus.SUCCESS.value
+        _finish_file(ingest_file.db_file, callback)
+
+    def _on_error(ingest_file: IngestFile, e: Exception):
+        db_file = ingest_file.db_file
+        logger.error(f'process_file_fail file_id={db_file.id} file_name={db_file.file_name}')
+        db_file.status = KnowledgeFileStatus.FAILED.value
+        db_file.remark = str(e)[:500]
+        _finish_file(db_file, callback)
+
+    # 尝试从缓存中获取文件的分块
+    ingest_files = []
     for index, db_file in enumerate(knowledge_files):
-        # 尝试从缓存中获取文件的分块
         preview_cache_key = None
         if preview_cache_keys:
             preview_cache_key = preview_cache_keys[index] if index < len(
                 preview_cache_keys) else None
-        try:
-            logger.info(f'process_file_begin file_id={db_file.id} file_name={db_file.file_name}')
-            add_file_embedding(vector_client,
-                               es_client,
-                               minio_client,
-                               db_file,
-                               separator,
-                               separator_rule,
-                               chunk_size,
-                               chunk_overlap,
-                               extra_meta=extra_meta,
-                               preview_cache_key=preview_cache_key)
-            db_file.status = KnowledgeFileStatus.SUCCESS.value
-        except Exception as e:
-            logger.exception(
-                f'process_file_fail file_id={db_file.id} file_name={db_file.file_name}')
-            db_file.status = KnowledgeFileStatus.FAILED.value
-            db_file.remark = str(e)[:500]
-        finally:
-            logger.info(f'process_file_end file_id={db_file.id} file_name={db_file.file_name}')
-            KnowledgeFileDao.update(db_file)
-            if callback:
-                inp = {
-                    'file_name': db_file.file_name,
-                    'file_status': db_file.status,
-                    'file_id': db_file.id,
-                    'error_msg': db_file.remark
-                }
-                requests.post(url=callback, json=inp, timeout=3)
+        ingest_files.append(IngestFile(db_file, preview_cache_key))
+
+    stages = [
+        PipelineStage('parse', _parse, conf.parse_workers),
+        PipelineStage('embed', _embed, conf.embed_workers),
+        PipelineStage('sink', _sink, conf.sink_workers),
+    ]
+    pipeline = StagedPipeline(stages,
+                              queue_size=conf.queue_size,
+                              on_done=_on_done,
+                              on_error=_on_error)
+    pipeline.run(ingest_files)
+
+
+def _finish_file(db_file: KnowledgeFile, callback: str = None):
+    """ 更新文件的处理状态并回调 """
+    logger.info(f'process_file_end file_id={db_file.id} file_name={db_file.file_name}')
+    KnowledgeFileDao.update(db_file)
+    if callback:
+        inp = {
+            'file_name': db_file.file_name,
+            'file_status': db_file.status,
+            'file_id': db_file.id,
+            'error_msg': db_file.remark
+        }
+        requests.post(url=callback, json=inp, timeout=3)
+
+
+def new_knowledge_sink(vector_client, es_client, embeddings: Embeddings) -> KnowledgeSink:
+    """ 按照入库配置初始化分块的写入 """
+    conf = settings.knowledge_ingest_conf
+    return KnowledgeSink(vector_client,
+                         es_client,
+                         embeddings,
+                         embed_batch_size=conf.embed_batch_size,
+                         max_retries=conf.embed_max_retries,
+                         retry_interval=conf.embed_retry_interval,
+                         es_workers=conf.sink_workers,
+                         es_refresh=conf.es_refresh)
 
 
 def add_file_embedding(vector_client,
@@ -299,11 +370,31 @@ def add_file_embedding(vector_client,
                        chunk_overlap: int,
                        extra_meta: str = None,
                        preview_cache_key: str = None):
+    if not vector_client:
+        raise ValueError('vector db not found, please check your milvus config')
+    if not es_client:
+        raise ValueError('es not found, please check your es config')
+    ingest_file = IngestFile(db_file, preview_cache_key)
+    texts, metadatas = parse_file_chunks(minio_client, db_file, separator, separator_rule,
+                                         chunk_size, chunk_overlap, extra_meta, preview_cache_key)
+    ingest_file.batch = ChunkBatch(texts, metadatas)
+    sink = new_knowledge_sink(vector_client, es_client, vector_client.embedding_func)
+    add_chunks_into_store(sink, ingest_file)
+
+
+def parse_file_chunks(minio_client,
+                      db_file: KnowledgeFile,
+                      separator: List[str],
+                      separator_rule: List[str],
+                      chunk_size: int,
+                      chunk_overlap: int,
+                      extra_meta: str = None,
+                      preview_cache_key: str = None) -> Tuple[List[str], List[dict]]:
+    """ 下载文件并解析成入库的文本和元数据 """
     # download original file
     logger.info(f'start download original file={db_file.id} file_name={db_file.file_name}')
     if db_file.object_name.startswith('tmp'):
-        file_url = minio_client.get_share_link(db_file.object_name, minio_client.tmp_bucket)
-        filepath, _ = file_download(file_url)
+        filepath, _ = minio_file_download(minio_client, minio_client.tmp_bucket, db_file.object_name)
 
         # 如果是tmp开头的bucket需要重新保存原始文件到minio的正式bucket
         file_type = db_file.file_name.rsplit('.', 1)[-1]
@@ -312,13 +403,7 @@ def add_file_embedding(vector_client,
         logger.info(f'upload original file {db_file.id} file_name={db_file.file_name} res={res}')
     # 如果是tmp开头的bucket需要重新保存原始文件到minio的正式bucket
     else:
-        file_url = minio_client.get_share_link(db_file.object_name)
-        filepath, _ = file_download(file_url)
-
-    if not vector_client:
-        raise ValueError('vector db not found, please check your milvus config')
-    if not es_client:
-        raise ValueError('es not found, please check your es config')
+        filepath, _ = minio_file_download(minio_client, minio_client.bucket, db_file.object_name)
 
     # extract text from file
     texts, metadatas, parse_type, partitions = read_chunk_text(filepath, db_file.file_name,
@@ -360,28 +445,25 @@ def add_file_embedding(vector_client,
             'extra': extra_meta or ''
         })
 
-    logger.info(f'add_vectordb file={db_file.id} file_name={db_file.file_name}')
-    # 存入milvus
-    vector_client.add_texts(texts=texts, metadatas=metadatas)
+    return texts, metadatas
 
-    logger.info(f'add_es file={db_file.id} file_name={db_file.file_name}')
-    # 存入es
-    es_client.add_texts(texts=texts, metadatas=metadatas)
+
+def add_chunks_into_store(sink: KnowledgeSink, ingest_file: IngestFile):
+    """ 文本写入milvus和es, 向量只计算一次, 两个库并发写入 """
+    db_file = ingest_file.db_file
+    logger.info(f'add_vectordb_es file={db_file.id} file_name={db_file.file_name}')
+    sink.write(ingest_file.batch)
 
     logger.info(f'add_complete file={db_file.id} file_name={db_file.file_name}')
-    if preview_cache_key:
-        KnowledgeUtils.delete_preview_cache(preview_cache_key)
+    if ingest_file.preview_cache_key:
+        KnowledgeUtils.delete_preview_cache(ingest_file.preview_cache_key)
 
 
 def add_text_into_vector(vector_client, es_client, db_file: KnowledgeFile, texts: List[str],
                          metadatas: List[dict]):
-    logger.info(f'add_vectordb file={db_file.id} file_name={db_file.file_name}')
-    # 存入milvus
-    vector_client.add_texts(texts=texts, metadatas=metadatas)
-
-    logger.info(f'add_es file={db_file.id} file_name={db_file.file_name}')
-    # 存入es
-    es_client.add_texts(texts=texts, metadatas=metadatas)
+    logger.info(f'add_vectordb_es file={db_file.id} file_name={db_file.file_name}')
+    sink = new_knowledge_sink(vector_client, es_client, vector_client.embedding_func)
+    sink.write(ChunkBatch(texts, metadatas))
 
 
 def parse_partitions(partitions: List[Any]) -> Dict:
@@ -446,9 +528,15 @@ def read_chunk_text(input_file, file_name, separator: List[str], separator_rule:
     logger.info(f'start_extract_title file_name={file_name}')
     if llm:
         t = time.time()
-        for one in documents:
-            # 配置了相关llm的话，就对文档做总结
-            title = extract_title(llm, one.page_content)
+        # 配置了相关llm的话，就并发对文档做总结, 相同内容的总结结果会被缓存
+        conf = settings.knowledge_ingest_conf
+        enricher = LLMEnricher(max_in_flight=conf.enrich_max_in_flight,
+                               cache=redis_client,
+                               cache_expiration=conf.enrich_cache_expiration)
+        titles = enricher.map(lambda text: extract_title(llm, text),
+                              [one.page_content for one in documents],
+                              namespace=f'title:{getattr(llm, "model_id", "")}')
+        for one, title in zip(documents, titles):
             one.metadata['title'] = title
         logger.info('file_extract_title=success timecost={}', time.time() - t)
 
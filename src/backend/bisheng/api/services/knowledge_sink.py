@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+
+import numpy as np
+from bisheng.utils.embedding import embed_documents_array
+from langchain.embeddings.base import Embeddings
+from loguru import logger
+
+# es的bulk写入单独使用线程池, 不阻塞milvus的写入
+_es_executor: Optional[ThreadPoolExecutor] = None
+_es_executor_lock = threading.Lock()
+
+
+def _get_es_executor(workers: int) -> ThreadPoolExecutor:
+    global _es_executor
+    with _es_executor_lock:
+        if _es_executor is None:
+            _es_executor = ThreadPoolExecutor(max_workers=workers,
+                                              thread_name_prefix='knowledge_es')
+    return _es_executor
+
+
+class ChunkBatch:
+    """ 按列存储的一批分块, milvus和es的写入共用同一份数据 """
+
+    def __init__(self,
+                 texts: List[str],
+                 metadatas: List[dict],
+                 embeddings: Optional[Union[List[List[float]], np.ndarray]] = None):
+        if len(texts) != len(metadatas):
+            raise ValueError('Number of metadatas must be equal to the number of texts.')
+        self.texts = texts
+        self.metadatas = metadatas
+        self.embeddings = embeddings
+
+    def __len__(self):
+        return len(self.texts)
+
+
+def embed_batches(embeddings: Embeddings,
+                  texts: List[str],
+                  batch_size: int = 32,
+                  max_retries: int = 3,
+                  retry_interval: float = 1) -> np.ndarray:
+    """
+    分批计算文本的向量, 单批失败时只重试这一批, 已经计算好的批次不会重新计算
+    返回(len(texts), dim)的float32数组
+    """
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        for retry in range(max_retries + 1):
+            try:
+                vectors.append(embed_documents_array(embeddings, batch))
+                break
+            except Exception as e:
+                if retry >= max_retries:
+                    raise e
+                logger.warning(f'embed batch retry start={start} size={len(batch)} '
+                               f'retry={retry + 1} error={e}')
+                time.sleep(retry_interval * (2**retry))
+    count = sum(len(one) for one in vectors)
+    if count != len(texts):
+        raise ValueError(f'embedding result count {count} not equal to texts {len(texts)}')
+    # 所有批次拼接成一个连续数组, 只拷贝一次
+    return np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+
+class KnowledgeSink:
+    """
+    知识库分块的写入: 向量只计算一次, milvus和es从同一份数据并发写入
+    """
+
+    def __init__(self,
+                 vector_client,
+                 es_client,
+                 embeddings: Embeddings = None,
+                 embed_batch_size: int = 32,
+                 max_retries: int = 3,
+                 retry_interval: float = 1,
+                 es_workers: int = 4,
+                 es_refresh: bool = True):
+        self.vector_client = vector_client
+        self.es_client = es_client
+        self.embeddings = embeddings
+        self.embed_batch_size = embed_batch_size
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.es_workers = es_workers
+        self.es_refresh = es_refresh
+
+    def embed(self, batch: ChunkBatch) -> ChunkBatch:
+        """ 计算这一批分块的向量, 已经计算过的不再计算 """
+        if batch.embeddings is None:
+            batch.embeddings = embed_batches(self.embeddings, batch.texts, self.embed_batch_size,
+                                             self.max_retries, self.retry_interval)
+        return batch
+
+    def write(self, batch: ChunkBatch):
+        """ 写入milvus和es, 两个都写入成功才返回, milvus写入失败时删除已经写入es的分块 """
+        if not self.vector_client:
+            raise ValueError('vector db not found, please check your milvus config')
+        if not self.es_client:
+            raise ValueError('es not found, please check your es config')
+        if not len(batch):
+            return
+        self.embed(batch)
+        # es在单独的线程里bulk写入, 和milvus的写入并发
+        es_future = _get_es_executor(self.es_workers).submit(self.es_client.add_texts,
+                                                             texts=batch.texts,
+                                                             metadatas=batch.metadatas,
+                                                             refresh_indices=self.es_refresh)
+        try:
+            self.vector_client.add_texts(texts=batch.texts,
+                                         metadatas=batch.metadatas,
+                                         embeddings=batch.embeddings)
+        except Exception:
+            # 等es写完再删除, 避免只有es里有分块
+            if es_future.exception() is None:
+                self.rollback_es(batch)
+            raise
+        es_error = es_future.exception()
+        if es_error is not None:
+            raise es_error
+
+    def rollback_es(self, batch: ChunkBatch):
+        """ 按文件id删除这一批分块在es里的数据 """
+        file_ids = list({one['file_id'] for one in batch.metadatas if one.get('file_id') is not None})
+        if not file_ids:
+            logger.warning('rollback es skipped, file_id not found in metadata')
+            return
+        try:
+            res = self.es_client.client.delete_by_query(
+                index=self.es_client.index_name,
+                query={'terms': {
+                    'metadata.file_id': file_ids
+                }},
+                refresh=self.es_refresh)
+            logger.info(f'act=rollback_es file_id={file_ids} res={res}')
+        except Exception:
+            logger.exception(f'rollback es error file_id={file_ids}')
@@ -3,6 +3,7 @@ from typing import List, Optional
 
 from bisheng.api.errcode.base import NotFoundError
 from bisheng.api.errcode.llm import ServerExistError, ModelNameRepeatError, ServerAddError, ServerAddAllError
+from bisheng.api.services.assistant_agent_cache import AssistantAgentCache
 from bisheng.api.services.user_service import UserPayload
 from bisheng.api.v1.schemas import LLMServerInfo, LLMModelInfo, KnowledgeLLMConfig, AssistantLLMConfig, \
     EvaluationLLMConfig, AssistantLLMItem, LLMServerCreateReq
@@ -107,6 +108,7 @@ class LLMService:
     def delete_llm_server(cls, request: Request, login_user: UserPayload, server_id: int) -> bool:
         """ 删除一个服务提供方 """
         LLMDao.delete_server_by_id(server_id)
+        AssistantAgentCache.update_version()
         return True
 
     @classmethod
@@ -201,6 +203,8 @@ class LLMService:
         exist_server.config = server.config
 
         db_server = LLMDao.update_server_with_models(exist_server, list(model_dict.values()))
+        # 助手缓存的llm实例使用了旧的模型配置
+        AssistantAgentCache.update_version()
 
         return cls.get_one_llm(request, login_user, db_server.id)
 
@@ -213,6 +217,7 @@ class LLMService:
             raise NotFoundError.http_exception()
         exist_model.online = online
         LLMDao.update_model_online(exist_model.id, online)
+        AssistantAgentCache.update_version()
         return LLMModelInfo(**exist_model.dict())
 
     @classmethod
@@ -282,6 +287,7 @@ class LLMService:
         else:
             config = Config(key=ConfigKeyEnum.ASSISTANT_LLM.value, value=json.dumps(data.dict()))
         ConfigDao.insert_config(config)
+        AssistantAgentCache.update_version()
         return data
 
     @classmethod
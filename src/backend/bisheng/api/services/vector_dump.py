@@ -0,0 +1,168 @@
+import gzip
+import io
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+from pymilvus import Collection, DataType
+
+# 默认不导出的字段, 需要时通过fields参数显式指定
+DEFAULT_EXCLUDE_FIELDS = ['bbox']
+VECTOR_DTYPES = (DataType.FLOAT_VECTOR, DataType.BINARY_VECTOR)
+# 导出支持的格式
+DUMP_FORMATS = ('ndjson', 'gzip', 'parquet')
+
+
+def get_dump_fields(col: Collection, fields: Optional[List[str]] = None,
+                    include_vector: bool = False) -> List[str]:
+    """
+    计算需要导出的字段, 主键总是导出, 用来作为断点续传的位置
+    """
+    pk_field = col.schema.primary_field.name
+    vector_fields = [one.name for one in col.schema.fields if one.dtype in VECTOR_DTYPES]
+    all_fields = [one.name for one in col.schema.fields]
+    if fields:
+        unknown = [one for one in fields if one not in all_fields]
+        if unknown:
+            raise ValueError(f'unknown fields: {unknown}')
+        ret = [one for one in fields if include_vector or one not in vector_fields]
+    else:
+        ret = [
+            one for one in all_fields
+            if one not in DEFAULT_EXCLUDE_FIELDS and (include_vector or one not in vector_fields)
+        ]
+    if pk_field not in ret:
+        ret.insert(0, pk_field)
+    return ret
+
+
+def iter_vector_rows(col: Collection,
+                     expr: str,
+                     output_fields: List[str],
+                     batch_size: int = 1000,
+                     resume_token: Any = None) -> Iterator[List[Dict]]:
+    """
+    通过query_iterator按主键顺序分批遍历collection, 内存里只保留一批数据
+    resume_token: 上次导出的最后一条数据的主键, 从它之后开始导出
+    """
+    pk_field = col.schema.primary_field.name
+    if resume_token is not None:
+        resume_expr = f'{pk_field} > {json.dumps(resume_token)}'
+        expr = f'({expr}) and {resume_expr}' if expr else resume_expr
+    iterator = col.query_iterator(batch_size=batch_size, expr=expr, output_fields=output_fields)
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            yield rows
+    finally:
+        iterator.close()
+
+
+def _json_default(value: Any):
+    # milvus返回的向量可能是numpy类型
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _to_ndjson(rows: List[Dict]) -> bytes:
+    return ''.join(
+        json.dumps(row, ensure_ascii=False, default=_json_default) + '\n' for row in rows).encode('utf-8')
+
+
+def dump_ndjson(batches: Iterator[List[Dict]]) -> Iterator[bytes]:
+    """ 每行一条json数据 """
+    for rows in batches:
+        yield _to_ndjson(rows)
+
+
+def dump_gzip(batches: Iterator[List[Dict]]) -> Iterator[bytes]:
+    """ gzip压缩的ndjson, 每批数据压缩后立即返回 """
+    buffer = _StreamSink()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+        for rows in batches:
+            gz.write(_to_ndjson(rows))
+            gz.flush()
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def dump_parquet(batches: Iterator[List[Dict]]) -> Iterator[bytes]:
+    """ parquet格式, 每批数据写成一个row group后立即返回 """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _StreamSink()
+    writer = None
+    try:
+        for rows in batches:
+            if writer is None:
+                table = pa.Table.from_pylist(rows)
+                writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), table.schema)
+            else:
+                table = pa.Table.from_pylist(rows, schema=writer.schema)
+            writer.write_table(table)
+            yield sink.pop()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.pop()
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    只追加的文件对象, 写入的数据取走后释放内存
+    parquet的footer需要记录绝对偏移量, 所以tell返回已写入的总长度
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def pop(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def dump_vector_stream(col: Collection,
+                       expr: str,
+                       output_fields: List[str],
+                       dump_format: str = 'ndjson',
+                       batch_size: int = 1000,
+                       resume_token: Any = None) -> Iterator[bytes]:
+    """
+    流式导出collection的数据
+    """
+    batches = iter_vector_rows(col, expr, output_fields, batch_size, resume_token)
+    if dump_format == 'ndjson':
+        stream = dump_ndjson(batches)
+    elif dump_format == 'gzip':
+        stream = dump_gzip(batches)
+    elif dump_format == 'parquet':
+        stream = dump_parquet(batches)
+    else:
+        raise ValueError(f'dump format must be one of {DUMP_FORMATS}')
+    total = 0
+    for one in stream:
+        if one:
+            total += len(one)
+            yield one
+    logger.info(f'dump_vector_over collection={col.name} bytes={total}')
@@ -2,7 +2,8 @@ import asyncio
 import copy
 import json
 from queue import Queue
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Union
+from uuid import UUID
 
 from bisheng.api.v1.schemas import ChatResponse
 from bisheng.database.models.message import ChatMessage as ChatMessageModel
@@ -563,3 +564,87 @@ class AsyncGptsDebugCallbackHandler(AsyncGptsLLMCallbackHandler):
                     chat_id=self.chat_id,
                     user_id=self.user_id,
                     extra=json.dumps({'run_id': kwargs.get('run_id').hex})))
+
+
+class AsyncOpenAIStreamCallbackHandler(AsyncCallbackHandler):
+    """
+    把助手运行过程中的流式输出转换成openai格式的delta, 放入有界队列
+    队列满时await会阻塞llm的流式读取, 消费方(客户端)慢时上游也跟着变慢
+    只转换助手本身的输出, 工具内部的llm(知识库问答、技能里的chain)产生的token不返回给调用方
+    """
+
+    def __init__(self, queue: asyncio.Queue, stream_token: bool = True):
+        self.queue = queue
+        # ReAct模式下模型输出的是思考过程, 不流式返回给调用方, 只返回工具调用和最终答案
+        self.stream_token = stream_token
+        # openai格式里tool_calls的序号
+        self.tool_call_index = 0
+        # 是否已经输出过答案内容
+        self.has_content = False
+        # 工具以及在工具内部运行的chain、llm的run_id, handler只在一次请求内使用, 不需要清理
+        self.tool_run_ids = set()
+
+    def _track_run(self, run_id: UUID, parent_run_id: Optional[UUID]) -> None:
+        if parent_run_id in self.tool_run_ids:
+            self.tool_run_ids.add(run_id)
+
+    async def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *,
+                             run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._track_run(run_id, parent_run_id)
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *,
+                           run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._track_run(run_id, parent_run_id)
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *,
+                                  run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._track_run(run_id, parent_run_id)
+
+    async def on_retriever_start(self, serialized: Dict[str, Any], query: str, *,
+                                 run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._track_run(run_id, parent_run_id)
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if not self.stream_token or kwargs.get('run_id') in self.tool_run_ids:
+            return
+        chunk = kwargs.get('chunk')
+        tool_call_chunks = getattr(getattr(chunk, 'message', None), 'tool_call_chunks', None)
+        if tool_call_chunks:
+            tool_calls = []
+            for one in tool_call_chunks:
+                function = {'arguments': one.get('args') or ''}
+                if one.get('name'):
+                    function['name'] = one['name']
+                tool_call = {'index': one.get('index') or 0, 'function': function}
+                if one.get('id'):
+                    tool_call['id'] = one['id']
+                    tool_call['type'] = 'function'
+                tool_calls.append(tool_call)
+            await self.queue.put({'tool_calls': tool_calls})
+            return
+        # azure偶尔会返回一个None
+        if not token:
+            return
+        self.has_content = True
+        await self.queue.put({'content': token})
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str,
+                            **kwargs: Any) -> Any:
+        run_id = kwargs.get('run_id')
+        nested = kwargs.get('parent_run_id') in self.tool_run_ids
+        self.tool_run_ids.add(run_id)
+        if self.stream_token or nested:
+            # function call模式下工具调用已经通过模型的流式输出返回, 工具内部调用的工具不返回
+            return
+        await self.queue.put({
+            'tool_calls': [{
+                'index': self.tool_call_index,
+                'id': f'call_{run_id.hex}' if run_id else None,
+                'type': 'function',
+                'function': {
+                    'name': serialized.get('name'),
+                    'arguments': input_str
+                }
+            }]
+        })
+        self.tool_call_index += 1
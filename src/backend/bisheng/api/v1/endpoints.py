@@ -10,7 +10,6 @@ from bisheng.api.services.user_service import UserPayload, get_admin_user, get_l
 from bisheng.api.utils import get_request_ip
 from bisheng.api.v1.schemas import (ProcessResponse, UnifiedResponseModel, UploadFileResponse,
                                     resp_200)
-from bisheng.cache.redis import redis_client
 from bisheng.cache.utils import save_uploaded_file, upload_file_to_minio
 from bisheng.chat.utils import judge_source, process_source_document
 from bisheng.database.base import generate_uuid, session_getter
@@ -95,7 +94,7 @@ def save_config(data: dict, admin_user: UserPayload = Depends(get_admin_user)):
             config.value = data.get('data')
             session.add(config)
             session.commit()
-        redis_client.delete('config:initdb_config')
+        settings.settings.update_config_version()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'格式不正确, {str(e)}')
 
@@ -349,7 +349,7 @@ class OpenAIChatCompletionReq(BaseModel):
 class OpenAIChoice(BaseModel):
     index: int = Field(..., description='选项的索引')
     message: dict = Field(default=None, description='对应的消息内容，和输入的格式一致')
-    finish_reason: str = Field(default='stop', description='结束原因, 助手只有stop')
+    finish_reason: Optional[str] = Field(default='stop', description='结束原因, 助手只有stop, 流式返回的中间结果为空')
     delta: dict = Field(default=None, description='对应的openai流式返回消息内容')
 
 
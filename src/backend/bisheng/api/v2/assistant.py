@@ -1,7 +1,9 @@
 # 免登录的助手相关接口
+import asyncio
+import json
 import time
 import uuid
-from typing import Optional
+from typing import List, Optional
 from uuid import UUID
 
 from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketException
@@ -13,6 +15,7 @@ from loguru import logger
 from bisheng.api.services.assistant import AssistantService
 from bisheng.api.services.assistant_agent import AssistantAgent
 from bisheng.api.utils import get_request_ip
+from bisheng.api.v1.callback import AsyncOpenAIStreamCallbackHandler
 from bisheng.api.v1.chat import chat_manager
 from bisheng.api.v1.schemas import (AssistantInfo, OpenAIChatCompletionReq,
                                     OpenAIChatCompletionResp, OpenAIChoice, UnifiedResponseModel)
@@ -22,6 +25,9 @@ from bisheng.settings import settings
 
 router = APIRouter(prefix='/assistant', tags=['OpenAPI', 'Assistant'])
 
+# 流式返回时缓存的最大delta数
+STREAM_QUEUE_SIZE = 64
+
 
 @router.post('/chat/completions', response_model=OpenAIChatCompletionResp)
 async def assistant_chat_completions(request: Request, req_data: OpenAIChatCompletionReq):
@@ -64,11 +70,18 @@ async def assistant_chat_completions(request: Request, req_data: OpenAIChatCompl
 
     # 初始化助手agent
     agent = AssistantAgent(assistant_info, '')  # 初始化agent
-    await agent.init_assistant()
+    await agent.init_assistant(use_cache=True)
+
+    openai_resp_id = uuid.uuid4().hex
+    # 流式返回, 边生成边返回
+    if req_data.stream:
+        return StreamingResponse(_stream_agent(agent, question, chat_history, openai_resp_id,
+                                               req_data.model),
+                                 media_type='text/event-stream')
+
     answer = await agent.run(question, chat_history)
     answer = answer[-1].content
 
-    openai_resp_id = uuid.uuid4().hex
     logger.info(f'act=assistant_chat_completions_over openai_resp_id={openai_resp_id}')
     # 将结果包装成openai的数据格式
     openai_resp = OpenAIChatCompletionResp(
@@ -81,26 +94,67 @@ async def assistant_chat_completions(request: Request, req_data: OpenAIChatCompl
             'content': answer
         })],
     )
+    return openai_resp
 
-    # 非流式直接返回结果
-    if not req_data.stream:
-        return openai_resp
-
-    # 流式返回最终结果, 兼容openai格式处理
-    openai_resp.object = 'chat.completion.chunk'
-    openai_resp.choices = [OpenAIChoice(index=0, delta={'content': answer})]
 
-    async def _event_stream():
-        # todo：zgq 后续优化成真正的流式输出，目前是出现最终答案之后直接流式返回的
-        yield f'data: {openai_resp.json()}\n\n'
+async def _stream_agent(agent: AssistantAgent, question: str, chat_history: List,
+                        openai_resp_id: str, model: str):
+    """
+    运行助手并把流式输出转换成openai格式的SSE
+    客户端断开时starlette会取消这个生成器, 同时取消助手的执行, 停止上游模型的调用
+    """
+    created = int(time.time())
+
+    def _chunk(delta: dict, finish_reason: str = None) -> str:
+        resp = OpenAIChatCompletionResp(
+            id=openai_resp_id,
+            object='chat.completion.chunk',
+            created=created,
+            model=model,
+            choices=[OpenAIChoice(index=0, delta=delta, finish_reason=finish_reason)])
+        return f'data: {resp.json()}\n\n'
+
+    # 有界队列, 客户端读取慢时阻塞上游的流式输出
+    queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    handler = AsyncOpenAIStreamCallbackHandler(queue,
+                                               stream_token=agent.current_agent_executor != 'ReAct')
+
+    async def _run_agent():
+        try:
+            result = await agent.run(question, chat_history, [handler])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception('act=assistant_chat_completions_stream error')
+            await queue.put(e)
+            return None
+        await queue.put(None)
+        return result
+
+    task = asyncio.create_task(_run_agent())
+    try:
+        yield _chunk({'role': 'assistant', 'content': ''})
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                yield f'data: {json.dumps({"error": {"message": str(item)}}, ensure_ascii=False)}\n\n'
+                return
+            yield _chunk(item)
+        result = task.result()
+        # 模型不支持流式输出或者ReAct模式, 最终答案一次性返回
+        if not handler.has_content and result:
+            yield _chunk({'content': result[-1].content})
+        yield _chunk({}, finish_reason='stop')
         # 最后的[DONE]
         yield 'data: [DONE]\n\n'
-
-    try:
-        return StreamingResponse(_event_stream(), media_type='text/event-stream')
-    except Exception as exc:
-        logger.error(exc)
-        return ORJSONResponse(status_code=500, content=str(exc))
+        logger.info(f'act=assistant_chat_completions_over openai_resp_id={openai_resp_id}')
+    finally:
+        if not task.done():
+            # 客户端断开, 取消助手执行
+            task.cancel()
+            logger.info(f'act=assistant_chat_completions_cancel openai_resp_id={openai_resp_id}')
 
 
 @router.get('/info/{assistant_id}', response_model=UnifiedResponseModel[AssistantInfo])
@@ -6,6 +6,7 @@ from bisheng.api.services import knowledge_imp
 from bisheng.api.services.knowledge import KnowledgeService
 from bisheng.api.services.knowledge_imp import (decide_vectorstores, delete_es, delete_vector,
                                                 text_knowledge)
+from bisheng.api.services.vector_dump import DUMP_FORMATS, dump_vector_stream, get_dump_fields
 from bisheng.api.v1.schemas import (ChunkInput, KnowledgeFileOne, KnowledgeFileProcess,
                                     UnifiedResponseModel, resp_200, resp_500)
 from bisheng.api.v2.schema.filelib import APIAddQAParam, APIAppendQAParam, QueryQAParam
@@ -19,7 +20,7 @@ from bisheng.interface.embeddings.custom import FakeEmbedding
 from bisheng.settings import settings
 from bisheng.utils.logger import logger
 from fastapi import APIRouter, BackgroundTasks, Body, File, Form, HTTPException, Request, UploadFile, Query
-from starlette.responses import FileResponse
+from starlette.responses import FileResponse, StreamingResponse
 
 # build router
 router = APIRouter(prefix='/filelib', tags=['OpenAPI', 'Knowledge'])
@@ -224,20 +225,43 @@ async def clear_tmp_chunks_data(body: Dict):
 
 
 @router.get('/dump_vector', status_code=200)
-def dump_vector_knowledge(collection_name: str, expr: str = None, store: str = 'Milvus'):
+def dump_vector_knowledge(collection_name: str,
+                          expr: str = None,
+                          store: str = 'Milvus',
+                          fields: str = Query(default=None, description='导出的字段, 逗号分隔, 默认导出除bbox外的标量字段'),
+                          include_vector: bool = Query(default=False, description='是否导出向量'),
+                          dump_format: str = Query(default='ndjson', alias='format',
+                                                   description='导出格式, ndjson、gzip(压缩的ndjson)或parquet'),
+                          batch_size: int = Query(default=1000, ge=1, le=16384, description='每批从milvus读取的条数'),
+                          resume_token: int = Query(default=None, description='断点续传, 传入上次导出的最后一条数据的pk')):
+    """ 流式导出向量库数据, 每条数据都带有主键, 中断后可以用最后一条数据的主键续传 """
     # dump vector db
     embedding_tmp = FakeEmbedding()
     vector_store = decide_vectorstores(collection_name, store, embedding_tmp)
 
-    if vector_store and vector_store.col:
-        fields = [
-            s.name for s in vector_store.col.schema.fields
-            if s.name not in ['pk', 'bbox', 'vector']
-        ]
-        res_list = vector_store.col.query('file_id>1', output_fields=fields)
-        return resp_200(res_list)
-    else:
+    if not vector_store or not getattr(vector_store, 'col', None):
         return resp_500('参数错误')
+    if dump_format not in DUMP_FORMATS:
+        return resp_500(f'format must be one of {DUMP_FORMATS}')
+    try:
+        output_fields = get_dump_fields(vector_store.col,
+                                        fields.split(',') if fields else None,
+                                        include_vector)
+    except ValueError as e:
+        return resp_500(str(e))
+    if expr is None:
+        expr = 'file_id>1'
+
+    media_type, suffix = {
+        'ndjson': ('application/x-ndjson', 'ndjson'),
+        'gzip': ('application/gzip', 'ndjson.gz'),
+        'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    }[dump_format]
+    return StreamingResponse(
+        dump_vector_stream(vector_store.col, expr, output_fields, dump_format, batch_size,
+                           resume_token),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{collection_name}.{suffix}"'})
 
 
 @router.get('/download_statistic')
@@ -0,0 +1,239 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from appdirs import user_cache_dir
+from loguru import logger
+from prometheus_client import Counter
+
+from bisheng.settings import settings
+
+# 每一层缓存的命中情况
+embedding_cache_requests = Counter('bisheng_embedding_cache_requests',
+                                   'embedding cache lookups by tier and result', ['tier', 'result'])
+
+
+def text_hash(text: str) -> str:
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def _to_bytes(vector) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def _from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.float32)
+
+
+class _DiskTier:
+    """
+    本地sqlite存储的向量缓存, 向量以float32的二进制存储
+    多个进程可以共用同一个文件, 超过有效期或者数量上限时淘汰最久未访问的
+    """
+
+    # 每写入多少条检查一次淘汰
+    evict_interval = 1000
+    # 命中时只在内存里记录访问时间, 攒够这么多条或者超过这么久(单位：秒)再一起写入, 读取时不提交事务
+    touch_batch = 1000
+    touch_interval = 60
+
+    def __init__(self, path: str, ttl: int, max_items: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.write_count = 0
+        # 还没有写入的访问时间 key -> access_time
+        self.touched: Dict[str, float] = {}
+        self.last_touch_flush = time.time()
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS embedding ('
+                          'key TEXT PRIMARY KEY, vector BLOB NOT NULL, '
+                          'create_time REAL NOT NULL, access_time REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_access_time ON embedding(access_time)')
+        self.conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        now = time.time()
+        ret = {}
+        with self.lock:
+            # sqlite单条语句的参数个数有限制
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self.conn.execute(
+                    f'SELECT key, vector FROM embedding WHERE create_time > ? AND key IN '
+                    f'({",".join("?" * len(batch))})', [now - self.ttl, *batch]).fetchall()
+                ret.update(rows)
+            self.touched.update(dict.fromkeys(ret, now))
+            if len(self.touched) >= self.touch_batch or now - self.last_touch_flush >= self.touch_interval:
+                self._flush_touched(now)
+                self.conn.commit()
+        return ret
+
+    def _flush_touched(self, now: float):
+        """ 把内存里记录的访问时间写入数据库, 由调用方提交事务 """
+        self.last_touch_flush = now
+        if not self.touched:
+            return
+        touched, self.touched = self.touched, {}
+        self.conn.executemany('UPDATE embedding SET access_time = ? WHERE key = ?',
+                              [(access_time, key) for key, access_time in touched.items()])
+
+    def set_many(self, items: Dict[str, bytes]):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO embedding (key, vector, create_time, access_time) '
+                'VALUES (?, ?, ?, ?)', [(key, value, now, now) for key, value in items.items()])
+            for key in items:
+                self.touched.pop(key, None)
+            self.write_count += len(items)
+            if self.write_count >= self.evict_interval:
+                self.write_count = 0
+                # 淘汰之前写入访问时间, 避免淘汰最近命中的
+                self._flush_touched(now)
+                self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now: float):
+        self.conn.execute('DELETE FROM embedding WHERE create_time <= ?', (now - self.ttl,))
+        total = self.conn.execute('SELECT COUNT(*) FROM embedding').fetchone()[0]
+        if total > self.max_items:
+            # 多删除一部分, 避免每次写入都触发淘汰
+            self.conn.execute(
+                'DELETE FROM embedding WHERE key IN '
+                '(SELECT key FROM embedding ORDER BY access_time LIMIT ?)',
+                (total - int(self.max_items * 0.9),))
+
+
+class _RedisTier:
+    """ redis存储的向量缓存, 多台机器之间共享 """
+
+    def __init__(self, ttl: int):
+        from bisheng.cache.redis import redis_client
+        self.redis = redis_client
+        self.ttl = ttl
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        values = self.redis.mget([f'embedding:{key}' for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, items: Dict[str, bytes]):
+        self.redis.mset({f'embedding:{key}': value for key, value in items.items()},
+                        expiration=self.ttl)
+
+
+class EmbeddingCache:
+    """
+    embedding结果的两级缓存: 本地磁盘 + 可选的redis, key是模型标识和文本的md5
+    缓存的是模型返回并归一化之后的向量, 命中时直接返回
+    """
+
+    def __init__(self, disk_path: str, ttl: int, max_items: int, redis_enabled: bool = False,
+                 redis_ttl: int = 86400):
+        self.disk = _DiskTier(disk_path, ttl, max_items)
+        self.redis = _RedisTier(redis_ttl) if redis_enabled else None
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, namespace: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """ 按顺序返回每个文本缓存的向量, 没有缓存的返回None """
+        keys = [f'{namespace}:{text_hash(text)}' for text in texts]
+        found = self._get_tier(self.disk, 'disk', list(set(keys)))
+        if self.redis is not None:
+            missing = list(set(key for key in keys if key not in found))
+            if missing:
+                redis_found = self._get_tier(self.redis, 'redis', missing)
+                if redis_found:
+                    # 回填本地磁盘
+                    self._set_tier(self.disk, 'disk', redis_found)
+                    found.update(redis_found)
+        ret = [_from_bytes(found[key]) if key in found else None for key in keys]
+        hit = sum(1 for one in ret if one is not None)
+        self.hits += hit
+        self.misses += len(ret) - hit
+        return ret
+
+    def set_many(self, namespace: str, texts: List[str], vectors: np.ndarray):
+        items = {f'{namespace}:{text_hash(text)}': _to_bytes(vector) for text, vector in zip(texts, vectors)}
+        self._set_tier(self.disk, 'disk', items)
+        if self.redis is not None:
+            self._set_tier(self.redis, 'redis', items)
+
+    def embed_documents(self, namespace: str, texts: List[str],
+                        embed_func: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """ 只对没有缓存的文本调用embed_func, 相同的文本只计算一次, 返回float32数组 """
+        rows = self.get_many(namespace, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, rows) if vector is None))
+        if missing:
+            vectors = embed_func(missing)
+            if len(vectors) != len(missing):
+                # 模型返回异常时不缓存, 保持和直接调用模型一样的结果
+                return embed_func(texts)
+            self.set_many(namespace, missing, vectors)
+            computed = dict(zip(missing, vectors))
+            rows = [computed[text] if vector is None else vector for text, vector in zip(texts, rows)]
+        logger.debug(f'embedding_cache namespace={namespace} total={len(texts)} miss={len(missing)} '
+                     f'hit_rate={self.hit_rate():.3f}')
+        return np.vstack(rows).astype(np.float32, copy=False)
+
+    def embed_query(self, namespace: str, text: str,
+                    embed_func: Callable[[str], np.ndarray]) -> np.ndarray:
+        vector = self.get_many(namespace, [text])[0]
+        if vector is None:
+            vector = embed_func(text)
+            if len(vector):
+                self.set_many(namespace, [text], [vector])
+        return vector
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def _get_tier(tier, name: str, keys: List[str]) -> Dict[str, bytes]:
+        try:
+            found = tier.get_many(keys)
+        except Exception as e:
+            # 缓存异常不影响embedding
+            logger.warning(f'embedding_cache {name} get error: {e}')
+            found = {}
+        embedding_cache_requests.labels(name, 'hit').inc(len(found))
+        embedding_cache_requests.labels(name, 'miss').inc(len(keys) - len(found))
+        return found
+
+    @staticmethod
+    def _set_tier(tier, name: str, items: Dict[str, bytes]):
+        try:
+            tier.set_many(items)
+        except Exception as e:
+            logger.warning(f'embedding_cache {name} set error: {e}')
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """ 进程内共享的embedding缓存, 没有开启时返回None """
+    global _embedding_cache
+    conf = settings.embedding_cache_conf
+    if not conf.enabled:
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            disk_path = conf.disk_path or os.path.join(user_cache_dir('bisheng', 'bisheng'),
+                                                       'embedding_cache.sqlite3')
+            try:
+                _embedding_cache = EmbeddingCache(disk_path, conf.ttl, conf.max_items,
+                                                  conf.redis_enabled, conf.redis_ttl)
+            except Exception as e:
+                logger.warning(f'init embedding cache error, cache disabled: {e}')
+                return None
+    return _embedding_cache
@@ -1,10 +1,15 @@
+import asyncio
 import pickle
+import threading
 from typing import Dict, Optional
 
 import redis
+import redis.asyncio as aioredis
 from bisheng.settings import settings
 from loguru import logger
 from redis import ConnectionPool, RedisCluster
+from redis.asyncio.cluster import ClusterNode as AsyncClusterNode
+from redis.asyncio.sentinel import Sentinel as AsyncSentinel
 from redis.backoff import ExponentialBackoff
 from redis.cluster import ClusterNode
 from redis.retry import Retry
@@ -14,6 +19,13 @@ from redis.sentinel import Sentinel
 class RedisClient:
 
     def __init__(self, url, max_connections=10):
+        self.url = url
+        # 异步连接, 每个事件循环第一次使用时初始化, 用于websocket等协程内的阻塞读
+        # asyncio的连接池绑定创建时的事件循环, 不能在多个事件循环之间共享
+        self._async_connections: Dict[asyncio.AbstractEventLoop, object] = {}
+        self._async_lock = threading.Lock()
+        # 同步的阻塞读使用的连接
+        self.block_connection = None
         # # 哨兵模式
         if isinstance(settings.redis_url, Dict):
             redis_conf = dict(settings.redis_url)
@@ -31,6 +43,7 @@ class RedisClient:
                 self.connection = RedisCluster.from_url(cluster_url, **redis_conf,
                                                         retry=Retry(ExponentialBackoff(), 6),
                                                         cluster_error_retry_attempts=1)
+                self.block_connection = self.connection
                 return
             hosts = [eval(x) for x in redis_conf.pop('sentinel_hosts')]
             password = redis_conf.pop('sentinel_password')
@@ -38,11 +51,14 @@ class RedisClient:
             sentinel = Sentinel(sentinels=hosts, socket_timeout=0.1, password=password)
             # 获取主节点的连接
             self.connection = sentinel.master_for(master, socket_timeout=0.1, **redis_conf)
+            # 阻塞读需要等待较长时间，使用单独的不设置socket超时的连接
+            self.block_connection = sentinel.master_for(master, **{**redis_conf, 'socket_timeout': None})
 
         else:
             # 单机模式
             self.pool = ConnectionPool.from_url(url, max_connections=max_connections)
             self.connection = redis.StrictRedis(connection_pool=self.pool)
+            self.block_connection = self.connection
 
     def set(self, key, value, expiration=3600):
         try:
@@ -129,10 +145,46 @@ class RedisClient:
         finally:
             self.close()
 
-    def incr(self, key, expiration=3600) -> int:
+    def getdel(self, key):
+        """ 获取后删除, 原子操作, 多个调用方同时获取时只有一个能拿到值(需要redis 6.2以上) """
         try:
             self.cluster_nodes(key)
-            value = self.connection.incr(key)
+            value = self.connection.getdel(key)
+            return pickle.loads(value) if value else None
+        finally:
+            self.close()
+
+    def mget(self, keys: list) -> list:
+        """ 批量获取, 集群模式下key可能在不同的节点, 使用pipeline逐个获取 """
+        if not keys:
+            return []
+        try:
+            pipe = self.connection.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(key)
+            return [pickle.loads(value) if value else None for value in pipe.execute()]
+        finally:
+            self.close()
+
+    def mset(self, mapping: dict, expiration=3600):
+        """ 批量写入 """
+        if not mapping:
+            return
+        try:
+            pipe = self.connection.pipeline(transaction=False)
+            for key, value in mapping.items():
+                if expiration:
+                    pipe.setex(key, expiration, pickle.dumps(value))
+                else:
+                    pipe.set(key, pickle.dumps(value))
+            pipe.execute()
+        finally:
+            self.close()
+
+    def incr(self, key, expiration=3600, amount: int = 1) -> int:
+        try:
+            self.cluster_nodes(key)
+            value = self.connection.incr(key, amount)
             if expiration:
                 self.connection.expire(key, expiration)
             return value
@@ -170,6 +222,78 @@ class RedisClient:
         finally:
             self.close()
 
+    def blpop(self, key, timeout: int = 1, count: int = 1) -> list:
+        """ 阻塞式的获取列表中的数据，最多等待timeout秒, 有数据时一次最多返回count条 """
+        try:
+            self.cluster_nodes(key)
+            ret = self.block_connection.blpop([key], timeout)
+            if not ret:
+                return []
+            result = [ret[1]]
+            if count > 1:
+                result.extend(self.connection.lpop(key, count - 1) or [])
+            return result
+        finally:
+            self.close()
+
+    async def ablpop(self, key, timeout: int = 1, count: int = 1) -> list:
+        """ blpop的异步版本，不会阻塞事件循环 """
+        connection = self.async_connection
+        ret = await connection.blpop([key], timeout)
+        if not ret:
+            return []
+        result = [ret[1]]
+        if count > 1:
+            result.extend(await connection.lpop(key, count - 1) or [])
+        return result
+
+    @property
+    def async_connection(self):
+        """ 当前事件循环使用的异步连接 """
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            connection = self._async_connections.get(loop)
+            if connection is None:
+                # 已经结束的事件循环没有调用aclose_async_connection时, 在这里释放连接
+                for one in [one for one in self._async_connections if one.is_closed()]:
+                    self._async_connections.pop(one)
+                connection = self._init_async_connection()
+                self._async_connections[loop] = connection
+        return connection
+
+    async def aclose_async_connection(self):
+        """ 事件循环结束前调用, 关闭当前事件循环的异步连接 """
+        with self._async_lock:
+            connection = self._async_connections.pop(asyncio.get_running_loop(), None)
+        if connection is not None:
+            # redis 5.0.1之前没有aclose
+            await getattr(connection, 'aclose', connection.close)()
+
+    def _init_async_connection(self):
+        if isinstance(settings.redis_url, Dict):
+            redis_conf = dict(settings.redis_url)
+            mode = redis_conf.pop('mode', 'sentinel')
+            if mode == 'cluster':
+                cluster_url = ''
+                if 'startup_nodes' in redis_conf:
+                    first_node = redis_conf['startup_nodes'][0]
+                    cluster_url = f'redis://{first_node["host"]}:{first_node["port"]}'
+                    redis_conf['startup_nodes'] = [
+                        AsyncClusterNode(node.get('host'), node.get('port'))
+                        for node in redis_conf['startup_nodes']
+                    ]
+                return aioredis.RedisCluster.from_url(cluster_url, **redis_conf,
+                                                      cluster_error_retry_attempts=1)
+            hosts = [eval(x) for x in redis_conf.pop('sentinel_hosts')]
+            password = redis_conf.pop('sentinel_password')
+            master = redis_conf.pop('sentinel_master')
+            sentinel = AsyncSentinel(sentinels=hosts, socket_timeout=0.1, password=password)
+            # 阻塞读需要等待较长时间，主节点连接不设置socket超时
+            return sentinel.master_for(master, **{**redis_conf, 'socket_timeout': None})
+        # 每个阻塞读会独占一个连接，不限制连接池的大小
+        pool = aioredis.ConnectionPool.from_url(self.url)
+        return aioredis.StrictRedis(connection_pool=pool)
+
     def publish(self, key, value):
         try:
             self.cluster_nodes(key)
@@ -186,6 +310,8 @@ class RedisClient:
 
     def close(self):
         self.connection.close()
+        if self.block_connection is not self.connection:
+            self.block_connection.close()
 
     def __contains__(self, key):
         """Check if the key is in the cache."""
@@ -8,8 +8,9 @@ import tempfile
 from collections import OrderedDict
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, BinaryIO
+from typing import Any, Dict, BinaryIO, Iterator
 from urllib.parse import unquote, urlparse
+from uuid import uuid4
 
 import cchardet
 import requests
@@ -270,6 +271,41 @@ def save_download_file(file_byte, folder_name, filename):
     return str(file_path)
 
 
+@create_cache_folder
+def save_download_stream(stream: Iterator[bytes], folder_name, filename) -> str:
+    """
+    边下载边写入文件并计算hash, 不需要把整个文件读入内存
+    文件命名规则和save_download_file一致
+    """
+    folder_path = Path(CACHE_DIR) / folder_name
+    if not folder_path.exists():
+        folder_path.mkdir()
+
+    sha256_hash = hashlib.sha256()
+    tmp_file_path = folder_path / f'{uuid4().hex}.tmp'
+    try:
+        with open(tmp_file_path, 'wb') as new_file:
+            for chunk in stream:
+                sha256_hash.update(chunk)
+                new_file.write(chunk)
+        file_path = folder_path / f'{sha256_hash.hexdigest()}_{filename}'
+        os.replace(tmp_file_path, file_path)
+    finally:
+        if tmp_file_path.exists():
+            tmp_file_path.unlink()
+    return str(file_path)
+
+
+def minio_file_download(minio_client: MinioClient, bucket_name: str, object_name: str):
+    """ 直接从minio流式下载文件, 不需要通过分享链接再下载一次 """
+    # 和get_share_link一致, 去掉开头的 /
+    object_name = object_name.lstrip('/')
+    filename = os.path.basename(object_name)
+    file_path = save_download_stream(minio_client.get_object_stream(bucket_name, object_name), 'bisheng',
+                                     filename)
+    return file_path, filename
+
+
 def file_download(file_path: str):
     """download file and return path"""
     if not os.path.isfile(file_path) and _is_valid_url(file_path):
@@ -67,7 +67,8 @@ class ChatClient:
                                    trace_id,
                                    self.handle_gpts_message,
                                    message,
-                                   trace_id=trace_id)
+                                   trace_id=trace_id,
+                                   keep_result=False)
                 # await self.handle_gpts_message(message)
 
     async def wrapper_task(self, task_id: str, fn: Callable, *args, **kwargs):
@@ -151,7 +152,8 @@ class ChatClient:
             if self.chat_id and self.gpts_agent is None:
                 # 会话业务agent通过数据库数据固定生成,不用每次变化
                 self.gpts_agent = AssistantAgent(assistant, self.chat_id)
-                await self.gpts_agent.init_assistant(self.gpts_async_callback)
+                # 复用进程内缓存的助手组件, 回调在运行时传入
+                await self.gpts_agent.init_assistant(self.gpts_async_callback, use_cache=True)
             elif not self.chat_id:
                 # 调试界面每次都重新生成
                 self.gpts_agent = AssistantAgent(assistant, self.chat_id)
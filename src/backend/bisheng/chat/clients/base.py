@@ -61,7 +61,8 @@ class BaseClient(ABC):
                                trace_id,
                                self._handle_message,
                                message,
-                               trace_id=trace_id)
+                               trace_id=trace_id,
+                               keep_result=False)
 
     @abstractmethod
     async def _handle_message(self, message: Dict[any, any]):
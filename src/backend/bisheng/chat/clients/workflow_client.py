@@ -1,4 +1,3 @@
-import asyncio
 import json
 import time
 import uuid
@@ -17,7 +16,7 @@ from bisheng.chat.clients.base import BaseClient
 from bisheng.chat.types import WorkType
 from bisheng.database.models.message import ChatMessageDao, ChatMessage, ChatMessageType
 from bisheng.worker.workflow.redis_callback import RedisCallback
-from bisheng.worker.workflow.tasks import execute_workflow
+from bisheng.worker.workflow.tasks import execute_workflow, resume_workflow
 from bisheng.workflow.common.workflow import WorkflowStatus
 
 
@@ -160,11 +159,12 @@ class WorkflowClient(BaseClient):
 
 
     async def workflow_run(self):
-        # 需要不断从redis中获取workflow返回的消息
+        # 阻塞读取workflow返回的消息，有消息时立即推送，workflow结束时会收到状态变化的通知
+        status_changed = False
         while True:
             if not self.workflow:
                 break
-            status_info = self.workflow.get_workflow_status()
+            status_info = self.workflow.get_workflow_status(user_cache=not status_changed)
             if not status_info:
                 await self.send_response('error', 'over', {'code': 500, 'message': 'workflow status not found'})
                 await self.send_response('processing', 'close', '')
@@ -203,12 +203,14 @@ class WorkflowClient(BaseClient):
                 await self.send_response('processing', 'close', '')
                 self.workflow.clear_workflow_status()
                 break
+            elif (status_info.get('deadline') and time.time() > status_info['deadline']
+                  and self.workflow.check_input_timeout()):
+                # 挂起等待用户输入超时, 下一轮读取到失败状态后通知前端
+                status_changed = True
             else:
-                chat_response = self.workflow.get_workflow_response()
-                if not chat_response:
-                    await asyncio.sleep(1)
-                    continue
-                await self.send_json(chat_response)
+                chat_responses, status_changed = await self.workflow.aget_workflow_responses()
+                for chat_response in chat_responses:
+                    await self.send_json(chat_response)
 
         logger.debug('workflow run over')
 
@@ -221,6 +223,9 @@ class WorkflowClient(BaseClient):
         if status_info['status'] != WorkflowStatus.INPUT.value:
             logger.warning('workflow is not input status')
             return
+        if self.workflow.check_input_timeout():
+            logger.warning('workflow wait user input timeout')
+            return
         user_input = {}
         for node_id, node_info in data.items():
             user_input[node_id] = node_info['data']
@@ -238,3 +243,6 @@ class WorkflowClient(BaseClient):
                                                           chat_id=self.chat_id,
                                                           user_id=self.user_id))
         self.workflow.set_user_input(user_input)
+        if self.workflow.is_workflow_suspended():
+            # workflow已挂起，发起新的异步任务恢复执行
+            resume_workflow.delay(self.workflow.unique_id, self.workflow.workflow_id, self.chat_id, str(self.user_id))
@@ -1,11 +1,12 @@
 import asyncio
 import concurrent.futures
+import functools
 import json
 import time
 import uuid
 from collections import defaultdict
 from queue import Queue
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from uuid import UUID
 
 from websockets.exceptions import ConnectionClosedError
@@ -19,6 +20,7 @@ from bisheng.cache.flow import InMemoryCache
 from bisheng.cache.manager import Subject
 from bisheng.chat.client import ChatClient
 from bisheng.chat.clients.workflow_client import WorkflowClient
+from bisheng.chat.message_sink import chat_message_sink
 from bisheng.chat.types import IgnoreException, WorkType
 from bisheng.chat.utils import process_node_data
 from bisheng.database.base import session_getter
@@ -45,12 +47,15 @@ class ChatHistory(Subject):
         client_id: str,
         chat_id: str,
         message: ChatMessage,
-    ):
-        """Add a message to the chat history."""
+    ) -> Optional[concurrent.futures.Future]:
+        """Add a message to the chat history.
+        消息异步写入数据库, 返回的future结果为消息id, 不需要持久化的消息返回None
+        """
         t1 = time.time()
         from bisheng.database.models.message import ChatMessage
         message.flow_id = client_id
         message.chat_id = chat_id
+        future = None
         if chat_id and (message.message or message.intermediate_steps
                         or message.files) and message.type != 'stream':
             msg = message.copy()
@@ -59,14 +64,17 @@ class ChatHistory(Subject):
             msg.__dict__.pop('files')
             db_message = ChatMessage(files=files, **msg.__dict__)
             logger.info(f'chat={db_message} time={time.time() - t1}')
-            with session_getter() as seesion:
-                seesion.add(db_message)
-                seesion.commit()
-                seesion.refresh(db_message)
-                message.message_id = db_message.id
+            future = chat_message_sink.put(db_message)
+            future.add_done_callback(functools.partial(self._set_message_id, message))
 
         if not isinstance(message, FileResponse):
             self.notify()
+        return future
+
+    @staticmethod
+    def _set_message_id(message: ChatMessage, future: concurrent.futures.Future):
+        if not future.exception():
+            message.message_id = future.result()
 
     def empty_history(self, client_id: str, chat_id: str):
         """Empty the chat history for a client."""
@@ -129,7 +137,10 @@ class ChatManager:
         websocket = self.active_connections[get_cache_key(client_id, chat_id)]
         # 增加消息记录
         if add:
-            self.chat_history.add_message(client_id, chat_id, message)
+            future = self.chat_history.add_message(client_id, chat_id, message)
+            if future:
+                # 等待批量写入返回消息id, 不阻塞事件循环
+                message.message_id = await asyncio.wrap_future(future)
         await websocket.send_json(message.dict())
 
     async def close_connection(self,
@@ -285,12 +296,23 @@ class ChatManager:
             'type': 'end',
             'category': 'system'
         }
+        receive_task = None
         try:
             while True:
-                try:
-                    json_payload_receive = await asyncio.wait_for(websocket.receive_json(),
-                                                                  timeout=2.0)
-                except asyncio.TimeoutError:
+                # 同时等待客户端消息和任务完成, 任务完成后立即处理, 不需要等到接收超时
+                if receive_task is None:
+                    receive_task = asyncio.create_task(websocket.receive_json())
+                complete_task = asyncio.create_task(thread_pool.wait_completed(key_list, timeout=2.0))
+                await asyncio.wait({receive_task, complete_task}, return_when=asyncio.FIRST_COMPLETED)
+                if complete_task.done():
+                    # 已经从线程池取出的结果先处理, 后面处理消息时可能continue
+                    await self._process_complete(complete_task.result(), context_dict, base_param)
+                else:
+                    complete_task.cancel()
+                if receive_task.done():
+                    json_payload_receive = receive_task.result()
+                    receive_task = None
+                else:
                     json_payload_receive = ''
                 try:
                     payload = json.loads(json_payload_receive) if json_payload_receive else {}
@@ -341,33 +363,8 @@ class ChatManager:
                                                              **process_param)
 
                 # 处理任务状态
-                complete_normal = await thread_pool.as_completed(key_list)
-                complete = complete_normal
-                # if async_task and async_task.done():
-                #     logger.debug(f'async_task_complete result={async_task.result}')
-                if complete:
-                    for future_key, future in complete:
-                        try:
-                            future.result()
-                            logger.debug('task_complete key={}', future_key)
-                        except Exception as e:
-                            if isinstance(e, concurrent.futures.CancelledError):
-                                continue
-                            logger.exception('feature_key={} {}', future_key, e)
-                            erro_resp = ChatResponse(**base_param)
-                            context = context_dict.get(future_key)
-                            if context.get('status') == 'init':
-                                erro_resp.intermediate_steps = f'LLM 技能执行错误. error={str(e)}'
-                            elif context.get('has_file'):
-                                erro_resp.intermediate_steps = f'文档解析失败，点击输入框上传按钮重新上传\n\n{str(e)}'
-                            else:
-                                erro_resp.intermediate_steps = f'Input data is parsed fail. error={str(e)}'
-                            context['status'] = 'init'
-                            await self.send_json(context.get('flow_id'), context.get('chat_id'),
-                                                 erro_resp)
-                            erro_resp.type = 'close'
-                            await self.send_json(context.get('flow_id'), context.get('chat_id'),
-                                                 erro_resp)
+                await self._process_complete(await thread_pool.as_completed(key_list), context_dict,
+                                             base_param)
         except WebSocketDisconnect as e:
             logger.info(f'act=rcv_client_disconnect {str(e)}')
         except Exception as e:
@@ -380,6 +377,8 @@ class ChatManager:
                                         key_list=key_list)
 
         finally:
+            if receive_task is not None:
+                receive_task.cancel()
             thread_pool.cancel_task(key_list)  # 将进行中的任务进行cancel
             try:
                 await self.close_connection(flow_id=flow_id,
@@ -488,6 +487,29 @@ class ChatManager:
             context.update({'status': status_})
             context.update({'payload': {}})  # clean message
 
+    async def _process_complete(self, complete: list, context_dict: dict, base_param: dict):
+        """ 处理已完成的任务, 任务异常时返回错误信息给客户端 """
+        for future_key, future in complete:
+            try:
+                future.result()
+                logger.debug('task_complete key={}', future_key)
+            except Exception as e:
+                if isinstance(e, concurrent.futures.CancelledError):
+                    continue
+                logger.exception('feature_key={} {}', future_key, e)
+                erro_resp = ChatResponse(**base_param)
+                context = context_dict.get(future_key)
+                if context.get('status') == 'init':
+                    erro_resp.intermediate_steps = f'LLM 技能执行错误. error={str(e)}'
+                elif context.get('has_file'):
+                    erro_resp.intermediate_steps = f'文档解析失败，点击输入框上传按钮重新上传\n\n{str(e)}'
+                else:
+                    erro_resp.intermediate_steps = f'Input data is parsed fail. error={str(e)}'
+                context['status'] = 'init'
+                await self.send_json(context.get('flow_id'), context.get('chat_id'), erro_resp)
+                erro_resp.type = 'close'
+                await self.send_json(context.get('flow_id'), context.get('chat_id'), erro_resp)
+
     def preper_reuse_connection(self, flow_id: str, chat_id: str, websocket: WebSocket):
         # 设置复用的映射关系
         message = ''
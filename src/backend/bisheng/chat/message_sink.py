@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from prometheus_client import Gauge
+
+from bisheng.database.models.message import ChatMessage, ChatMessageDao
+
+# 等待写入数据库的消息数
+message_queue_depth = Gauge('bisheng_chat_message_queue_depth', 'chat messages waiting to be written to database')
+
+
+class ChatMessageSink:
+    """
+    聊天消息的异步写入
+    消息先放入队列, 后台线程按时间间隔或者数量阈值把多条消息合并成一次多行insert
+    调用方通过返回的future拿到消息id, websocket的事件循环不需要等待数据库
+    """
+
+    def __init__(self, max_batch_size: int = 100, flush_interval: float = 0.02):
+        # 单次insert的最大消息数
+        self.max_batch_size = max_batch_size
+        # 收到第一条消息后最多等待多久再写入(单位：秒)
+        self.flush_interval = flush_interval
+
+        self._queue: Queue[Optional[Tuple[ChatMessage, Future]]] = Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def put(self, message: ChatMessage) -> Future:
+        """ 放入待写入的消息, future的结果是消息id """
+        future = Future()
+        with self._lock:
+            if not self._closed:
+                self._ensure_started()
+                self._queue.put((message, future))
+                message_queue_depth.set(self._queue.qsize())
+                return future
+        # 已经关闭, 直接同步写入避免丢消息
+        self._write([(message, future)])
+        return future
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='chat_message_sink', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            message_queue_depth.set(self._queue.qsize())
+            self._write(batch)
+
+    @classmethod
+    def _write(cls, batch: List[Tuple[ChatMessage, Future]]):
+        start = time.time()
+        try:
+            ids = ChatMessageDao.insert_batch_return_ids([one[0] for one in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                logger.exception(f'write chat message error: {e}')
+                batch[0][1].set_exception(e)
+                return
+            logger.warning(f'write chat message batch error, retry one by one num={len(batch)}: {e}')
+            ids = None
+        if ids is None:
+            # 某一条消息写入失败时整批回滚, 逐条重试, 只让真正失败的消息返回异常
+            for one in batch:
+                cls._write([one])
+            return
+        logger.debug(f'write chat message num={len(batch)} time={time.time() - start}')
+        for (message, future), message_id in zip(batch, ids):
+            message.id = message_id
+            future.set_result(message_id)
+
+    def close(self, timeout: float = 10):
+        """ 服务退出时调用, 写完队列里剩余的消息 """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(None)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning(f'chat message sink not finished, remaining={self.queue_depth}')
+        message_queue_depth.set(self._queue.qsize())
+
+
+chat_message_sink = ChatMessageSink()
@@ -3,7 +3,7 @@ from typing import Dict, List
 import yaml
 from bisheng.database.models.config import Config
 from bisheng.database.base import session_getter
-from bisheng.settings import parse_key, read_from_conf
+from bisheng.settings import parse_key, read_from_conf, settings
 from bisheng.utils.logger import logger
 from sqlmodel import select
 
@@ -28,6 +28,7 @@ def init_config():
                 db_config = Config(key=all_config_key, value=new_config_content)
                 session.add(db_config)
                 session.commit()
+                settings.update_config_version()
             except Exception as e:
                 logger.exception(e)
                 session.rollback()
@@ -21,6 +21,8 @@ from bisheng.database.models.flow_version import FlowVersion
 from bisheng.database.models.user_role import UserRoleDao
 from bisheng.database.models.group import Group, DefaultGroup
 from bisheng.database.models.role_access import RoleAccess, AccessType
+# 只在celery任务里使用的表, 显式导入保证建表时已经注册到metadata
+from bisheng.database.models.workflow_checkpoint import WorkflowCheckpoint  # noqa: F401
 
 
 def init_default_data():
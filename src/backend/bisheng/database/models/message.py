@@ -9,7 +9,7 @@ from bisheng.database.base import session_getter
 from bisheng.database.models.base import SQLModelSerializable
 from loguru import logger
 from pydantic import BaseModel
-from sqlalchemy import JSON, Column, DateTime, String, Text, case, func, or_, text, update
+from sqlalchemy import JSON, Column, DateTime, String, Text, case, func, insert, or_, text, update
 from sqlmodel import Field, delete, select
 
 
@@ -243,6 +243,42 @@ class ChatMessageDao(MessageBase):
             session.add_all(messages)
             session.commit()
 
+    @classmethod
+    def insert_batch_return_ids(cls, messages: List[ChatMessage]) -> List[int]:
+        """
+        多条消息合并成一条多行insert写入, 按顺序返回每条消息的id
+        支持RETURNING的数据库直接返回id; mysql上多行insert values属于simple insert,
+        这张表没有insert ... select等bulk insert, 各种innodb_autoinc_lock_mode下同一条语句生成的自增id
+        都是连续的(间隔为auto_increment_increment), lastrowid是第一行的id
+        """
+        if not messages:
+            return []
+        table = ChatMessage.__table__
+        # 所有消息都没有赋值的字段使用数据库的默认值
+        columns = [
+            column.name for column in table.columns
+            if not column.primary_key and (column.server_default is None or any(
+                getattr(one, column.name) is not None for one in messages))
+        ]
+        rows = [{column: getattr(one, column) for column in columns} for one in messages]
+        with session_getter() as session:
+            dialect = session.bind.dialect
+            if getattr(dialect, 'insert_executemany_returning_sort_by_parameter_order', False):
+                result = session.exec(
+                    insert(table).returning(table.c.id, sort_by_parameter_order=True), params=rows)
+                ids = [one[0] for one in result]
+            elif dialect.name == 'mysql':
+                result = session.exec(insert(table).values(rows))
+                step = session.exec(text('SELECT @@auto_increment_increment')).scalar()
+                ids = [result.lastrowid + index * step for index in range(len(messages))]
+            else:
+                # 其他数据库由orm逐行insert拿到id
+                session.add_all(messages)
+                session.flush()
+                ids = [one.id for one in messages]
+            session.commit()
+        return ids
+
     @classmethod
     def get_message_by_id(cls, message_id: int) -> Optional[ChatMessage]:
         with session_getter() as session:
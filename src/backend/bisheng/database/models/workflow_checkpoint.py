@@ -0,0 +1,77 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, DateTime, LargeBinary, String, UniqueConstraint, func, text
+from sqlalchemy.dialects.mysql import LONGBLOB
+from sqlmodel import Field, delete, select
+
+from bisheng.database.base import session_getter
+from bisheng.database.models.base import SQLModelSerializable
+
+
+class WorkflowCheckpointBase(SQLModelSerializable):
+    thread_id: str = Field(sa_column=Column(String(length=128), nullable=False, index=True),
+                           description='workflow运行的唯一ID')
+    field: str = Field(sa_column=Column(String(length=255), nullable=False), description='状态的字段名')
+    value: bytes = Field(sa_column=Column(LargeBinary().with_variant(LONGBLOB, 'mysql'), nullable=False),
+                         description='序列化后的状态数据')
+    create_time: Optional[datetime] = Field(
+        sa_column=Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP')))
+    update_time: Optional[datetime] = Field(
+        sa_column=Column(DateTime,
+                         nullable=False,
+                         index=True,
+                         server_default=text('CURRENT_TIMESTAMP'),
+                         onupdate=text('CURRENT_TIMESTAMP')))
+
+
+class WorkflowCheckpoint(WorkflowCheckpointBase, table=True):
+    __table_args__ = (UniqueConstraint('thread_id', 'field', name='thread_id_field_uniq'),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+
+class WorkflowCheckpointDao(WorkflowCheckpointBase):
+
+    @classmethod
+    def get_fields(cls, thread_id: str) -> Dict[str, bytes]:
+        return {one.field: one.value for one in cls.get_rows(thread_id)}
+
+    @classmethod
+    def get_rows(cls, thread_id: str) -> List[WorkflowCheckpoint]:
+        with session_getter() as session:
+            statement = select(WorkflowCheckpoint).where(WorkflowCheckpoint.thread_id == thread_id)
+            return session.exec(statement).all()
+
+    @classmethod
+    def upsert_fields(cls, thread_id: str, items: Dict[str, bytes]):
+        """ 一次事务内写入多个字段，已存在的字段覆盖 """
+        with session_getter() as session:
+            statement = select(WorkflowCheckpoint).where(WorkflowCheckpoint.thread_id == thread_id,
+                                                         WorkflowCheckpoint.field.in_(list(items.keys())))
+            exists = {one.field: one for one in session.exec(statement).all()}
+            for field, value in items.items():
+                if field in exists:
+                    exists[field].value = value
+                    session.add(exists[field])
+                else:
+                    session.add(WorkflowCheckpoint(thread_id=thread_id, field=field, value=value))
+            session.commit()
+
+    @classmethod
+    def delete_thread(cls, thread_id: str):
+        with session_getter() as session:
+            session.exec(delete(WorkflowCheckpoint).where(WorkflowCheckpoint.thread_id == thread_id))
+            session.commit()
+
+    @classmethod
+    def delete_expired(cls, before: datetime) -> int:
+        """ 删除最新update_time早于before的thread的所有行，返回删除的行数
+        put只写变化的字段，同一个thread里未变化的行update_time较早，不能按行删除 """
+        expired = select(WorkflowCheckpoint.thread_id).group_by(WorkflowCheckpoint.thread_id).having(
+            func.max(WorkflowCheckpoint.update_time) < before).subquery()
+        with session_getter() as session:
+            # mysql不允许delete的子查询直接查询同一张表，多包一层派生表
+            result = session.exec(
+                delete(WorkflowCheckpoint).where(WorkflowCheckpoint.thread_id.in_(select(expired.c.thread_id))))
+            session.commit()
+            return result.rowcount
@@ -32,6 +32,9 @@ from copy import deepcopy
 from huggingface_hub import snapshot_download
 
 class RAGFlowPdfParser:
+    # 待识别的文本框达到这个数量时批量识别一次, 限制跨页攒批时占用的内存
+    ocr_batch_crops = 256
+
     def __init__(self):
         self.ocr = OCR()
         if hasattr(self, "model_speciess"):
@@ -275,7 +278,9 @@ class RAGFlowPdfParser:
                 b["SP"] = ii
 
     def __ocr(self, pagenum, img, chars, ZM=3):
-        bxs = self.ocr.detect(np.array(img))
+        # 页面图片只转换一次, 检测和裁剪文本框共用
+        img = np.array(img)
+        bxs = self.ocr.detect(img)
         if not bxs:
             self.boxes.append([])
             return
@@ -306,19 +311,35 @@ class RAGFlowPdfParser:
             else:
                 bxs[ii]["text"] += c["text"]
 
+        # 没有内嵌文字的文本框先裁剪出来, 攒够一批后和其他页面的一起识别
         for b in bxs:
             if not b["text"]:
                 left, right, top, bott = b["x0"] * ZM, b["x1"] * \
                                          ZM, b["top"] * ZM, b["bottom"] * ZM
-                b["text"] = self.ocr.recognize(np.array(img),
-                                               np.array([[left, top], [right, top], [right, bott], [left, bott]],
-                                                        dtype=np.float32))
-            del b["txt"]
-        bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[-1] == 0:
-            self.mean_height[-1] = np.median([b["bottom"] - b["top"]
-                                              for b in bxs])
+                self.ocr_pending_crops.append((b, self.ocr.get_rotate_crop_image(
+                    img, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))))
+        self.ocr_pending_pages.append((len(self.boxes), pagenum))
         self.boxes.append(bxs)
+        if len(self.ocr_pending_crops) >= self.ocr_batch_crops:
+            self.__ocr_flush()
+
+    def __ocr_flush(self):
+        """ 批量识别所有待识别的文本框, 然后完成这些页面的处理 """
+        if self.ocr_pending_crops:
+            texts = self.ocr.recognize_batch([crop for _, crop in self.ocr_pending_crops])
+            for (b, _), text in zip(self.ocr_pending_crops, texts):
+                b["text"] = text
+        for index, pagenum in self.ocr_pending_pages:
+            bxs = self.boxes[index]
+            for b in bxs:
+                del b["txt"]
+            bxs = [b for b in bxs if b["text"]]
+            if self.mean_height[pagenum - 1] == 0:
+                self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"]
+                                                           for b in bxs])
+            self.boxes[index] = bxs
+        self.ocr_pending_crops = []
+        self.ocr_pending_pages = []
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
@@ -941,6 +962,8 @@ class RAGFlowPdfParser:
     def __images__(self, fnm, zoomin=3, page_from=0,
                    page_to=299, callback=None):
         self.lefted_chars = []
+        self.ocr_pending_crops = []
+        self.ocr_pending_pages = []
         self.mean_height = []
         self.mean_width = []
         self.boxes = []
@@ -1016,6 +1039,7 @@ class RAGFlowPdfParser:
             self.__ocr(i + 1, img, chars, zoomin*2)
             if callback and i % 6 == 5:
                 callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
+        self.__ocr_flush()
         # print("OCR:", timer()-st)
 
         if not self.is_english and not any(
@@ -578,6 +578,16 @@ class OCR(object):
             return ""
         return text
 
+    def recognize_batch(self, img_list):
+        """
+        Recognize many cropped text images at once, the recognizer sorts them by
+        aspect ratio and runs them in batches of rec_batch_num.
+        """
+        if not img_list:
+            return []
+        rec_res, elapse = self.text_recognizer(img_list)
+        return [text if score >= self.drop_score else "" for text, score in rec_res]
+
     def __call__(self, img, cls=True):
         time_dict = {'det': 0, 'rec': 0, 'cls': 0, 'all': 0}
 
@@ -1,10 +1,13 @@
 from typing import List, Optional
 
 import numpy as np
+from bisheng.cache.embedding import get_embedding_cache
 from bisheng.database.models.llm_server import (LLMDao, LLMModel, LLMModelType, LLMServer,
                                                 LLMServerType)
 from bisheng.interface.importing import import_by_type
+from bisheng.interface.model_telemetry import model_status_tracker
 from bisheng.interface.utils import wrapper_bisheng_model_limit_check
+from bisheng.utils.embedding import normalize_embeddings
 from langchain.embeddings.base import Embeddings
 from langchain_core.pydantic_v1 import BaseModel
 from loguru import logger
@@ -152,18 +155,27 @@ class BishengEmbedding(BaseModel, Embeddings):
             params['openai_api_key'] = params.pop('openai_api_key', None) or 'EMPTY'
         return params
 
-    @wrapper_bisheng_model_limit_check
+    @property
+    def cache_namespace(self) -> str:
+        """ 缓存key的前缀, 模型id相同但是换了模型时缓存失效 """
+        return f'{self.model_id}:{self.model}'
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """embedding"""
+        return self.embed_documents_array(texts).tolist()
+
+    @wrapper_bisheng_model_limit_check
+    def embed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """ 返回(len(texts), dim)的float32数组, 写入向量库时不需要再转换成列表 """
         try:
             if self.server_info.limit_flag:
                 pass
-            ret = self.embeddings.embed_documents(texts)
-            # 盘单向量是否归一化了
-            if ret:
-                vector = ret[0]
-                if np.linalg.norm(vector) != 1:
-                    ret = [(np.array(doc) / np.linalg.norm(doc)).tolist() for doc in ret]
+            embedding_cache = get_embedding_cache()
+            if embedding_cache and texts:
+                ret = embedding_cache.embed_documents(self.cache_namespace, texts,
+                                                      self._embed_documents)
+            else:
+                ret = self._embed_documents(texts)
             self._update_model_status(0)
             return ret
         except Exception as e:
@@ -175,19 +187,28 @@ class BishengEmbedding(BaseModel, Embeddings):
     def embed_query(self, text: str) -> List[float]:
         """embedding"""
         try:
-            ret = self.embeddings.embed_query(text)
-            if np.linalg.norm(ret) != 1:
-                ret = (np.array(ret) / np.linalg.norm(ret)).tolist()
+            embedding_cache = get_embedding_cache()
+            if embedding_cache:
+                ret = embedding_cache.embed_query(self.cache_namespace, text, self._embed_query)
+            else:
+                ret = self._embed_query(text)
             self._update_model_status(0)
-            return ret
+            return ret.tolist()
         except Exception as e:
             self._update_model_status(1, str(e))
             logger.exception('embedding error')
             raise Exception(f'embedding组件异常，请检查配置或联系管理员。错误信息：{e}')
 
+    def _embed_documents(self, texts: List[str]) -> np.ndarray:
+        """ 调用模型并归一化, 缓存里存的是这里的结果 """
+        return normalize_embeddings(self.embeddings.embed_documents(texts))
+
+    def _embed_query(self, text: str) -> np.ndarray:
+        return normalize_embeddings(self.embeddings.embed_query(text))
+
     def _update_model_status(self, status: int, remark: str = ''):
-        """更新模型状态"""
-        LLMDao.update_model_status(self.model_id, status, remark)
+        """更新模型状态, 状态变化时才异步写入数据库"""
+        model_status_tracker.report(self.model_id, status, remark)
 
 
 CUSTOM_EMBEDDING = {
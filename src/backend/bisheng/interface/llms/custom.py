@@ -15,6 +15,7 @@ from langchain_core.language_models import BaseLanguageModel, BaseChatModel, Lan
 from bisheng.database.models.llm_server import LLMDao, LLMModelType, LLMServerType, LLMModel, LLMServer
 from bisheng.interface.importing import import_by_type
 from bisheng.interface.initialize.loading import instantiate_llm
+from bisheng.interface.model_telemetry import model_status_tracker
 from bisheng.interface.utils import wrapper_bisheng_model_limit_check, wrapper_bisheng_model_limit_check_async
 
 
@@ -163,9 +164,8 @@ class BishengLLM(BaseChatModel):
         return ret
 
     def _update_model_status(self, status: int, remark: str = ''):
-        """更新模型状态"""
-        # todo 接入到异步任务模块
-        LLMDao.update_model_status(self.model_id, status, remark)
+        """更新模型状态, 状态变化时才异步写入数据库"""
+        model_status_tracker.report(self.model_id, status, remark)
 
     def bind_tools(
         self,
@@ -0,0 +1,153 @@
+import atexit
+import datetime
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from prometheus_client import Counter, Histogram
+
+from bisheng.cache.redis import redis_client
+from bisheng.settings import settings
+
+# 模型调用的次数和耗时, 只在内存里累加, 由prometheus定时拉取
+model_request_count = Counter('bisheng_model_requests', 'model calls by result',
+                              ['model_id', 'model_type', 'result'])
+model_request_seconds = Histogram('bisheng_model_request_seconds', 'model call latency',
+                                  ['model_id', 'model_type'],
+                                  buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+
+def record_model_call(model_id: int, model_type: str, success: bool, cost: float):
+    model_request_count.labels(model_id, model_type, 'success' if success else 'failure').inc()
+    model_request_seconds.labels(model_id, model_type).observe(cost)
+
+
+class ModelStatusTracker:
+    """
+    模型的健康状态在变化时写入数据库
+    调用方只更新内存里的状态, 后台线程合并同一个模型的多次变化后异步写入
+    其它进程可能写入了不同的状态, 状态不变时也每隔status_refresh_interval秒重新写入一次
+    """
+
+    def __init__(self):
+        # 本进程最后一次写入的状态 model_id -> (status, remark, 写入时间)
+        self._status: Dict[int, Tuple[int, str, float]] = {}
+        # 等待写入的状态, 同一个模型只保留最新的
+        self._pending: Dict[int, Tuple[int, str]] = {}
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def report(self, model_id: int, status: int, remark: str = ''):
+        with self._lock:
+            pending = self._pending.get(model_id)
+            written = self._status.get(model_id)
+            # 成功的状态不关心remark, 失败时只在从成功变成失败时记录
+            if pending is not None and pending[0] == status:
+                return
+            if pending is None and written is not None and written[0] == status \
+                    and time.time() - written[2] < settings.model_telemetry_conf.status_refresh_interval:
+                return
+            self._pending[model_id] = (status, remark)
+            self._ensure_started()
+        self._event.set()
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='model_status_writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        from bisheng.database.models.llm_server import LLMDao
+
+        while True:
+            self._event.wait()
+            with self._lock:
+                self._event.clear()
+                pending, self._pending = self._pending, {}
+            for model_id, (status, remark) in pending.items():
+                try:
+                    LLMDao.update_model_status(model_id, status, remark)
+                except Exception as e:
+                    logger.exception(f'update model status error model_id={model_id}: {e}')
+                    continue
+                with self._lock:
+                    self._status[model_id] = (status, remark, time.time())
+
+
+class _QuotaLease:
+
+    def __init__(self):
+        self.date = ''
+        # 本进程已经从redis领取但还没有用掉的次数
+        self.tokens = 0
+        # 最后一次领取后, redis里记录的剩余额度
+        self.remaining = None
+        # 额度用完时的限额, 限额没有调整时当天不再访问redis
+        self.exhausted_limit = None
+
+
+class ModelQuota:
+    """
+    按天限制服务提供方的调用次数
+    每个进程一次从redis批量领取一部分额度在本地扣减, 用完再领取, 不再每次调用都访问redis
+    第一次领取不超过限额的1/4, 进程正常退出时把没有用掉的额度还回redis
+    """
+
+    def __init__(self, lease_size: int = None):
+        self._lease_size = lease_size
+        self._leases: Dict[int, _QuotaLease] = {}
+        self._lock = threading.Lock()
+        atexit.register(self.release)
+
+    @property
+    def lease_size(self) -> int:
+        return self._lease_size or settings.model_telemetry_conf.quota_lease_size
+
+    def acquire(self, server_id: int, limit: int):
+        """ 消耗一次调用额度, 额度用完时抛出异常 """
+        today = datetime.datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            lease = self._leases.setdefault(server_id, _QuotaLease())
+            if lease.date != today:
+                # 前一天的额度已经不再使用, 不需要归还
+                lease.date, lease.tokens, lease.remaining, lease.exhausted_limit = today, 0, None, None
+            if lease.tokens <= 0 and lease.exhausted_limit != limit:
+                self._lease(server_id, limit, lease)
+                if lease.tokens <= 0:
+                    lease.exhausted_limit = limit
+            if lease.tokens <= 0:
+                raise Exception('额度已用完')
+            lease.tokens -= 1
+
+    def _lease(self, server_id: int, limit: int, lease: _QuotaLease):
+        # 第一次领取时不知道其它进程用了多少, 按限额的1/4领取; 快用完时减少领取的数量, 避免额度被某个进程占住
+        remaining = limit if lease.remaining is None else lease.remaining
+        size = max(1, min(self.lease_size, remaining // 4))
+        total = redis_client.incr(self._cache_key(lease.date, server_id), expiration=86400, amount=size)
+        used_before = total - size
+        lease.tokens = max(0, min(size, limit - used_before))
+        lease.remaining = max(0, limit - total)
+
+    @staticmethod
+    def _cache_key(date: str, server_id: int) -> str:
+        return f'model_limit:{date}:{server_id}'
+
+    def release(self):
+        """ 把当天领取了但没有用掉的额度还回redis, 进程退出时调用 """
+        today = datetime.datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            for server_id, lease in self._leases.items():
+                if lease.date != today or lease.tokens <= 0:
+                    continue
+                try:
+                    redis_client.incr(self._cache_key(lease.date, server_id), expiration=86400,
+                                      amount=-lease.tokens)
+                    lease.tokens = 0
+                except Exception as e:
+                    logger.warning(f'release model quota error server_id={server_id}: {e}')
+
+
+model_status_tracker = ModelStatusTracker()
+model_quota = ModelQuota()
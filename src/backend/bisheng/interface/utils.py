@@ -1,16 +1,16 @@
 import base64
-import datetime
 import functools
 import inspect
 import json
 import os
 import re
+import time
 from io import BytesIO
 
 import yaml
 
-from bisheng.cache.redis import redis_client
 from bisheng.chat.config import ChatConfig
+from bisheng.interface.model_telemetry import model_quota, record_model_call
 from bisheng.settings import settings
 from bisheng.utils.logger import logger
 from langchain.base_language import BaseLanguageModel
@@ -94,36 +94,51 @@ def set_langchain_cache(settings):
 
 
 def bisheng_model_limit_check(self: 'BishengLLM | BishengEmbedding'):
-    now = datetime.datetime.now().strftime("%Y-%m-%d")
     if self.server_info.limit_flag:
-        # 开启了调用次数检查
-        cache_key = f"model_limit:{now}:{self.server_info.id}"
-        use_num = redis_client.incr(cache_key)
-        if use_num > self.server_info.limit:
-            raise Exception(f'额度已用完')
+        # 开启了调用次数检查, 额度在本地批量扣减
+        model_quota.acquire(self.server_info.id, self.server_info.limit)
+
+
+def _record_model_call(self: 'BishengLLM | BishengEmbedding', success: bool, start: float):
+    model_type = self.model_info.model_type if self.model_info else ''
+    record_model_call(self.model_id, model_type, success, time.perf_counter() - start)
 
 
 def wrapper_bisheng_model_limit_check_async(func):
     """
-    调用次数检查的装饰器
+    调用次数检查的装饰器, 同时记录调用的结果和耗时
     """
 
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
         bisheng_model_limit_check(args[0])
-        return await func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            ret = await func(*args, **kwargs)
+        except Exception:
+            _record_model_call(args[0], False, start)
+            raise
+        _record_model_call(args[0], True, start)
+        return ret
 
     return wrapper
 
 
 def wrapper_bisheng_model_limit_check(func):
     """
-    调用次数检查的装饰器
+    调用次数检查的装饰器, 同时记录调用的结果和耗时
     """
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         bisheng_model_limit_check(args[0])
-        return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            ret = func(*args, **kwargs)
+        except Exception:
+            _record_model_call(args[0], False, start)
+            raise
+        _record_model_call(args[0], True, start)
+        return ret
 
     return wrapper
@@ -4,6 +4,7 @@ from typing import Optional
 import subprocess
 
 from bisheng.api import router, router_rpc
+from bisheng.chat.message_sink import chat_message_sink
 from bisheng.database.init_data import init_default_data
 from bisheng.interface.utils import setup_llm_caching
 from bisheng.restructure.register import register_restructure
@@ -62,6 +63,8 @@ async def lifespan(app: FastAPI):
     yield
     teardown_services()
     thread_pool.tear_down()
+    # 写完还在队列里的聊天消息
+    chat_message_sink.close()
 
 
 def create_app():
@@ -13,6 +13,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import hashlib
 import re
 import threading
 from urllib.parse import urljoin
@@ -25,6 +26,7 @@ import numpy as np
 
 from bisheng.api import settings
 from bisheng.api.util.file_utils import get_home_cache_dir
+from bisheng.cache.flow import InMemoryCache
 from bisheng.rag.utils import num_tokens_from_string, truncate
 import json
 
@@ -41,9 +43,17 @@ class Base(ABC):
         raise NotImplementedError("Please implement encode method!")
 
 
+def text_hash(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
 class DefaultRerank(Base):
     _model = None
     _model_lock = threading.Lock()
+    # 翻页检索时同样的(问题, 分块)会重复打分, 按 模型名+问题+分块 的hash缓存分数
+    score_cache = InMemoryCache(max_size=100000)
+    # 每批送入模型的token数上限, 按 条数 * 这一批里最长的长度 计算, 包括padding
+    batch_tokens = 65536
 
     def __init__(self, key, model_name, **kwargs):
         """
@@ -73,22 +83,54 @@ class DefaultRerank(Base):
                                                       local_dir_use_symlinks=False)
                         DefaultRerank._model = FlagReranker(model_dir, use_fp16=torch.cuda.is_available())
         self._model = DefaultRerank._model
+        self.model_name = model_name
 
     def similarity(self, query: str, texts: list):
-        pairs = [(query, truncate(t, 2048)) for t in texts]
-        token_count = 0
-        for _, t in pairs:
-            token_count += num_tokens_from_string(t)
-        batch_size = 4096
-        res = []
-        for i in range(0, len(pairs), batch_size):
-            scores = self._model.compute_score(pairs[i:i + batch_size], max_length=2048)
-            scores = sigmoid(np.array(scores)).tolist()
-            if isinstance(scores, float):
-                res.append(scores)
-            else:
-                res.extend(scores)
-        return np.array(res), token_count
+        return self.cached_similarity(query, texts, 2048)
+
+    def cached_similarity(self, query: str, texts: list, max_length: int):
+        """
+        只计算没有缓存的分块, 按长度排序后按token数分批, 减少padding, 返回的分数和texts的顺序一致
+        返回的token数只包括这次实际送入模型的分块
+        """
+        query_hash = text_hash(query)
+        res = np.zeros(len(texts), dtype=float)
+        # 没有缓存的分块, 相同的分块只计算一次: 缓存key -> (分块, 长度, 在texts里的位置)
+        todo = {}
+        for i, t in enumerate(texts):
+            t = truncate(t, max_length)
+            key = (self.model_name, query_hash, text_hash(t))
+            if key in todo:
+                todo[key][2].append(i)
+                continue
+            score = self.score_cache.get(key)
+            if score is not None:
+                res[i] = score
+                continue
+            todo[key] = (t, num_tokens_from_string(t), [i])
+
+        token_count = sum(length for _, length, _ in todo.values())
+        query_tokens = num_tokens_from_string(query)
+        batch = []
+        for key in sorted(todo, key=lambda k: todo[k][1]):
+            # 按长度升序, 这一批都会padding到最后加入的这一条的长度
+            length = min(query_tokens + todo[key][1], max_length)
+            if batch and (len(batch) + 1) * length > self.batch_tokens:
+                self.score_batch(query, batch, todo, res, max_length)
+                batch = []
+            batch.append(key)
+        if batch:
+            self.score_batch(query, batch, todo, res, max_length)
+        return res, token_count
+
+    def score_batch(self, query: str, batch: list, todo: dict, res: np.ndarray, max_length: int):
+        scores = self._model.compute_score([(query, todo[key][0]) for key in batch], max_length=max_length)
+        scores = sigmoid(np.array(scores)).tolist()
+        if isinstance(scores, float):
+            scores = [scores]
+        for key, score in zip(batch, scores):
+            self.score_cache.set(key, score)
+            res[todo[key][2]] = score
 
 
 class JinaRerank(Base):
@@ -119,6 +161,8 @@ class JinaRerank(Base):
 class YoudaoRerank(DefaultRerank):
     _model = None
     _model_lock = threading.Lock()
+    # 和原来每批8条、每条最长512的显存占用相当
+    batch_tokens = 4096
 
     def __init__(self, key=None, model_name="maidalun1020/bce-reranker-base_v1", **kwargs):
         if not settings.LIGHTEN and not YoudaoRerank._model:
@@ -135,22 +179,10 @@ class YoudaoRerank(DefaultRerank):
                                 "maidalun1020", "InfiniFlow"))
 
         self._model = YoudaoRerank._model
+        self.model_name = model_name
 
     def similarity(self, query: str, texts: list):
-        pairs = [(query, truncate(t, self._model.max_length)) for t in texts]
-        token_count = 0
-        for _, t in pairs:
-            token_count += num_tokens_from_string(t)
-        batch_size = 8
-        res = []
-        for i in range(0, len(pairs), batch_size):
-            scores = self._model.compute_score(pairs[i:i + batch_size], max_length=self._model.max_length)
-            scores = sigmoid(np.array(scores)).tolist()
-            if isinstance(scores, float):
-                res.append(scores)
-            else:
-                res.extend(scores)
-        return np.array(res), token_count
+        return self.cached_similarity(query, texts, self._model.max_length)
 
 
 class XInferenceRerank(Base):
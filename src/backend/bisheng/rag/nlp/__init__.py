@@ -246,8 +246,17 @@ def tokenize(d, t, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
+def tokenize_docs(docs, texts, eng):
+    """ 和逐个调用 tokenize 的结果相同, 分块多时用多进程分词 """
+    cleaned = [re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t) for t in texts]
+    for d, t, (ltks, sm_ltks) in zip(docs, texts, rag_tokenizer.tokenize_batch(cleaned, fine_grained=True)):
+        d["content_with_weight"] = t
+        d["content_ltks"] = ltks
+        d["content_sm_ltks"] = sm_ltks
+
+
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
-    res = []
+    res, texts = [], []
     # wrap up as es documents
     for ck in chunks:
         if len(ck.strip()) == 0:continue
@@ -260,21 +269,23 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
                 ck = pdf_parser.remove_tag(ck)
             except NotImplementedError:
                 pass
-        tokenize(d, ck, eng)
+        texts.append(ck)
         res.append(d)
+    tokenize_docs(res, texts, eng)
     return res
 
 
 def tokenize_chunks_docx(chunks, doc, eng, images):
-    res = []
+    res, texts = [], []
     # wrap up as es documents
     for ck, image in zip(chunks, images):
         if len(ck.strip()) == 0:continue
         logging.debug("-- {}".format(ck))
         d = copy.deepcopy(doc)
         d["image"] = image
-        tokenize(d, ck, eng)
+        texts.append(ck)
         res.append(d)
+    tokenize_docs(res, texts, eng)
     return res
 
 
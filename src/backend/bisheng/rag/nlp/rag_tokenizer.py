@@ -14,20 +14,87 @@
 #  limitations under the License.
 #
 
+import atexit
 import logging
-import copy
 import datrie
+import glob
+import hashlib
 import math
+import multiprocessing
 import os
 import re
 import string
 import sys
-from hanziconv import HanziConv
+import threading
+from functools import partial
+from multiprocessing.context import TimeoutError as PoolTimeoutError
+from hanziconv.charmap import simplified_charmap, traditional_charmap
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
 from bisheng.api.util.file_utils import get_project_base_directory
 
 
+# 全角转半角: 全角空格和 0xff00-0xff5e 转成对应的半角字符, 其它字符不变
+Q2B_TABLE = {0x3000: 0x20, **{c: c - 0xfee0 for c in range(0xff00, 0xff5f)}}
+# 繁体转简体, 和 HanziConv.toSimplified 一样逐字替换, 一个字在字符表里出现多次时以第一次为准
+T2S_TABLE = {ord(t): ord(s) for t, s in reversed(list(zip(traditional_charmap, simplified_charmap)))}
+
+# 少于这么多文本时直接在当前进程分词, 把文本发给子进程的开销比分词还大
+BATCH_MIN_TEXTS = 64
+# 一次批量分词最长等待多久(单位：秒), 超时后关闭进程池在当前进程分词
+BATCH_TIMEOUT = 600
+
+# 当前进程创建的进程池和它加载的trie快照, 快照变化(比如加载了用户词典)时重新创建
+_batch_pool = None
+_batch_pool_key = None
+_batch_lock = threading.Lock()
+
+
+def _init_batch_worker(trie_file):
+    # 子进程导入本模块时已经创建了模块级的 tokenizer, 直接复用, 快照不同时才加载
+    if tokenizer.trie_file_ != trie_file:
+        tokenizer.trie_ = datrie.Trie.load(trie_file)
+        tokenizer.trie_file_ = trie_file
+
+
+def _close_batch_pool():
+    global _batch_pool, _batch_pool_key
+    with _batch_lock:
+        if _batch_pool is not None:
+            _batch_pool.terminate()
+        _batch_pool, _batch_pool_key = None, None
+
+
+atexit.register(_close_batch_pool)
+
+
+def _get_batch_pool(trie_file, workers):
+    """
+    获取加载了指定trie快照的进程池, 只创建一次
+    用 forkserver/spawn 启动子进程, 调用方可能是多线程的(task_executor 的状态上报线程、
+    api 服务解析文件的线程池), fork 出的子进程可能继承其它线程持有的锁而卡住
+    """
+    global _batch_pool, _batch_pool_key
+    with _batch_lock:
+        if _batch_pool is not None and _batch_pool_key == (trie_file, workers):
+            return _batch_pool
+        if _batch_pool is not None:
+            _batch_pool.terminate()
+            _batch_pool, _batch_pool_key = None, None
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        _batch_pool = ctx.Pool(workers, initializer=_init_batch_worker, initargs=(trie_file,))
+        _batch_pool_key = (trie_file, workers)
+        return _batch_pool
+
+
+def _tokenize_worker(text, fine_grained=False):
+    tks = tokenizer.tokenize(text)
+    if fine_grained:
+        return tks, tokenizer.fine_grained_tokenize(tks)
+    return tks
+
+
 class RagTokenizer:
     def key_(self, line):
         return str(line.lower().encode("utf-8"))[2:-1]
@@ -35,7 +102,11 @@ class RagTokenizer:
     def rkey_(self, line):
         return str(("DD" + (line[::-1].lower())).encode("utf-8"))[2:-1]
 
+    # 词典转换成trie的方式变化时修改, 旧版本的快照会自动重新构建
+    TRIE_VERSION = 1
+
     def loadDict_(self, fnm):
+        """把词典加到trie里, 返回是否全部加载成功"""
         logging.info(f"[HUQIE]:Build trie {fnm}")
         try:
             of = open(fnm, "r", encoding='utf-8')
@@ -50,15 +121,63 @@ class RagTokenizer:
                 if k not in self.trie_ or self.trie_[k][0] < F:
                     self.trie_[self.key_(line[0])] = (F, line[2])
                 self.trie_[self.rkey_(line[0])] = 1
-            self.trie_.save(fnm + ".trie")
             of.close()
+            return True
         except Exception:
             logging.exception(f"[HUQIE]:Build trie {fnm} failed")
+            return False
+
+    def snapshot_(self, fnm):
+        """词典对应的trie快照文件, 文件名里有词典内容的hash和版本号, 词典变化后自动失效"""
+        with open(fnm, "rb") as f:
+            digest = hashlib.md5(f.read()).hexdigest()[:16]
+        return f"{fnm}.{digest}.v{self.TRIE_VERSION}.trie"
+
+    def loadTrie_(self, fnm):
+        """
+        加载词典, 有可用的快照时直接加载二进制的trie, 否则从词典构建后保存快照
+        多个进程同时构建时各自写临时文件再重命名, 不会读到写了一半的快照
+        """
+        self.trie_file_ = None
+        if not os.path.exists(fnm):
+            # 只有旧版本的trie文件, 没有词典
+            self.trie_ = datrie.Trie.load(fnm + ".trie")
+            self.trie_file_ = fnm + ".trie"
+            return
+        snapshot = self.snapshot_(fnm)
+        try:
+            self.trie_ = datrie.Trie.load(snapshot)
+            self.trie_file_ = snapshot
+            return
+        except Exception:
+            logging.info(f"[HUQIE]:No trie snapshot {snapshot}")
+
+        self.trie_ = datrie.Trie(string.printable)
+        if not self.loadDict_(fnm):
+            # 只加载了一部分词典, 不保存快照, 下次启动时重新构建
+            return
+        tmp = f"{snapshot}.{os.getpid()}.tmp"
+        try:
+            self.trie_.save(tmp)
+            os.replace(tmp, snapshot)
+            self.trie_file_ = snapshot
+        except Exception:
+            logging.exception(f"[HUQIE]:Save trie snapshot {snapshot} failed")
+            return
+        # 清理词典修改之前的快照
+        for old in glob.glob(glob.escape(fnm) + ".*.v*.trie"):
+            if old != snapshot:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
 
     def __init__(self, debug=False):
         self.DEBUG = debug
         self.DENOMINATOR = 1000000
         self.trie_ = datrie.Trie(string.printable)
+        # 当前trie对应的快照文件, 批量分词的子进程从这里加载; trie在内存里被修改过时为None
+        self.trie_file_ = None
         self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
 
         self.stemmer = PorterStemmer()
@@ -66,42 +185,30 @@ class RagTokenizer:
 
         self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-z\.-]+|[0-9,\.-]+)"
         try:
-            self.trie_ = datrie.Trie.load(self.DIR_ + ".txt.trie")
-            return
+            self.loadTrie_(self.DIR_ + ".txt")
         except Exception:
             logging.exception("[HUQIE]:Build default trie")
             self.trie_ = datrie.Trie(string.printable)
-
-        self.loadDict_(self.DIR_ + ".txt")
+            self.trie_file_ = None
 
     def loadUserDict(self, fnm):
         try:
-            self.trie_ = datrie.Trie.load(fnm + ".trie")
-            return
+            self.loadTrie_(fnm)
         except Exception:
+            logging.exception(f"[HUQIE]:Load user dict {fnm} failed")
             self.trie_ = datrie.Trie(string.printable)
-        self.loadDict_(fnm)
+            self.trie_file_ = None
 
     def addUserDict(self, fnm):
+        self.trie_file_ = None
         self.loadDict_(fnm)
 
     def _strQ2B(self, ustring):
         """把字符串全角转半角"""
-        rstring = ""
-        for uchar in ustring:
-            inside_code = ord(uchar)
-            if inside_code == 0x3000:
-                inside_code = 0x0020
-            else:
-                inside_code -= 0xfee0
-            if inside_code < 0x0020 or inside_code > 0x7e:  # 转完之后不是半角字符返回原来的字符
-                rstring += uchar
-            else:
-                rstring += chr(inside_code)
-        return rstring
+        return ustring.translate(Q2B_TABLE)
 
     def _tradi2simp(self, line):
-        return HanziConv.toSimplified(line)
+        return line.translate(T2S_TABLE)
 
     def dfs_(self, chars, s, preTks, tkslist):
         MAX_L = 10
@@ -133,11 +240,8 @@ class RagTokenizer:
                 break
 
             if k in self.trie_:
-                pretks = copy.deepcopy(preTks)
-                if k in self.trie_:
-                    pretks.append((t, self.trie_[k]))
-                else:
-                    pretks.append((t, (-12, '')))
+                # 元素是不可变的tuple, 浅拷贝即可
+                pretks = preTks + [(t, self.trie_[k])]
                 res = max(res, self.dfs_(chars, e, pretks, tkslist))
 
         if res > s:
@@ -152,6 +256,119 @@ class RagTokenizer:
 
         return self.dfs_(chars, s + 1, preTks, tkslist)
 
+    def bestSeg_(self, chars):
+        """
+        和 self.sortTks_(tkslist)[0][0] 结果相同, tkslist 是 dfs_ 枚举的所有切分, 耗时和长度成线性关系
+        dfs_ 的剪枝只和位置以及前面连续单字的个数(最多看3个)有关, 按(位置, 连续单字数)做动态规划
+        分数是 词频之和 + (B + 多字词个数) / 分词个数, 按词频之和比最大值低多少分层,
+        每一层用 Dinkelbach 方法求后一项比值的最大值, 每次迭代是一次线性的动态规划
+        """
+        B = 30
+        N = len(chars)
+        if N == 0:
+            return []
+        if N < 8:
+            # 很短的文本可以切分的方式很少, 直接枚举更快
+            tkslist = []
+            self.dfs_(chars, 0, [], tkslist)
+            return self.sortTks_(tkslist)[0][0]
+
+        # edges[s][trail]: 按 dfs_ 的规则从 s 可以切出的词 (结束位置, 词频, 下一个trail, 是否多字词)
+        # trail 是 s 之前连续单字的个数, 3 表示3个及以上
+        edges = []
+        for s in range(N):
+            ends = []
+            for e in range(s + 1, N + 1):
+                k = self.key_(chars[s:e])
+                if e > s + 1 and not self.trie_.has_keys_with_prefix(k):
+                    break
+                if k in self.trie_:
+                    ends.append((e, self.trie_[k][0]))
+            # 第一个剪枝: 单字是前缀但两个字不是时, 只能按单字切
+            if s + 2 <= N and self.trie_.has_keys_with_prefix(self.key_(chars[s])) and \
+                    not self.trie_.has_keys_with_prefix(self.key_(chars[s:s + 2])):
+                ends = []
+            # 第二个剪枝: 前面连续3个单字, 且前一个字和当前字是前缀时不切单字
+            skip_single = s > 0 and self.trie_.has_keys_with_prefix(self.key_(chars[s - 1:s + 1]))
+            k = self.key_(chars[s])
+            # 没有可用的词时按单字切
+            single = [(s + 1, self.trie_[k][0] if k in self.trie_ else -12)]
+            row = []
+            for trail in range(4):
+                opts = [(e, f) for e, f in ends if not (trail == 3 and skip_single and e == s + 1)] or single
+                row.append([(e, f, min(trail + 1, 3) if e == s + 1 else 0, 1 if e - s >= 2 else 0)
+                            for e, f in opts])
+            edges.append(row)
+
+        # 每个状态后缀的最大词频之和
+        fmax = [[0] * 4 for _ in range(N + 1)]
+        for s in range(N - 1, -1, -1):
+            for trail in range(4):
+                fmax[s][trail] = max(f + fmax[e][nt] for e, f, nt, _ in edges[s][trail])
+
+        def solve(p, q, level):
+            """
+            词频之和正好比最大值低 level (None 表示不限制) 的切分里, 使 q * 多字词个数 - p * 分词个数 最大的一个
+            都是整数运算, 相同时取 dfs_ 先枚举到的, 即结束位置序列字典序最小的
+            """
+            depth = level or 0
+            # val[s][trail][r]: 后缀比最大值低 r 时的 (权重, 结束位置, 下一个trail, 下一个r)
+            val = [None] * (N + 1)
+            val[N] = [[(0, None, None, None)] + [None] * depth] * 4
+            for s in range(N - 1, -1, -1):
+                val[s] = []
+                for trail in range(4):
+                    row = [None] * (depth + 1)
+                    for e, f, nt, multi in edges[s][trail]:
+                        delta = 0 if level is None else fmax[s][trail] - f - fmax[e][nt]
+                        w = multi * q - p
+                        nxt = val[e][nt]
+                        for r in range(delta, depth + 1):
+                            if nxt[r - delta] is not None and (row[r] is None or nxt[r - delta][0] + w > row[r][0]):
+                                row[r] = (nxt[r - delta][0] + w, e, nt, r - delta)
+                    val[s].append(row)
+            if val[0][0][depth] is None:
+                return None
+            ends, s, trail, r = [], 0, 0, depth
+            while s < N:
+                _, s, trail, r = val[s][trail][r]
+                ends.append(s)
+            return ends
+
+        def max_ratio(level):
+            # Dinkelbach: 比值 p / q 不是最大时, 使 q * L - p * n 最大的切分比值一定更大
+            p, q, ends = 0, 1, None
+            while True:
+                cand = solve(p, q, level)
+                if cand is None:
+                    return ends
+                n = len(cand)
+                L = sum(1 for s, e in zip([0] + cand[:-1], cand) if e - s >= 2)
+                if (B + L) * q <= p * n:
+                    return ends
+                p, q, ends = B + L, n, cand
+
+        def score(ends, F):
+            # 和 score_ 一样的计算方式
+            L = sum(1 for s, e in zip([0] + ends[:-1], ends) if e - s >= 2)
+            L /= len(ends)
+            return B / len(ends) + L + F
+
+        # 后一项的上限, 词频之和低太多的层不可能超过已有的最优解
+        ends = max_ratio(None)
+        ratio_max = score(ends, 0)
+        top = None
+        level = 0
+        while top is None or fmax[0][0] - level + ratio_max >= top[0]:
+            ends = max_ratio(level)
+            if ends is not None:
+                sc = score(ends, fmax[0][0] - level)
+                if top is None or sc > top[0] or (sc == top[0] and ends < top[1]):
+                    top = (sc, ends)
+            level += 1
+        ends = top[1]
+        return [chars[s:e] for s, e in zip([0] + ends[:-1], ends)]
+
     def freq(self, tk):
         k = self.key_(tk)
         if k not in self.trie_:
@@ -304,9 +521,7 @@ class RagTokenizer:
                     j += 1
                     continue
                 # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+                res.append(" ".join(self.bestSeg_("".join(tks[_j:j]))))
 
                 same = 1
                 while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
@@ -320,9 +535,7 @@ class RagTokenizer:
             if _i < len(tks1):
                 assert _j < len(tks)
                 assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+                res.append(" ".join(self.bestSeg_("".join(tks[_j:]))))
 
         res = " ".join(self.english_normalize_(res))
         logging.debug("[TKS] {}".format(self.merge_(res)))
@@ -368,6 +581,33 @@ class RagTokenizer:
 
         return " ".join(self.english_normalize_(res))
 
+    def tokenize_batch(self, texts, workers=None, fine_grained=False):
+        """
+        批量分词, 按输入顺序返回每个文本 tokenize 的结果
+        fine_grained 为 True 时返回 (tokenize 结果, 对它 fine_grained_tokenize 的结果)
+        文本较多时交给进程池分词, 进程池只创建一次, 子进程从trie快照加载词典; 文本少、trie没有对应的快照
+        或者当前是守护进程(比如 celery 的 worker, 不能创建子进程)时在当前进程里分词
+        """
+        texts = list(texts)
+        workers = min(workers or os.cpu_count() or 1, len(texts) // BATCH_MIN_TEXTS)
+        if workers > 1 and self.trie_file_ and not multiprocessing.current_process().daemon:
+            try:
+                pool = _get_batch_pool(self.trie_file_, workers)
+                return pool.map_async(partial(_tokenize_worker, fine_grained=fine_grained), texts,
+                                      chunksize=max(1, len(texts) // (workers * 4))).get(BATCH_TIMEOUT)
+            except PoolTimeoutError:
+                logging.error(f"[HUQIE]:Tokenize with process pool timeout after {BATCH_TIMEOUT}s, "
+                              f"fallback to current process")
+                _close_batch_pool()
+            except Exception:
+                logging.exception("[HUQIE]:Tokenize with process pool failed, fallback to current process")
+
+        res = []
+        for text in texts:
+            tks = self.tokenize(text)
+            res.append((tks, self.fine_grained_tokenize(tks)) if fine_grained else tks)
+        return res
+
 
 def is_chinese(s):
     if s >= u'\u4e00' and s <= u'\u9fa5':
@@ -403,6 +643,7 @@ def naiveQie(txt):
 
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
+tokenize_batch = tokenizer.tokenize_batch
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
 tag = tokenizer.tag
 freq = tokenizer.freq
@@ -32,6 +32,8 @@ except Exception:
     REDIS = {}
     pass
 DOC_MAXIMUM_SIZE = int(os.environ.get("MAX_CONTENT_LENGTH", 128 * 1024 * 1024))
+# 同时请求llm生成关键词和问题的最大数量
+LLM_ENRICH_MAX_IN_FLIGHT = int(os.environ.get("LLM_ENRICH_MAX_IN_FLIGHT", 4))
 
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_QUEUE_RETENTION = 60*60
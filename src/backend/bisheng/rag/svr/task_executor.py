@@ -52,11 +52,12 @@ from bisheng.api.db.db_models import close_connection
 from bisheng.rag.app import qa,resume,naive,table,presentation,paper,picture,book,laws,email,one,manual
 from bisheng.rag.nlp import search, rag_tokenizer
 from bisheng.rag.utils.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
-from bisheng.rag.settings import DOC_MAXIMUM_SIZE, SVR_QUEUE_NAME, print_rag_settings
+from bisheng.rag.settings import DOC_MAXIMUM_SIZE, LLM_ENRICH_MAX_IN_FLIGHT, SVR_QUEUE_NAME, print_rag_settings
 from bisheng.rag.utils import rmSpace, num_tokens_from_string
 from bisheng.rag.utils.redis_conn import REDIS_CONN, Payload
 from bisheng.rag.utils.storage_factory import STORAGE_IMPL
 from bisheng.api.util.log_utils import initRootLogger
+from bisheng.utils.llm_enrich import LLMEnricher
 
 CONSUMER_NO = "0" if len(sys.argv) < 2 else sys.argv[1]
 CONSUMER_NAME = "task_executor_" + CONSUMER_NO
@@ -240,23 +241,34 @@ def build_chunks(task, progress_callback):
         docs.append(d)
     logging.info("MINIO PUT({}):{}".format(task["name"], el))
 
+    # 并发请求llm, 相同内容的生成结果会被缓存
+    enricher = LLMEnricher(max_in_flight=LLM_ENRICH_MAX_IN_FLIGHT, cache=REDIS_CONN)
+    contents = [d["content_with_weight"] for d in docs]
+
     if task["parser_config"].get("auto_keywords", 0):
         st = timer()
         progress_callback(msg="Start to generate keywords for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-        for d in docs:
-            d["important_kwd"] = keyword_extraction(chat_mdl, d["content_with_weight"],
-                                                    task["parser_config"]["auto_keywords"]).split(",")
-            d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
+        topn = task["parser_config"]["auto_keywords"]
+        keywords = enricher.map(lambda content: keyword_extraction(chat_mdl, content, topn), contents,
+                                namespace="keywords:{}:{}".format(task["llm_id"], topn))
+        for d, kwd in zip(docs, keywords):
+            d["important_kwd"] = kwd.split(",")
+        for d, tks in zip(docs, rag_tokenizer.tokenize_batch([" ".join(d["important_kwd"]) for d in docs])):
+            d["important_tks"] = tks
         progress_callback(msg="Keywords generation completed in {:.2f}s".format(timer() - st))
 
     if task["parser_config"].get("auto_questions", 0):
         st = timer()
         progress_callback(msg="Start to generate questions for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-        for d in docs:
-            d["question_kwd"] = question_proposal(chat_mdl, d["content_with_weight"], task["parser_config"]["auto_questions"]).split("\n")
-            d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
+        topn = task["parser_config"]["auto_questions"]
+        questions = enricher.map(lambda content: question_proposal(chat_mdl, content, topn), contents,
+                                 namespace="questions:{}:{}".format(task["llm_id"], topn))
+        for d, question in zip(docs, questions):
+            d["question_kwd"] = question.split("\n")
+        for d, tks in zip(docs, rag_tokenizer.tokenize_batch(["\n".join(d["question_kwd"]) for d in docs])):
+            d["question_tks"] = tks
         progress_callback(msg="Question generation completed in {:.2f}s".format(timer() - st))
 
     return docs
@@ -282,41 +294,47 @@ def embedding(docs, mdl, parser_config=None, callback=None):
 
     tk_count = 0
     if len(tts) == len(cnts):
-        tts_ = np.array([])
-        for i in range(0, len(tts), batch_size):
-            vts, c = mdl.encode(tts[i: i + batch_size])
-            if len(tts_) == 0:
-                tts_ = vts
-            else:
-                tts_ = np.concatenate((tts_, vts), axis=0)
-            tk_count += c
-            callback(prog=0.6 + 0.1 * (i + 1) / len(tts), msg="")
-        tts = tts_
-
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), batch_size):
-        vts, c = mdl.encode(cnts[i: i + batch_size])
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
+        tts, c = encode_batches(mdl, tts, batch_size, callback, 0.6, 0.1)
         tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+
+    cnts, c = encode_batches(mdl, cnts, batch_size, callback, 0.7, 0.2)
+    tk_count += c
 
     title_w = float(parser_config.get("filename_embd_weight", 0.1))
-    vects = (title_w * tts + (1 - title_w) *
-             cnts) if len(tts) == len(cnts) else cnts
+    if len(tts) == len(cnts):
+        # 原地计算加权和, 不再分配新的数组
+        cnts *= 1 - title_w
+        cnts += title_w * tts
+    vects = cnts
 
     assert len(vects) == len(docs)
     # vector_size = 0
+    vects = vects.tolist()
     for i, d in enumerate(docs):
-        v = vects[i].tolist()
+        v = vects[i]
         # vector_size = len(v)
         d["q_%d_vec" % len(v)] = v
     return tk_count, 3027
 
 
+def encode_batches(mdl, texts, batch_size, callback, prog_start, prog_span):
+    """
+    分批计算向量, 写入预先分配的float32数组, 避免每批都concatenate拷贝之前的结果
+    """
+    vects = None
+    tk_count = 0
+    for i in range(0, len(texts), batch_size):
+        vts, c = mdl.encode(texts[i: i + batch_size])
+        if vects is None:
+            vects = np.empty((len(texts), vts.shape[1]), dtype=np.float32)
+        vects[i: i + len(vts)] = vts
+        tk_count += c
+        callback(prog=prog_start + prog_span * (i + 1) / len(texts), msg="")
+    if vects is None:
+        vects = np.empty((0, 0), dtype=np.float32)
+    return vects, tk_count
+
+
 def run_raptor(row, chat_mdl, embd_mdl, callback=None):
     vts, _ = embd_mdl.encode(["ok"])
     vector_size = len(vts[0])
@@ -345,7 +363,9 @@ def run_raptor(row, chat_mdl, embd_mdl, callback=None):
     if row["pagerank"]: doc["pagerank_fea"] = int(row["pagerank"])
     res = []
     tk_count = 0
-    for content, vctr in chunks[original_length:]:
+    new_chunks = chunks[original_length:]
+    tokens = rag_tokenizer.tokenize_batch([content for content, _ in new_chunks], fine_grained=True)
+    for (content, vctr), (ltks, sm_ltks) in zip(new_chunks, tokens):
         d = copy.deepcopy(doc)
         md5 = hashlib.md5()
         md5.update((content + str(d["doc_id"])).encode("utf-8"))
@@ -354,8 +374,8 @@ def run_raptor(row, chat_mdl, embd_mdl, callback=None):
         d["create_timestamp_flt"] = datetime.now().timestamp()
         d[vctr_nm] = vctr.tolist()
         d["content_with_weight"] = content
-        d["content_ltks"] = rag_tokenizer.tokenize(content)
-        d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+        d["content_ltks"] = ltks
+        d["content_sm_ltks"] = sm_ltks
         res.append(d)
         tk_count += num_tokens_from_string(content)
     return res, tk_count, vector_size
@@ -1,6 +1,9 @@
 import json
 import os
 import re
+import threading
+import time
+from uuid import uuid4
 from typing import Dict, List, Optional, Union
 
 import yaml
@@ -85,6 +88,64 @@ class ObjectStore(BaseModel):
 class WorkflowConf(BaseModel):
     max_steps: int = Field(default=50, description="节点运行最大步数")
     timeout: int = Field(default=720, description="节点超时时间（min）")
+    suspend_on_input: bool = Field(default=False, description="等待用户输入时挂起workflow并释放worker，收到输入后再恢复执行")
+    checkpointer: str = Field(default='memory', description="workflow运行状态的存储方式: memory、redis、sql")
+    async_mode: bool = Field(default=False, description="异步执行workflow, 并行分支里的节点并发运行")
+    node_max_workers: int = Field(default=16, description="异步模式下执行同步节点逻辑的最大线程数")
+
+
+class ThreadPoolConf(BaseModel):
+    max_workers: int = Field(default=16, description="执行同步任务的最大线程数")
+    loop_num: int = Field(default=5, description="执行协程任务的后台事件循环数")
+    max_tasks_per_key: int = Field(default=0, description="同一个会话同时运行的最大任务数, 0表示不限制")
+
+
+class KnowledgeIngestConf(BaseModel):
+    parse_workers: int = Field(default=4, description="下载和解析文件的线程数")
+    embed_workers: int = Field(default=2, description="计算向量的线程数")
+    sink_workers: int = Field(default=2, description="写入milvus和es的线程数")
+    queue_size: int = Field(default=8, description="阶段之间最多缓存的文件数")
+    embed_batch_size: int = Field(default=32, description="单次请求embedding模型的文本数")
+    embed_max_retries: int = Field(default=3, description="单批embedding请求失败后的重试次数")
+    embed_retry_interval: float = Field(default=1, description="embedding重试的初始间隔, 每次重试翻倍(单位：秒)")
+    es_refresh: bool = Field(default=True, description="es写入后是否立即刷新索引, 关闭后写入更快, 但要等es的刷新间隔之后才能检索到")
+    enrich_max_in_flight: int = Field(default=4, description="进程内同时请求llm提取标题的最大数量, 所有文件共用")
+    enrich_cache_expiration: int = Field(default=7 * 86400, description="llm提取结果按内容缓存的时间(单位：秒)")
+
+
+class EmbeddingCacheConf(BaseModel):
+    enabled: bool = Field(default=False, description="是否缓存embedding模型的计算结果")
+    disk_path: str = Field(default='', description="本地缓存文件的路径, 为空时使用系统的缓存目录")
+    ttl: int = Field(default=30 * 86400, description="本地缓存的有效期(单位：秒)")
+    max_items: int = Field(default=100000, description="本地最多缓存的向量数, 超过后淘汰最久未访问的")
+    redis_enabled: bool = Field(default=False, description="是否同时缓存到redis, 多台机器之间共享")
+    redis_ttl: int = Field(default=86400, description="redis缓存的有效期(单位：秒)")
+
+
+class ModelTelemetryConf(BaseModel):
+    quota_lease_size: int = Field(default=10, description="开启调用次数限制时, 每个进程一次从redis领取的额度")
+    status_refresh_interval: int = Field(default=60, description="模型状态没有变化时, 每隔多久重新写入一次数据库(单位：秒)")
+
+
+class _ConfigCache:
+    """ 进程内缓存解析后的系统配置, 通过redis里的版本号判断配置是否有变更 """
+
+    # 多久去redis检查一次版本号(单位：秒)
+    check_interval = 1
+
+    def __init__(self):
+        self.version = None
+        self.value = None
+        self.check_time = 0
+        self.lock = threading.Lock()
+
+    def is_fresh(self) -> bool:
+        return self.value is not None and time.monotonic() - self.check_time < self.check_interval
+
+
+_config_cache = _ConfigCache()
+# 系统配置的版本号, 保存配置时更新
+CONFIG_VERSION_KEY = 'config:initdb_config:version'
 
 
 class Settings(BaseModel):
@@ -132,6 +193,10 @@ class Settings(BaseModel):
     vector_stores: VectorStores = {}
     object_storage: ObjectStore = {}
     workflow_conf: WorkflowConf = WorkflowConf()
+    thread_pool_conf: ThreadPoolConf = ThreadPoolConf()
+    knowledge_ingest_conf: KnowledgeIngestConf = KnowledgeIngestConf()
+    embedding_cache_conf: EmbeddingCacheConf = EmbeddingCacheConf()
+    model_telemetry_conf: ModelTelemetryConf = ModelTelemetryConf()
 
     @validator('database_url', pre=True)
     def set_database_url(cls, value):
@@ -203,7 +268,8 @@ class Settings(BaseModel):
     def get_knowledge(self):
         # 由于分布式的要求，可变更的配置存储于mysql，因此读取配置每次从mysql中读取
         all_config = self.get_all_config()
-        ret = all_config.get('knowledges', {})
+        # 配置在进程内共享，复制一份再添加其他的配置
+        ret = dict(all_config.get('knowledges', {}))
         # milvus、 es、minio配置从环境变量获取
         ret.update({
             "vectorstores": {
@@ -257,11 +323,31 @@ class Settings(BaseModel):
         return all_config.get(key, {})
 
     def get_all_config(self):
+        """
+        获取系统配置, 解析后的结果在进程内共享, 调用方不要修改返回的数据
+        配置保存时会更新redis里的版本号, 版本号变化后才重新读取和解析配置
+        """
+        if _config_cache.is_fresh():
+            return _config_cache.value
+        from bisheng.cache.redis import redis_client
+
+        with _config_cache.lock:
+            if _config_cache.is_fresh():
+                return _config_cache.value
+            # 先读版本号再读配置，保证缓存的配置不会比版本号旧
+            version = redis_client.get(CONFIG_VERSION_KEY)
+            if _config_cache.value is None or version != _config_cache.version:
+                _config_cache.value = self._load_all_config(version)
+                _config_cache.version = version
+            _config_cache.check_time = time.monotonic()
+            return _config_cache.value
+
+    def _load_all_config(self, version: str = None):
         from bisheng.database.base import session_getter
         from bisheng.cache.redis import redis_client
         from bisheng.database.models.config import Config
 
-        redis_key = 'config:initdb_config'
+        redis_key = f'config:initdb_config:{version}'
         cache = redis_client.get(redis_key)
         if cache:
             return yaml.safe_load(cache)
@@ -275,6 +361,13 @@ class Settings(BaseModel):
                 else:
                     raise Exception('initdb_config not found, please check your system config')
 
+    def update_config_version(self):
+        """ 系统配置变更后调用, 所有进程的配置缓存会在下次检查版本号时失效 """
+        from bisheng.cache.redis import redis_client
+
+        redis_client.set(CONFIG_VERSION_KEY, uuid4().hex, expiration=None)
+        _config_cache.check_time = 0
+
     def update_from_yaml(self, file_path: str, dev: bool = False):
         new_settings = load_settings_from_yaml(file_path)
         self.chains = new_settings.chains or {}
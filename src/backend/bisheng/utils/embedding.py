@@ -1,3 +1,4 @@
+import numpy as np
 from langchain.embeddings.base import Embeddings
 
 
@@ -6,3 +7,20 @@ def decide_embeddings(model: str) -> Embeddings:
     from bisheng.api.services.llm import LLMService
 
     return LLMService.get_bisheng_embedding(model_id=model)
+
+
+def normalize_embeddings(vectors) -> np.ndarray:
+    """ 转换成连续的float32数组, 一次按行归一化, 模长为0的向量保持不变 """
+    arr = np.array(vectors, dtype=np.float32)
+    if arr.size == 0:
+        return arr
+    norms = np.linalg.norm(arr, axis=-1, keepdims=True)
+    np.divide(arr, norms, out=arr, where=norms > 0)
+    return arr
+
+
+def embed_documents_array(embeddings: Embeddings, texts: list) -> np.ndarray:
+    """ 计算文本的向量, 返回(len(texts), dim)的float32数组, 支持数组接口的embedding不再转换成列表 """
+    if hasattr(embeddings, 'embed_documents_array'):
+        return embeddings.embed_documents_array(texts)
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
@@ -0,0 +1,153 @@
+import contextvars
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+# 认为是限流的错误信息
+RATE_LIMIT_KEYWORDS = ('429', 'rate limit', 'ratelimit', 'too many requests', 'rate_limit')
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """ 判断是否是模型服务返回的限流错误 """
+    status_code = getattr(e, 'status_code', None) or getattr(getattr(e, 'response', None),
+                                                             'status_code', None)
+    if status_code == 429:
+        return True
+    message = f'{type(e).__name__} {e}'.lower()
+    return any(one in message for one in RATE_LIMIT_KEYWORDS)
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """ 限流响应里的Retry-After头 """
+    headers = getattr(getattr(e, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMEnricher:
+    """
+    并发调用llm给文档或分块生成标题、关键词、问题等信息
+    进程内同时执行的llm请求数有上限(多个文件同时解析时共用), 遇到限流时所有请求一起暂停后重试
+    结果按内容的md5缓存, 重新解析相同内容时不再调用llm
+    """
+
+    # 进程内共享的限流暂停截止时间, 一个请求被限流后其他请求也不再发送
+    _pause_until = 0.0
+    _pause_lock = threading.Lock()
+    # 进程内共享的并发限制, 按max_in_flight区分, 配置修改后使用新的信号量
+    _in_flight: Dict[int, threading.BoundedSemaphore] = {}
+    _in_flight_lock = threading.Lock()
+
+    def __init__(self,
+                 max_in_flight: int = 4,
+                 max_retries: int = 3,
+                 retry_interval: float = 2,
+                 cache: Any = None,
+                 cache_expiration: int = 7 * 86400,
+                 cache_prefix: str = 'llm_enrich'):
+        """
+        max_in_flight: 进程内同时执行的llm请求数
+        cache: 提供get(key)和set(key, value, expiration)的缓存, 比如redis_client, 不传不缓存
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        with self._in_flight_lock:
+            self.semaphore = self._in_flight.setdefault(self.max_in_flight,
+                                                        threading.BoundedSemaphore(self.max_in_flight))
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.cache = cache
+        self.cache_expiration = cache_expiration
+        self.cache_prefix = cache_prefix
+
+    def cache_key(self, namespace: str, content: str) -> str:
+        content_hash = hashlib.md5(content.encode('utf-8')).hexdigest()
+        return f'{self.cache_prefix}:{namespace}:{content_hash}'
+
+    def map(self, func: Callable[[str], Any], contents: List[str], namespace: str) -> List[Any]:
+        """
+        对每个内容调用func, 按输入顺序返回结果
+        namespace: 区分不同的模型和用途, 是缓存key的一部分
+        """
+        results: List[Any] = [None] * len(contents)
+        # 相同内容只调用一次llm
+        pending: Dict[str, List[int]] = {}
+        for index, content in enumerate(contents):
+            key = self.cache_key(namespace, content)
+            if key in pending:
+                pending[key].append(index)
+                continue
+            cached = self._cache_get(key)
+            if cached is not None:
+                results[index] = cached
+                continue
+            pending[key] = [index]
+        logger.debug(f'llm_enrich namespace={namespace} total={len(contents)} '
+                     f'cached={len(contents) - sum(len(one) for one in pending.values())}')
+        if not pending:
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(pending)),
+                                thread_name_prefix='llm_enrich') as executor:
+            futures = {
+                # 保留trace_id等日志信息
+                key: executor.submit(contextvars.copy_context().run, self._call, func,
+                                     contents[indexes[0]])
+                for key, indexes in pending.items()
+            }
+            for key, future in futures.items():
+                value = future.result()
+                for index in pending[key]:
+                    results[index] = value
+                # llm返回空时不缓存, 下次重新生成
+                if value:
+                    self._cache_set(key, value)
+        return results
+
+    def _call(self, func: Callable[[str], Any], content: str) -> Any:
+        for retry in range(self.max_retries + 1):
+            self._wait_pause()
+            try:
+                with self.semaphore:
+                    return func(content)
+            except Exception as e:
+                if retry >= self.max_retries or not is_rate_limit_error(e):
+                    raise e
+                wait = _retry_after(e) or self.retry_interval * (2**retry)
+                logger.warning(f'llm_enrich rate limited, retry={retry + 1} wait={wait}s error={e}')
+                self._set_pause(wait)
+
+    @classmethod
+    def _wait_pause(cls):
+        wait = cls._pause_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    @classmethod
+    def _set_pause(cls, wait: float):
+        with cls._pause_lock:
+            cls._pause_until = max(cls._pause_until, time.monotonic() + wait)
+
+    def _cache_get(self, key: str) -> Any:
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.get(key)
+        except Exception as e:
+            logger.warning(f'llm_enrich cache get error: {e}')
+            return None
+
+    def _cache_set(self, key: str, value: Any):
+        if self.cache is None:
+            return
+        try:
+            self.cache.set(key, value, self.cache_expiration)
+        except Exception as e:
+            logger.warning(f'llm_enrich cache set error: {e}')
@@ -1,6 +1,7 @@
 import io
+import threading
 from datetime import timedelta
-from typing import BinaryIO
+from typing import BinaryIO, Dict, Iterator, Set, Tuple
 
 import minio
 from bisheng.settings import settings
@@ -12,28 +13,51 @@ tmp_bucket = 'tmp-dir'
 
 
 class MinioClient:
+    """
+    进程内按minio配置共享一个实例, minio.Minio本身是线程安全的, 底层的http连接池可以复用
+    配置变更后再次构造时会创建新的实例
+    """
     minio_share: minio.Minio
     minio_client: minio.Minio
 
     tmp_bucket = tmp_bucket
     bucket = bucket
 
-    def __init__(self) -> None:
-        if 'minio' not in settings.get_knowledge(
-        ) or not settings.get_knowledge().get('minio').get('MINIO_ENDPOINT'):
+    _instances: Dict[Tuple, 'MinioClient'] = {}
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        minio_conf = settings.get_knowledge().get('minio') or {}
+        if not minio_conf.get('MINIO_ENDPOINT'):
             raise Exception('请配置minio地址等相关配置')
-        self.minio_client = minio.Minio(
-            endpoint=settings.get_knowledge().get('minio').get('MINIO_ENDPOINT'),
-            access_key=settings.get_knowledge().get('minio').get('MINIO_ACCESS_KEY'),
-            secret_key=settings.get_knowledge().get('minio').get('MINIO_SECRET_KEY'),
-            secure=settings.get_knowledge().get('minio').get('SCHEMA'),
-            cert_check=settings.get_knowledge().get('minio').get('CERT_CHECK'))
-        self.minio_share = minio.Minio(
-            endpoint=settings.get_knowledge().get('minio').get('MINIO_SHAREPOIN'),
-            access_key=settings.get_knowledge().get('minio').get('MINIO_ACCESS_KEY'),
-            secret_key=settings.get_knowledge().get('minio').get('MINIO_SECRET_KEY'),
-            secure=settings.get_knowledge().get('minio').get('SCHEMA'),
-            cert_check=settings.get_knowledge().get('minio').get('CERT_CHECK'))
+        conf_key = tuple(
+            minio_conf.get(one) for one in ('MINIO_ENDPOINT', 'MINIO_SHAREPOIN', 'MINIO_ACCESS_KEY',
+                                            'MINIO_SECRET_KEY', 'SCHEMA', 'CERT_CHECK'))
+        instance = cls._instances.get(conf_key)
+        if instance is None:
+            with cls._instance_lock:
+                instance = cls._instances.get(conf_key)
+                if instance is None:
+                    instance = super().__new__(cls)
+                    instance._init_client(minio_conf)
+                    # 只保留最新配置的实例
+                    cls._instances = {conf_key: instance}
+        return instance
+
+    def _init_client(self, minio_conf: dict):
+        self.minio_client = minio.Minio(endpoint=minio_conf.get('MINIO_ENDPOINT'),
+                                        access_key=minio_conf.get('MINIO_ACCESS_KEY'),
+                                        secret_key=minio_conf.get('MINIO_SECRET_KEY'),
+                                        secure=minio_conf.get('SCHEMA'),
+                                        cert_check=minio_conf.get('CERT_CHECK'))
+        self.minio_share = minio.Minio(endpoint=minio_conf.get('MINIO_SHAREPOIN'),
+                                       access_key=minio_conf.get('MINIO_ACCESS_KEY'),
+                                       secret_key=minio_conf.get('MINIO_SECRET_KEY'),
+                                       secure=minio_conf.get('SCHEMA'),
+                                       cert_check=minio_conf.get('CERT_CHECK'))
+        # 已经确认存在的bucket, 避免每次都请求minio
+        self._exist_buckets: Set[str] = set()
+        self._tmp_lifecycle_checked = False
         self.mkdir(new_bucket=bucket)
 
     def upload_minio(self,
@@ -74,6 +98,16 @@ class MinioClient:
 
     def upload_tmp(self, object_name, data):
         self.mkdir(tmp_bucket)
+        if not self._tmp_lifecycle_checked:
+            self._init_tmp_lifecycle()
+            self._tmp_lifecycle_checked = True
+
+        self.minio_client.put_object(bucket_name=tmp_bucket,
+                                     object_name=object_name,
+                                     data=io.BytesIO(data),
+                                     length=len(data))
+
+    def _init_tmp_lifecycle(self):
         from minio.lifecycleconfig import LifecycleConfig, Rule, Expiration
         from minio.commonconfig import Filter
 
@@ -88,17 +122,15 @@ class MinioClient:
             ], )
             self.minio_client.set_bucket_lifecycle(tmp_bucket, lifecycle_conf)
 
-        self.minio_client.put_object(bucket_name=tmp_bucket,
-                                     object_name=object_name,
-                                     data=io.BytesIO(data),
-                                     length=len(data))
-
     def delete_minio(self, object_name: str):
         self.minio_client.remove_object(bucket_name=bucket, object_name=object_name)
 
     def mkdir(self, new_bucket: str):
+        if new_bucket in self._exist_buckets:
+            return
         if not self.minio_client.bucket_exists(new_bucket):
             self.minio_client.make_bucket(new_bucket)
+        self._exist_buckets.add(new_bucket)
 
     def upload_minio_file(self,
                           object_name: str,
@@ -147,6 +179,30 @@ class MinioClient:
                 response.close()
                 response.release_conn()
 
+    def get_object_stream(self, bucket_name, object_name, chunk_size: int = 1024 * 1024, **kwargs) -> Iterator[bytes]:
+        """ 分块读取文件内容, 不需要把整个文件读入内存 """
+        response = self.minio_client.get_object(bucket_name, object_name, **kwargs)
+        try:
+            yield from response.stream(chunk_size)
+        finally:
+            response.close()
+            response.release_conn()
+
+    def put_object_stream(self,
+                          object_name: str,
+                          stream: BinaryIO,
+                          bucket_name=bucket,
+                          length: int = -1,
+                          part_size: int = 10 * 1024 * 1024,
+                          **kwargs):
+        """ 分片上传文件流, 长度未知时不需要先读取整个文件计算长度 """
+        return self.minio_client.put_object(bucket_name=bucket_name,
+                                            object_name=object_name,
+                                            data=stream,
+                                            length=length,
+                                            part_size=part_size if length == -1 else 0,
+                                            **kwargs)
+
     def copy_object(
         self,
         source_object_name,
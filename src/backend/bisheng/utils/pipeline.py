@@ -0,0 +1,88 @@
+import contextvars
+import threading
+from queue import Queue
+from typing import Any, Callable, Iterable, List, Optional
+
+from loguru import logger
+
+# 通知阶段内的线程退出
+_STOP = object()
+
+
+class PipelineStage:
+    """ 流水线的一个阶段, func处理一个数据并返回给下一个阶段的数据 """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class StagedPipeline:
+    """
+    多阶段的处理流水线, 每个阶段有自己的工作线程, 阶段之间通过有界队列连接
+    下游处理慢时上游阻塞在队列上, 内存里同时存在的数据量有上限
+    某个数据处理失败时调用on_error, 不影响其他数据; 最后一个阶段处理完成时调用on_done
+    """
+
+    def __init__(self,
+                 stages: List[PipelineStage],
+                 queue_size: int = 8,
+                 on_done: Optional[Callable[[Any], None]] = None,
+                 on_error: Optional[Callable[[Any, Exception], None]] = None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_done = on_done
+        self.on_error = on_error
+
+    def run(self, items: Iterable[Any]):
+        """ 处理所有数据, 全部处理完成后返回 """
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+        for index, stage in enumerate(self.stages):
+            output = queues[index + 1] if index + 1 < len(queues) else None
+            stage_threads = []
+            for i in range(stage.workers):
+                # 每个线程单独复制一份上下文, 保留trace_id等日志信息
+                ctx = contextvars.copy_context()
+                thread = threading.Thread(target=ctx.run,
+                                          args=(self._work, stage, queues[index], output),
+                                          name=f'pipeline_{stage.name}_{i}',
+                                          daemon=True)
+                thread.start()
+                stage_threads.append(thread)
+            threads.append(stage_threads)
+
+        for item in items:
+            queues[0].put(item)
+        # 上一个阶段的线程全部退出后, 下一个阶段不会再有新的数据
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                queues[index].put(_STOP)
+            for thread in threads[index]:
+                thread.join()
+
+    def _work(self, stage: PipelineStage, input_queue: Queue, output_queue: Optional[Queue]):
+        while True:
+            item = input_queue.get()
+            if item is _STOP:
+                return
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                logger.exception(f'pipeline stage {stage.name} error')
+                self._callback(self.on_error, item, e)
+                continue
+            if output_queue is not None:
+                output_queue.put(result)
+            else:
+                self._callback(self.on_done, result)
+
+    @staticmethod
+    def _callback(func: Optional[Callable], *args):
+        if func is None:
+            return
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('pipeline callback error')
@@ -2,132 +2,252 @@ import asyncio
 import concurrent.futures
 import threading
 import time
-from typing import Dict, List, Set, Tuple
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
 
 from loguru import logger
+from prometheus_client import Gauge, Histogram
+
+from bisheng.settings import settings
+
+# 任务从提交到开始执行的等待时间
+task_queue_wait_seconds = Histogram('bisheng_task_queue_wait_seconds',
+                                    'time tasks wait before start running', ['pool', 'type'],
+                                    buckets=(0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60))
+# 因为同一个key的并发限制排队中的任务数
+task_pending_count = Gauge('bisheng_task_pending_count', 'tasks waiting for per key concurrency', ['pool'])
+
+
+class _TaskItem:
+    """ 提交的任务, future是返回给调用方的句柄, inner是实际执行的future """
+
+    def __init__(self, key: str, fn: Callable, args: tuple, kwargs: dict, trace_id: str, keep_result: bool):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.trace_id = trace_id
+        # 没有调用方会取结果的任务, 完成后不保留结果
+        self.keep_result = keep_result
+        self.is_async = asyncio.iscoroutinefunction(fn)
+        self.future = concurrent.futures.Future()
+        self.inner: Optional[concurrent.futures.Future] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.submit_time = time.time()
 
 
 class ThreadPoolManager:
+    """
+    同步函数提交到线程池执行, 协程提交到常驻的后台事件循环上执行
+    任务完成时通过回调记录结果并唤醒等待的协程, 不需要轮询
+    同一个key可以限制最大并发数, 超过的任务排队等待
+    """
 
-    def __init__(self, max_workers, thread_name_prefix='pool'):
+    def __init__(self,
+                 max_workers: int = None,
+                 thread_name_prefix: str = 'pool',
+                 loop_num: int = None,
+                 max_tasks_per_key: int = None,
+                 result_ttl: int = 600):
+        conf = settings.thread_pool_conf
         self.thread_group = thread_name_prefix
+        self.max_workers = max_workers or conf.max_workers
+        self.loop_num = loop_num or conf.loop_num
+        # 0表示不限制
+        self.max_tasks_per_key = conf.max_tasks_per_key if max_tasks_per_key is None else max_tasks_per_key
+        # 没有被取走的任务结果保留的时间
+        self.result_ttl = result_ttl
+
         self.executor = concurrent.futures.ThreadPoolExecutor(
-            max_workers=max_workers, thread_name_prefix=thread_name_prefix)
-        # 设计每个同步线程配备一个协程
-        self.future_dict: Dict[str, List[concurrent.futures.Future]] = {}
-        self.async_task: Dict[str, List[concurrent.futures.Future]] = {}
-        self.lock = threading.Lock()
+            max_workers=self.max_workers, thread_name_prefix=thread_name_prefix)
+        # 任务取消或者提交时已经完成会在持有锁的线程里直接触发完成回调, 需要可重入
+        self.lock = threading.RLock()
+        # 后台事件循环和各自正在运行的协程数
+        self._loops: List[asyncio.AbstractEventLoop] = []
+        self._loop_load: Dict[asyncio.AbstractEventLoop, int] = {}
 
-    def fake_task_for_skip_first_thread(self):
-        """因为异步函数提交会不占用线程时间，导致任务堆积到某个线程上"""
-        time.sleep(1)
+        self._running: Dict[str, List[_TaskItem]] = {}
+        self._pending: Dict[str, Deque[_TaskItem]] = {}
+        self._completed: Dict[str, List[Tuple[float, concurrent.futures.Future]]] = {}
+        # 按完成时间排序的结果, 用于过期清理时只检查最早完成的结果
+        self._completed_order: Deque[Tuple[float, str, concurrent.futures.Future]] = deque()
+        self._waiters: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
 
-    def submit(self, key: str, fn, *args, **kwargs):
+    def submit(self, key: str, fn, *args, **kwargs) -> concurrent.futures.Future:
+        """ kwargs里的trace_id用于日志, keep_result=False表示没有调用方取结果, 完成后不保留 """
+        trace_id = kwargs.pop('trace_id', '2')
+        keep_result = kwargs.pop('keep_result', True)
+        item = _TaskItem(key, fn, args, kwargs, trace_id, keep_result)
         with self.lock:
-            if key not in self.future_dict:
-                self.future_dict[key] = []
-            if key not in self.async_task:
-                self.async_task[key] = []
-            if asyncio.coroutines.iscoroutinefunction(fn):
-                self.executor.submit(self.fake_task_for_skip_first_thread)
-                future = self.executor.submit(self.run_in_event_loop, fn, *args, **kwargs)
-                self.async_task[key].append(future)
+            running = self._running.setdefault(key, [])
+            if self.max_tasks_per_key and len(running) >= self.max_tasks_per_key:
+                self._pending.setdefault(key, deque()).append(item)
+                task_pending_count.labels(self.thread_group).inc()
+                logger.info('task_pending key={} running={}', key, len(running))
             else:
-                future = self.executor.submit(self.context_wrapper, fn, *args, **kwargs)
-                self.future_dict[key].append(future)
-            return future
+                self._start(item)
+        return item.future
 
-    def context_wrapper(self, func, *args, **kwargs):
-        trace_id = kwargs.pop('trace_id', '2')
-        start_wait = time.time()
-        with logger.contextualize(trace_id=trace_id):
-            result = func(*args, **kwargs)
-            end_wait = time.time()  # Time when the task actually started
-            logger.info(
-                f'Task_waited={end_wait - start_wait:.2f} seconds and executed={time.time() - end_wait:.2f} seconds',
-            )
-            return result
+    def _start(self, item: _TaskItem):
+        """ 需要持有锁调用 """
+        self._running.setdefault(item.key, []).append(item)
+        if item.is_async:
+            item.loop = self._pick_loop()
+            self._loop_load[item.loop] += 1
+            item.inner = asyncio.run_coroutine_threadsafe(self._run_coroutine(item), item.loop)
+        else:
+            item.inner = self.executor.submit(self._run_sync, item)
+        item.inner.add_done_callback(lambda _: self._on_done(item))
 
-    def run_in_event_loop(self, coro, *args, **kwargs) -> concurrent.futures.Future:
-        try:
-            loop = asyncio.get_event_loop()
-            logger.info('event loop {}', loop)
-        except Exception:
+    def _pick_loop(self) -> asyncio.AbstractEventLoop:
+        """ 选择正在运行协程最少的事件循环, 不足loop_num时创建新的 """
+        if len(self._loops) < self.loop_num and all(self._loop_load[one] for one in self._loops):
             loop = asyncio.new_event_loop()
-            thread_event = threading.Thread(target=self.start_loop, args=(loop, ))
-            thread_event.start()
+            threading.Thread(target=self.start_loop,
+                             args=(loop,),
+                             name=f'{self.thread_group}_loop_{len(self._loops)}',
+                             daemon=True).start()
+            self._loops.append(loop)
+            self._loop_load[loop] = 0
             logger.info('Creating new event loop {}', loop)
-        asyncio.set_event_loop(loop)
-        trace_id = kwargs.pop('trace_id', '2')
-        with logger.contextualize(trace_id=trace_id):
-            future = asyncio.run_coroutine_threadsafe(coro(*args, **kwargs), loop)
-            # result = loop.run_until_complete(coro(*args, **kwargs))
-            # 压力大的时候，会创建更多线程，从而更多事件队列
-            time.sleep(1)
-            logger.info('async_task_added fun={} args={}', coro.__name__, args[0] if args else '')
-            return future
+            return loop
+        return min(self._loops, key=lambda one: self._loop_load[one])
+
+    def _observe_wait(self, item: _TaskItem) -> float:
+        wait = time.time() - item.submit_time
+        task_queue_wait_seconds.labels(self.thread_group, 'async' if item.is_async else 'sync').observe(wait)
+        return wait
+
+    async def _run_coroutine(self, item: _TaskItem) -> Any:
+        with logger.contextualize(trace_id=item.trace_id):
+            wait = self._observe_wait(item)
+            logger.info('async_task_start fun={} waited={:.3f}s', item.fn.__name__, wait)
+            return await item.fn(*item.args, **item.kwargs)
+
+    def _run_sync(self, item: _TaskItem) -> Any:
+        with logger.contextualize(trace_id=item.trace_id):
+            wait = self._observe_wait(item)
+            start = time.time()
+            result = item.fn(*item.args, **item.kwargs)
+            logger.info(f'Task_waited={wait:.2f} seconds and executed={time.time() - start:.2f} seconds')
+            return result
+
+    def _on_done(self, item: _TaskItem):
+        # 先把结果同步到返回给调用方的future
+        if item.inner.cancelled():
+            item.future.cancel()
+        elif item.inner.exception() is not None:
+            item.future.set_exception(item.inner.exception())
+        else:
+            item.future.set_result(item.inner.result())
+
+        now = time.time()
+        with self.lock:
+            if item.loop is not None:
+                self._loop_load[item.loop] -= 1
+            running = self._running.get(item.key, [])
+            if item in running:
+                running.remove(item)
+            # 同一个key排队的任务开始执行
+            pending = self._pending.get(item.key)
+            if pending:
+                task_pending_count.labels(self.thread_group).dec()
+                self._start(pending.popleft())
+                if not pending:
+                    self._pending.pop(item.key)
+            if not running:
+                self._running.pop(item.key, None)
+
+            if item.keep_result:
+                self._completed.setdefault(item.key, []).append((now, item.future))
+                self._completed_order.append((now, item.key, item.future))
+            self._expire_completed(now)
+            for loop, event in self._waiters.get(item.key, set()):
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(event.set)
+
+    def _expire_completed(self, now: float):
+        """ 没有调用方取走的结果过期清理, 需要持有锁调用 """
+        while self._completed_order and now - self._completed_order[0][0] >= self.result_ttl:
+            _, key, future = self._completed_order.popleft()
+            # 同一个key的结果也是按完成时间排序的, 已经被取走的结果跳过
+            futures = self._completed.get(key)
+            if futures and futures[0][1] is future:
+                futures.pop(0)
+                if not futures:
+                    self._completed.pop(key)
 
     def start_loop(self, loop):
         asyncio.set_event_loop(loop)
         loop.run_forever()
 
+    def _pop_completed(self, key_list: Set[str]) -> List[Tuple[str, concurrent.futures.Future]]:
+        completed_futures = []
+        with self.lock:
+            for key in key_list:
+                for _, future in self._completed.pop(key, []):
+                    completed_futures.append((key, future))
+        return completed_futures
+
     async def as_completed(self,
                            key_list: Set[str]) -> List[Tuple[str, concurrent.futures.Future]]:
-        with self.lock:
-            completed_futures = []
-            for k, lf in list(self.future_dict.items()):
-                for f in lf:
-                    if f.done():
-                        if k in key_list:
-                            completed_futures.append((k, f))
-                            self.future_dict[k].remove(f)
-                if len(lf) == 0:
-                    self.future_dict.pop(k)
-
-            pending_count = 0
-            for k, lf in list(self.async_task.items()):
-                for f in lf:
-                    if f.done():
-                        # 获取task
-                        task = f.result()
-                        if task.done():
-                            if k in key_list:
-                                completed_futures.append((k, task))
-                                self.async_task[k].remove(f)
-                        else:
-                            pending_count += 1
-                if len(lf) == 0:
-                    self.async_task.pop(k)
-            if pending_count > 0:
-                logger.info('async_wait_count={}', pending_count)
-            return completed_futures
+        """ 返回已经完成的任务, 不等待 """
+        return self._pop_completed(key_list)
 
-    # async def async_done_callback(self, future):
-    #     self.async_task_result.append(future)
+    async def wait_completed(self, key_list: Set[str],
+                             timeout: float = None) -> List[Tuple[str, concurrent.futures.Future]]:
+        """ 等待任意一个key的任务完成, 超时返回空列表 """
+        completed_futures = self._pop_completed(key_list)
+        if completed_futures:
+            return completed_futures
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            for key in key_list:
+                self._waiters.setdefault(key, set()).add(waiter)
+        try:
+            # 注册前刚好完成的任务
+            completed_futures = self._pop_completed(key_list)
+            if completed_futures:
+                return completed_futures
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.lock:
+                for key in key_list:
+                    waiters = self._waiters.get(key)
+                    if waiters is not None:
+                        waiters.discard(waiter)
+                        if not waiters:
+                            self._waiters.pop(key)
+        return self._pop_completed(key_list)
 
-    def cancel_task(self, key_list: List[str]):
+    def cancel_task(self, key_list: List[str]) -> List[bool]:
+        """ 取消key对应的排队中和运行中的任务, 返回每个key是否有任务被取消 """
         res = [False] * len(key_list)
         with self.lock:
             for index, key in enumerate(key_list):
-                if self.async_task.get(key):
-                    for task in self.async_task.get(key):
-                        cancel_res = task.result().cancel()
-                        logger.info('clean_pending_task key={} task={} res={}', key, task,
-                                    cancel_res)
-                        res[index] = cancel_res
-                if self.future_dict.get(key):
-                    for task in self.future_dict.get(key):
-                        res.append(task.cancel())
-            return res
+                for item in self._pending.pop(key, []):
+                    task_pending_count.labels(self.thread_group).dec()
+                    res[index] = item.future.cancel() or res[index]
+                for item in list(self._running.get(key, [])):
+                    cancel_res = item.inner.cancel()
+                    logger.info('clean_pending_task key={} task={} res={}', key, item.inner, cancel_res)
+                    res[index] = cancel_res or res[index]
+                self._completed.pop(key, None)
+        return res
 
     def tear_down(self):
-        key_list = list(self.async_task.keys())
+        with self.lock:
+            key_list = list(set(self._running.keys()) | set(self._pending.keys()))
         self.cancel_task(key_list)
+        for loop in self._loops:
+            loop.call_soon_threadsafe(loop.stop)
         self.executor.shutdown(cancel_futures=True)
 
 
 # 创建一个线程池管理器
-thread_pool = ThreadPoolManager(5)
+thread_pool = ThreadPoolManager()
 
 if __name__ == '__main__':
 
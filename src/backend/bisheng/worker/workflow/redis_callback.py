@@ -11,6 +11,7 @@ from bisheng.cache.redis import redis_client
 from bisheng.chat.utils import sync_judge_source, sync_process_source_document
 from bisheng.database.models.message import ChatMessageDao, ChatMessage, ChatMessageType
 from bisheng.settings import settings
+from bisheng.utils.exceptions import IgnoreException
 from bisheng.workflow.callback.base_callback import BaseCallback
 from bisheng.workflow.callback.event import NodeStartData, NodeEndData, UserInputData, GuideWordData, GuideQuestionData, \
     OutputMsgData, StreamMsgData, StreamMsgOverData, OutputMsgChooseData, OutputMsgInputData
@@ -18,6 +19,8 @@ from bisheng.workflow.common.workflow import WorkflowStatus
 
 
 class RedisCallback(BaseCallback):
+    # workflow结束时写入消息队列的通知，用来唤醒阻塞读取消息的一方
+    status_notify_category = 'workflow_status_notify'
 
     def __init__(self, unique_id: str, workflow_id: str, chat_id: str, user_id: str):
         super(RedisCallback, self).__init__()
@@ -37,6 +40,10 @@ class RedisCallback(BaseCallback):
         self.workflow_event_key = f'workflow:{unique_id}:event'
         self.workflow_input_key = f'workflow:{unique_id}:input'
         self.workflow_stop_key = f'workflow:{unique_id}:stop'
+        # 用户输入和停止的信号，等待用户输入时阻塞读取此队列
+        self.workflow_signal_key = f'workflow:{unique_id}:signal'
+        # 挂起的workflow的运行状态
+        self.workflow_checkpoint_key = f'workflow:{unique_id}:checkpoint'
         self.workflow_expire_time = settings.get_workflow_conf().timeout * 60 + 60
 
     def set_workflow_data(self, data: dict):
@@ -45,20 +52,24 @@ class RedisCallback(BaseCallback):
     def get_workflow_data(self) -> dict:
         return self.redis_client.get(self.workflow_data_key)
 
-    def set_workflow_status(self, status: int, reason: str = None):
+    def set_workflow_status(self, status: int, reason: str = None, deadline: float = None):
+        """ deadline: 挂起等待用户输入时, 输入的截止时间 """
         self.redis_client.set(self.workflow_status_key,
-                              {'status': status, 'reason': reason, 'time': time.time()},
+                              {'status': status, 'reason': reason, 'time': time.time(), 'deadline': deadline},
                               expiration=None)
         if status in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
             # 消息事件和状态key可能还需要消费
             self.redis_client.delete(self.workflow_data_key)
             self.redis_client.delete(self.workflow_input_key)
+            self.redis_client.delete(self.workflow_signal_key)
+            self.redis_client.delete(self.workflow_checkpoint_key)
+            self.insert_workflow_response({'category': self.status_notify_category, 'status': status})
 
     def get_workflow_status(self, user_cache: bool = True) -> dict | None:
         if user_cache and self.workflow_cache.get(self.workflow_status_key):
             return self.workflow_cache.get(self.workflow_status_key)
         workflow_status = self.redis_client.get(self.workflow_status_key)
-        self.workflow_cache.setdefault(self.workflow_status_key, workflow_status)
+        self.workflow_cache[self.workflow_status_key] = workflow_status
         return workflow_status
 
     def clear_workflow_status(self):
@@ -67,18 +78,43 @@ class RedisCallback(BaseCallback):
     def insert_workflow_response(self, event: dict):
         self.redis_client.rpush(self.workflow_event_key, json.dumps(event), expiration=self.workflow_expire_time)
 
+    def parse_workflow_response(self, response: bytes | str) -> dict:
+        response = json.loads(response)
+        if (response.get('category') == 'node_run' and response.get('type') == 'end'
+                and response.get('message', {}).get('node_id', '').startswith('end_')):
+            # 如果是结束节点，清空状态缓存
+            self.workflow_cache.clear()
+        return response
+
     def get_workflow_response(self):
-        response = self.redis_client.lpop(self.workflow_event_key)
-        if response:
-            response = json.loads(response)
-            if (response.get('category') == 'node_run' and response.get('type') == 'end'
-                    and response.get('message', {}).get('node_id', '').startswith('end_')):
-                # 如果是结束节点，清空状态缓存
+        while True:
+            response = self.redis_client.lpop(self.workflow_event_key)
+            if not response:
+                return None
+            response = self.parse_workflow_response(response)
+            if response.get('category') != self.status_notify_category:
+                return response
+
+    async def aget_workflow_responses(self, count: int = 50, timeout: int = 5) -> (list, bool):
+        """
+        阻塞等待workflow返回的消息，有消息时立即返回，一次最多返回count条
+        return: 消息列表, workflow状态是否发生了变化
+        """
+        responses = await self.redis_client.ablpop(self.workflow_event_key, timeout, count)
+        result = []
+        status_changed = False
+        for one in responses:
+            one = self.parse_workflow_response(one)
+            if one.get('category') == self.status_notify_category:
+                status_changed = True
                 self.workflow_cache.clear()
-        return response
+                continue
+            result.append(one)
+        return result, status_changed
 
     def set_user_input(self, data: dict):
         self.redis_client.set(self.workflow_input_key, data, expiration=self.workflow_expire_time)
+        self.redis_client.rpush(self.workflow_signal_key, 'input', expiration=self.workflow_expire_time)
 
     def get_user_input(self) -> dict | None:
         ret = self.redis_client.get(self.workflow_input_key)
@@ -86,13 +122,62 @@ class RedisCallback(BaseCallback):
             self.redis_client.delete(self.workflow_input_key)
         return ret
 
+    def wait_user_input(self, timeout: int) -> dict:
+        """ 阻塞等待用户的输入或者停止信号，超时或者被停止时抛出异常 """
+        end_time = time.time() + timeout
+        while True:
+            if self.get_workflow_stop():
+                raise IgnoreException('workflow stop by user')
+            user_input = self.get_user_input()
+            if user_input:
+                return user_input
+            remain_time = end_time - time.time()
+            if remain_time <= 0:
+                raise IgnoreException('workflow wait user input timeout')
+            self.redis_client.blpop(self.workflow_signal_key, timeout=int(remain_time) + 1)
+
     def set_workflow_stop(self):
         self.redis_client.set(self.workflow_stop_key, 1, expiration=self.workflow_expire_time)
+        self.redis_client.rpush(self.workflow_signal_key, 'stop', expiration=self.workflow_expire_time)
+        if self.is_workflow_suspended():
+            # 挂起的workflow没有worker在执行，直接结束
+            self.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow stop by user')
 
     def get_workflow_stop(self) -> bool | None:
         """ 为了可以及时停止workflow，不做内存的缓存 """
         return self.redis_client.get(self.workflow_stop_key) == 1
 
+    def set_workflow_checkpoint(self, checkpoint: dict, deadline: float = None) -> float:
+        """ 挂起workflow，保存运行状态和等待用户输入的截止时间, 返回截止时间 """
+        if deadline is None:
+            deadline = time.time() + settings.get_workflow_conf().timeout * 60
+        self.redis_client.set(self.workflow_checkpoint_key, {'checkpoint': checkpoint, 'deadline': deadline},
+                              expiration=self.workflow_expire_time)
+        # 恢复执行时需要重新读取workflow的数据
+        self.redis_client.expire_key(self.workflow_data_key, self.workflow_expire_time)
+        return deadline
+
+    def pop_workflow_checkpoint(self) -> dict | None:
+        """ 获取挂起的workflow的运行状态和截止时间，获取后删除, 同时恢复执行时只有一方能拿到 """
+        return self.redis_client.getdel(self.workflow_checkpoint_key)
+
+    def check_input_timeout(self) -> bool:
+        """
+        挂起的workflow等待用户输入超过截止时间时结束workflow, 返回是否超时
+        超时后检查点可能已经过期, 没有任务会再恢复执行, 需要在这里把状态改成失败
+        """
+        status_info = self.get_workflow_status(user_cache=False)
+        if not status_info or status_info['status'] != WorkflowStatus.INPUT.value:
+            return False
+        deadline = status_info.get('deadline')
+        if not deadline or time.time() <= deadline:
+            return False
+        self.set_workflow_status(WorkflowStatus.FAILED.value, 'workflow wait user input timeout')
+        return True
+
+    def is_workflow_suspended(self) -> bool:
+        return bool(self.redis_client.exists(self.workflow_checkpoint_key))
+
     def send_chat_response(self, chat_response: ChatResponse):
         """ 发送聊天消息 """
         self.insert_workflow_response(chat_response.dict())
@@ -1,3 +1,4 @@
+import asyncio
 import time
 
 from loguru import logger
@@ -6,10 +7,82 @@ from bisheng.settings import settings
 from bisheng.utils.exceptions import IgnoreException
 from bisheng.worker.main import bisheng_celery
 from bisheng.worker.workflow.redis_callback import RedisCallback
+from bisheng.workflow.checkpoint.base_checkpoint import WorkflowCheckpointer
+from bisheng.workflow.checkpoint.redis_checkpoint import RedisCheckpointStore
+from bisheng.workflow.checkpoint.sql_checkpoint import SqlCheckpointStore
 from bisheng.workflow.common.workflow import WorkflowStatus
 from bisheng.workflow.graph.workflow import Workflow
 
 
+def _init_checkpointer(redis_callback: RedisCallback, checkpointer_type: str) -> WorkflowCheckpointer | None:
+    if checkpointer_type == 'redis':
+        return WorkflowCheckpointer(RedisCheckpointStore(expiration=redis_callback.workflow_expire_time))
+    elif checkpointer_type == 'sql':
+        return WorkflowCheckpointer(SqlCheckpointStore(expiration=redis_callback.workflow_expire_time))
+    # 默认使用langgraph的内存checkpointer
+    return None
+
+
+def _clear_checkpoint(redis_callback: RedisCallback):
+    """ 运行异常结束时清理持久化的运行状态 """
+    try:
+        checkpointer = _init_checkpointer(redis_callback, settings.get_workflow_conf().checkpointer)
+        if checkpointer:
+            checkpointer.delete_thread(redis_callback.unique_id)
+    except Exception as e:
+        logger.warning(f'clear workflow checkpoint error: {e}')
+
+
+def _init_workflow(redis_callback: RedisCallback) -> Workflow:
+    # get workflow data
+    workflow_data = redis_callback.get_workflow_data()
+    if not workflow_data:
+        raise Exception('workflow data not found maybe data is expired')
+
+    # init workflow
+    workflow_conf = settings.get_workflow_conf()
+    workflow = Workflow(redis_callback.workflow_id, redis_callback.user_id, workflow_data,
+                        workflow_conf.async_mode,
+                        workflow_conf.max_steps,
+                        workflow_conf.timeout,
+                        redis_callback,
+                        checkpointer=_init_checkpointer(redis_callback, workflow_conf.checkpointer),
+                        thread_id=redis_callback.unique_id)
+    redis_callback.workflow = workflow
+    return workflow
+
+
+def _execute(workflow: Workflow, input_data: dict = None) -> (str, str):
+    """ 异步模式下节点在事件循环里并发执行, 同步的操作放到节点线程池里 """
+    if workflow.graph_engine.async_mode:
+        return asyncio.run(workflow.arun(input_data))
+    return workflow.run(input_data)
+
+
+def _run_workflow(redis_callback: RedisCallback, workflow: Workflow, status: str, reason: str):
+    """ 处理workflow的运行状态，直到运行结束或者挂起 """
+    suspend_on_input = settings.get_workflow_conf().suspend_on_input
+    while True:
+        logger.debug(f'workflow {redis_callback.unique_id} execute status: {workflow.status()}')
+        if workflow.status() in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
+            redis_callback.set_workflow_status(status, reason)
+            workflow.clear_checkpoint()
+            break
+        elif workflow.status() == WorkflowStatus.INPUT.value:
+            if suspend_on_input:
+                # 先保存运行状态再更新状态，保证收到用户输入时可以恢复执行
+                deadline = redis_callback.set_workflow_checkpoint(workflow.get_checkpoint())
+                redis_callback.set_workflow_status(status, reason, deadline=deadline)
+                logger.debug(f'workflow {redis_callback.unique_id} suspend to wait user input')
+                break
+            redis_callback.set_workflow_status(status, reason)
+            user_input = redis_callback.wait_user_input(workflow.timeout * 60)
+            redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
+            status, reason = _execute(workflow, user_input)
+        else:
+            raise Exception(f'unexpected workflow status error: {status}')
+
+
 @bisheng_celery.task
 def execute_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: str):
     """ 执行workflow """
@@ -17,48 +90,48 @@ def execute_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: st
     try:
         # update workflow status
         redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
-        # get workflow data
-        workflow_data = redis_callback.get_workflow_data()
-        if not workflow_data:
-            raise Exception('workflow data not found maybe data is expired')
-
-        # init workflow
-        workflow_conf = settings.get_workflow_conf()
-        workflow = Workflow(workflow_id, user_id, workflow_data, False,
-                            workflow_conf.max_steps,
-                            workflow_conf.timeout,
-                            redis_callback)
-        redis_callback.workflow = workflow
-        start_time = time.time()
-        status, reason = workflow.run()
-        first_input = True
-        # run workflow
-        while True:
-            logger.debug(f'workflow {unique_id} execute status: {workflow.status()}')
-            if workflow.status() in [WorkflowStatus.FAILED.value, WorkflowStatus.SUCCESS.value]:
-                redis_callback.set_workflow_status(status, reason)
-                break
-            elif workflow.status() == WorkflowStatus.INPUT.value:
-                if first_input:
-                    start_time = time.time()
-                    first_input = False
-                redis_callback.set_workflow_status(status, reason)
-                time.sleep(1)
-                if time.time() - start_time > workflow.timeout * 60:
-                    raise IgnoreException('workflow wait user input timeout')
-                if redis_callback.get_workflow_stop():
-                    raise IgnoreException('workflow stop by user')
-                user_input = redis_callback.get_user_input()
-                if not user_input:
-                    continue
-                redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
-                status, reason = workflow.run(user_input)
-                first_input = True
-            else:
-                raise Exception(f'unexpected workflow status error: {status}')
+        workflow = _init_workflow(redis_callback)
+        status, reason = _execute(workflow)
+        _run_workflow(redis_callback, workflow, status, reason)
     except IgnoreException as e:
         logger.warning(f'execute_workflow ignore error: {e}')
         redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e))
+        _clear_checkpoint(redis_callback)
     except Exception as e:
         logger.exception('execute_workflow error')
         redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e)[:100])
+        _clear_checkpoint(redis_callback)
+
+
+@bisheng_celery.task
+def resume_workflow(unique_id: str, workflow_id: str, chat_id: str, user_id: str):
+    """ 收到用户输入后，恢复执行挂起的workflow """
+    redis_callback = RedisCallback(unique_id, workflow_id, chat_id, user_id)
+    try:
+        checkpoint = redis_callback.pop_workflow_checkpoint()
+        if not checkpoint:
+            # 已经被其它任务恢复执行, 或者等待输入超时后检查点过期了
+            if not redis_callback.check_input_timeout():
+                logger.warning(f'workflow {unique_id} not suspended or already resumed')
+            return
+        if time.time() > checkpoint['deadline']:
+            raise IgnoreException('workflow wait user input timeout')
+        user_input = redis_callback.get_user_input()
+        if not user_input:
+            # 没有用户输入，继续挂起
+            redis_callback.set_workflow_checkpoint(checkpoint['checkpoint'], checkpoint['deadline'])
+            return
+
+        redis_callback.set_workflow_status(WorkflowStatus.RUNNING.value)
+        workflow = _init_workflow(redis_callback)
+        workflow.load_checkpoint(checkpoint['checkpoint'])
+        status, reason = _execute(workflow, user_input)
+        _run_workflow(redis_callback, workflow, status, reason)
+    except IgnoreException as e:
+        logger.warning(f'resume_workflow ignore error: {e}')
+        redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e))
+        _clear_checkpoint(redis_callback)
+    except Exception as e:
+        logger.exception('resume_workflow error')
+        redis_callback.set_workflow_status(WorkflowStatus.FAILED.value, str(e)[:100])
+        _clear_checkpoint(redis_callback)
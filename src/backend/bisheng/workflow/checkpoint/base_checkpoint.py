@@ -0,0 +1,235 @@
+import pickle
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata,
+                                       CheckpointTuple, get_checkpoint_id)
+
+# 超过这个大小的数据压缩后再存储
+COMPRESS_THRESHOLD = 1024
+
+
+def dumps(obj: Any) -> bytes:
+    """ 紧凑的序列化: pickle, 数据较大时用zlib压缩, 首字节标记是否压缩 """
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) > COMPRESS_THRESHOLD:
+        return b'z' + zlib.compress(data, 1)
+    return b'p' + data
+
+
+def loads(data: bytes) -> Any:
+    if data[:1] == b'z':
+        return pickle.loads(zlib.decompress(data[1:]))
+    return pickle.loads(data[1:])
+
+
+class BaseCheckpointStore(ABC):
+    """
+    checkpoint的存储后端, 每个workflow运行(thread_id)对应一组 字段->数据 的映射
+    每步只写入发生变化的字段，读取时一次读出全部字段
+    """
+
+    @abstractmethod
+    def get_fields(self, thread_id: str) -> Dict[str, bytes]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_fields(self, thread_id: str, items: Dict[str, bytes]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_thread(self, thread_id: str):
+        raise NotImplementedError
+
+
+class MemoryCheckpointStore(BaseCheckpointStore):
+    """ 进程内的存储，不能跨进程恢复，用于测试 """
+
+    def __init__(self):
+        self.storage: Dict[str, Dict[str, bytes]] = {}
+
+    def get_fields(self, thread_id: str) -> Dict[str, bytes]:
+        return dict(self.storage.get(thread_id, {}))
+
+    def put_fields(self, thread_id: str, items: Dict[str, bytes]):
+        self.storage.setdefault(thread_id, {}).update(items)
+
+    def delete_thread(self, thread_id: str):
+        self.storage.pop(thread_id, None)
+
+
+class WorkflowCheckpointer(BaseCheckpointSaver):
+    """
+    langgraph的checkpointer, 数据存储在可插拔的存储后端里, 任意进程都可以根据thread_id恢复workflow
+
+    只保留最新的checkpoint, 每步只写入增量:
+        checkpoint:{ns}         checkpoint的元数据(不包含channel的值)
+        channel:{ns}:{channel}  channel的值, 只有版本发生变化的channel才会写入
+        writes:{ns}             最新checkpoint的pending writes
+        state:{key}             GraphState等workflow自身的状态, 由GraphEngine按需写入
+    """
+
+    state_prefix = 'state:'
+
+    def __init__(self, store: BaseCheckpointStore):
+        super().__init__()
+        self.store = store
+        # 当前进程内最新写入的writes, 避免每次put_writes都需要读取存储
+        self._writes_cache: Dict[Tuple[str, str], Dict] = {}
+
+    @staticmethod
+    def _parse_config(config: RunnableConfig) -> Tuple[str, str]:
+        return config['configurable']['thread_id'], config['configurable'].get('checkpoint_ns', '')
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id, checkpoint_ns = self._parse_config(config)
+        fields = self.store.get_fields(thread_id)
+        checkpoint_data = fields.get(f'checkpoint:{checkpoint_ns}')
+        if not checkpoint_data:
+            return None
+        checkpoint_data = loads(checkpoint_data)
+        checkpoint: Checkpoint = checkpoint_data['checkpoint']
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id and checkpoint_id != checkpoint['id']:
+            # 历史的checkpoint不保留
+            return None
+
+        channel_values = {}
+        for channel, version in checkpoint['channel_versions'].items():
+            channel_data = fields.get(f'channel:{checkpoint_ns}:{channel}')
+            if not channel_data:
+                continue
+            channel_version, value = loads(channel_data)
+            if channel_version == version:
+                channel_values[channel] = value
+        checkpoint = {**checkpoint, 'channel_values': channel_values}
+
+        pending_writes = []
+        writes_data = fields.get(f'writes:{checkpoint_ns}')
+        if writes_data:
+            writes_data = loads(writes_data)
+            if writes_data['checkpoint_id'] == checkpoint['id']:
+                pending_writes = [(task_id, channel, value)
+                                  for (task_id, _), (channel, value) in writes_data['writes'].items()]
+
+        parent_config = None
+        if checkpoint_data['parent_id']:
+            parent_config = {'configurable': {'thread_id': thread_id,
+                                              'checkpoint_ns': checkpoint_ns,
+                                              'checkpoint_id': checkpoint_data['parent_id']}}
+        return CheckpointTuple(
+            config={'configurable': {'thread_id': thread_id,
+                                     'checkpoint_ns': checkpoint_ns,
+                                     'checkpoint_id': checkpoint['id']}},
+            checkpoint=checkpoint,
+            metadata=checkpoint_data['metadata'],
+            parent_config=parent_config,
+            pending_writes=pending_writes,
+        )
+
+    def list(self,
+             config: Optional[RunnableConfig],
+             *,
+             filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None,
+             limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        if not config:
+            return
+        checkpoint_tuple = self.get_tuple(config)
+        if not checkpoint_tuple:
+            return
+        if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+            return
+        if before and get_checkpoint_id(before) == checkpoint_tuple.checkpoint['id']:
+            return
+        yield checkpoint_tuple
+
+    def put(self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id, checkpoint_ns = self._parse_config(config)
+        checkpoint = checkpoint.copy()
+        channel_values = checkpoint.pop('channel_values', {})
+        items = {
+            f'checkpoint:{checkpoint_ns}': dumps({
+                'checkpoint': checkpoint,
+                'metadata': metadata,
+                'parent_id': config['configurable'].get('checkpoint_id'),
+            })
+        }
+        for channel, version in new_versions.items():
+            if channel in channel_values:
+                items[f'channel:{checkpoint_ns}:{channel}'] = dumps((version, channel_values[channel]))
+        self.store.put_fields(thread_id, items)
+        return {'configurable': {'thread_id': thread_id,
+                                 'checkpoint_ns': checkpoint_ns,
+                                 'checkpoint_id': checkpoint['id']}}
+
+    def put_writes(self,
+                   config: RunnableConfig,
+                   writes: Sequence[Tuple[str, Any]],
+                   task_id: str,
+                   task_path: str = '') -> None:
+        thread_id, checkpoint_ns = self._parse_config(config)
+        checkpoint_id = config['configurable']['checkpoint_id']
+        cache_key = (thread_id, checkpoint_ns)
+        if cache_key not in self._writes_cache:
+            # 进程内第一次写入, 可能是从其他进程恢复的workflow, 需要读取已经存储的writes
+            stored_writes = self.store.get_fields(thread_id).get(f'writes:{checkpoint_ns}')
+            if stored_writes:
+                self._writes_cache[cache_key] = loads(stored_writes)
+        writes_data = self._writes_cache.get(cache_key)
+        if not writes_data or writes_data['checkpoint_id'] != checkpoint_id:
+            writes_data = {'checkpoint_id': checkpoint_id, 'writes': {}}
+            self._writes_cache[cache_key] = writes_data
+        for idx, (channel, value) in enumerate(writes):
+            writes_data['writes'][(task_id, idx)] = (channel, value)
+        self.store.put_fields(thread_id, {f'writes:{checkpoint_ns}': dumps(writes_data)})
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(self,
+                    config: Optional[RunnableConfig],
+                    *,
+                    filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        for one in self.list(config, filter=filter, before=before, limit=limit):
+            yield one
+
+    async def aput(self,
+                   config: RunnableConfig,
+                   checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self,
+                          config: RunnableConfig,
+                          writes: Sequence[Tuple[str, Any]],
+                          task_id: str,
+                          task_path: str = '') -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    def put_state(self, thread_id: str, state: Dict[str, Any]):
+        """ 写入workflow自身的状态，只需要传入发生变化的部分 """
+        if not state:
+            return
+        self.store.put_fields(thread_id, {f'{self.state_prefix}{k}': dumps(v) for k, v in state.items()})
+
+    def get_state(self, thread_id: str) -> Dict[str, Any]:
+        fields = self.store.get_fields(thread_id)
+        return {
+            k[len(self.state_prefix):]: loads(v)
+            for k, v in fields.items() if k.startswith(self.state_prefix)
+        }
+
+    def delete_thread(self, thread_id: str):
+        """ workflow运行结束后清理所有的状态 """
+        self._writes_cache = {k: v for k, v in self._writes_cache.items() if k[0] != thread_id}
+        self.store.delete_thread(thread_id)
@@ -0,0 +1,26 @@
+from typing import Dict
+
+from bisheng.cache.redis import redis_client
+from bisheng.workflow.checkpoint.base_checkpoint import BaseCheckpointStore
+
+
+class RedisCheckpointStore(BaseCheckpointStore):
+    """ 每个workflow运行的状态存储在一个redis hash里 """
+
+    def __init__(self, expiration: int = 3600):
+        self.redis_client = redis_client
+        self.expiration = expiration
+
+    @staticmethod
+    def _key(thread_id: str) -> str:
+        return f'workflow:{thread_id}:graph_checkpoint'
+
+    def get_fields(self, thread_id: str) -> Dict[str, bytes]:
+        ret = self.redis_client.hgetall(self._key(thread_id))
+        return {k.decode() if isinstance(k, bytes) else k: v for k, v in ret.items()}
+
+    def put_fields(self, thread_id: str, items: Dict[str, bytes]):
+        self.redis_client.hset(self._key(thread_id), mapping=items, expiration=self.expiration)
+
+    def delete_thread(self, thread_id: str):
+        self.redis_client.delete(self._key(thread_id))
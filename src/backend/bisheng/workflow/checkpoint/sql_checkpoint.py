@@ -0,0 +1,54 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+from loguru import logger
+
+from bisheng.database.models.workflow_checkpoint import WorkflowCheckpointDao
+from bisheng.workflow.checkpoint.base_checkpoint import BaseCheckpointStore
+
+
+class SqlCheckpointStore(BaseCheckpointStore):
+    """
+    状态存储在数据库里，每个字段一行
+    超过expiration没有更新的运行状态视为过期: 读取时直接删除, 写入时每隔cleanup_interval秒清理一次所有过期的行
+    """
+
+    # 本进程上一次清理过期数据的时间
+    _last_cleanup = 0
+    _cleanup_lock = threading.Lock()
+
+    def __init__(self, expiration: int = 3600, cleanup_interval: int = 600):
+        self.expiration = expiration
+        self.cleanup_interval = cleanup_interval
+
+    def _expire_before(self) -> datetime:
+        return datetime.now() - timedelta(seconds=self.expiration)
+
+    def get_fields(self, thread_id: str) -> Dict[str, bytes]:
+        rows = WorkflowCheckpointDao.get_rows(thread_id)
+        if rows and max(one.update_time for one in rows) < self._expire_before():
+            self.delete_thread(thread_id)
+            return {}
+        return {one.field: one.value for one in rows}
+
+    def put_fields(self, thread_id: str, items: Dict[str, bytes]):
+        WorkflowCheckpointDao.upsert_fields(thread_id, items)
+        self._cleanup()
+
+    def delete_thread(self, thread_id: str):
+        WorkflowCheckpointDao.delete_thread(thread_id)
+
+    def _cleanup(self):
+        """ 清理异常退出、没有被删除的运行状态 """
+        with self._cleanup_lock:
+            if time.time() - SqlCheckpointStore._last_cleanup < self.cleanup_interval:
+                return
+            SqlCheckpointStore._last_cleanup = time.time()
+        try:
+            count = WorkflowCheckpointDao.delete_expired(self._expire_before())
+            if count:
+                logger.info(f'delete expired workflow checkpoint rows={count}')
+        except Exception as e:
+            logger.warning(f'delete expired workflow checkpoint error: {e}')
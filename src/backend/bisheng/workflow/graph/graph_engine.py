@@ -1,6 +1,7 @@
 import operator
 from typing import Annotated, Any, Dict
 
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.constants import END, START
 from langgraph.graph import StateGraph
@@ -10,11 +11,12 @@ from typing_extensions import TypedDict
 from bisheng.utils.exceptions import IgnoreException
 from bisheng.workflow.callback.base_callback import BaseCallback
 from bisheng.workflow.callback.event import UserInputData
+from bisheng.workflow.checkpoint.base_checkpoint import WorkflowCheckpointer
 from bisheng.workflow.common.node import BaseNodeData, NodeType
 from bisheng.workflow.common.workflow import WorkflowStatus
 from bisheng.workflow.edges.edges import EdgeManage
 from bisheng.workflow.graph.graph_state import GraphState
-from bisheng.workflow.nodes.base import BaseNode
+from bisheng.workflow.nodes.base import BaseNode, run_in_node_executor
 from bisheng.workflow.nodes.node_manage import NodeFactory
 from bisheng.workflow.nodes.output.output_fake import OutputFakeNode
 
@@ -32,7 +34,9 @@ class GraphEngine:
                  workflow_data: Dict = None,
                  async_mode: bool = False,
                  max_steps: int = 0,
-                 callback: BaseCallback = None):
+                 callback: BaseCallback = None,
+                 checkpointer: BaseCheckpointSaver = None,
+                 thread_id: str = None):
         self.user_id = user_id
         self.workflow_id = workflow_id
         self.workflow_data = workflow_data
@@ -54,7 +58,12 @@ class GraphEngine:
         # init langgraph state graph
         self.graph_builder = StateGraph(TempState)
         self.graph = None
-        self.graph_config = {'configurable': {'thread_id': '1'}, 'recursion_limit': 50}
+        # 默认存储在进程内存里，使用WorkflowCheckpointer时可以在其他进程里恢复执行
+        self.checkpointer = checkpointer or MemorySaver()
+        self.thread_id = thread_id or '1'
+        self.graph_config = {'configurable': {'thread_id': self.thread_id}, 'recursion_limit': 50}
+        # 记录已持久化的节点运行次数，用来判断节点状态是否需要重新写入
+        self.saved_node_steps = {}
 
         self.status = WorkflowStatus.RUNNING.value
         self.reason = ''  # 失败原因
@@ -201,7 +210,7 @@ class GraphEngine:
         self.build_more_fan_in_node()
 
         # compile langgraph
-        self.graph = self.graph_builder.compile(checkpointer=MemorySaver(),
+        self.graph = self.graph_builder.compile(checkpointer=self.checkpointer,
                                                 interrupt_before=interrupt_nodes)
         self.graph_config['recursion_limit'] = (len(nodes) - len(end_nodes) - 1) * self.max_steps
 
@@ -214,7 +223,7 @@ class GraphEngine:
         try:
             self.status = WorkflowStatus.RUNNING.value
             for _ in self.graph.stream(input_data, config=self.graph_config):
-                pass
+                self.save_state()
             self.judge_status()
         except IgnoreException as e:
             logger.warning(f'graph ignore error: {e}')
@@ -229,7 +238,8 @@ class GraphEngine:
         try:
             self.status = WorkflowStatus.RUNNING.value
             async for _ in self.graph.astream(input_data, config=self.graph_config):
-                pass
+                # 持久化的存储只有同步实现
+                await run_in_node_executor(self.save_state)
             self.judge_status()
         except IgnoreException as e:
             logger.warning(f'graph ignore error: {e}')
@@ -259,6 +269,7 @@ class GraphEngine:
         for node_id, node_params in data.items():
             node_instance = self.nodes_map[node_id]
             node_instance.handle_input(node_params)
+            self.saved_node_steps.pop(node_id, None)
 
         # 继续执行graph
         self._run(None)
@@ -276,6 +287,7 @@ class GraphEngine:
         for node_id, node_params in data.items():
             node_instance = self.nodes_map[node_id]
             node_instance.handle_input(node_params)
+            self.saved_node_steps.pop(node_id, None)
 
         # 继续执行graph
         await self._arun(None)
@@ -307,6 +319,108 @@ class GraphEngine:
                     self.status = WorkflowStatus.INPUT.value
                     return
 
+    @property
+    def is_persistent(self) -> bool:
+        return isinstance(self.checkpointer, WorkflowCheckpointer)
+
+    def save_state(self):
+        """ 持久化checkpointer时，把每步发生变化的GraphState和节点状态写入存储 """
+        if not self.is_persistent:
+            return
+        state = {}
+        for key in self.graph_state.pop_changed_keys():
+            if key == 'history':
+                state[key] = self.graph_state.history_memory.chat_memory.messages
+            else:
+                state[key] = self.graph_state.variables_pool[key.split(':', 1)[1]]
+        for node_id, node_instance in self.nodes_map.items():
+            if not isinstance(node_instance, BaseNode):
+                continue
+            if self.saved_node_steps.get(node_id) != node_instance.current_step:
+                state[f'node:{node_id}'] = node_instance.get_checkpoint()
+                self.saved_node_steps[node_id] = node_instance.current_step
+        self.checkpointer.put_state(self.thread_id, state)
+
+    def restore_state(self):
+        """ 从持久化的存储里恢复GraphState和节点状态 """
+        state = self.checkpointer.get_state(self.thread_id)
+        for key, value in state.items():
+            if key == 'history':
+                if self.graph_state.history_memory:
+                    self.graph_state.history_memory.chat_memory.messages = list(value)
+            elif key.startswith('var:'):
+                self.graph_state.variables_pool[key.split(':', 1)[1]] = value
+            elif key.startswith('node:'):
+                node_id = key.split(':', 1)[1]
+                if node_id in self.nodes_map:
+                    self.nodes_map[node_id].load_checkpoint(value)
+                    self.saved_node_steps[node_id] = self.nodes_map[node_id].current_step
+        self.graph_state.pop_changed_keys()
+
+    def clear_state(self):
+        """ 运行结束后清理持久化的状态 """
+        if self.is_persistent:
+            self.checkpointer.delete_thread(self.thread_id)
+
+    def get_checkpoint(self) -> Dict:
+        """ 导出引擎的运行状态，用于挂起后在其他进程里恢复执行 """
+        if self.is_persistent:
+            # 状态已经在存储里，只需要写入最新的变化
+            self.save_state()
+            return {'thread_id': self.thread_id, 'status': self.status, 'reason': self.reason}
+
+        checkpoint_tuple = self.checkpointer.get_tuple(self.graph_config)
+        graph_checkpoint = None
+        if checkpoint_tuple:
+            graph_checkpoint = {
+                'checkpoint': checkpoint_tuple.checkpoint,
+                'metadata': checkpoint_tuple.metadata,
+                'pending_writes': checkpoint_tuple.pending_writes or [],
+            }
+        history = []
+        if self.graph_state.history_memory:
+            history = self.graph_state.history_memory.chat_memory.messages
+        return {
+            'graph': graph_checkpoint,
+            'variables_pool': self.graph_state.variables_pool,
+            'history': history,
+            'nodes': {
+                node_id: node_instance.get_checkpoint()
+                for node_id, node_instance in self.nodes_map.items() if isinstance(node_instance, BaseNode)
+            },
+            'status': self.status,
+            'reason': self.reason,
+        }
+
+    def load_checkpoint(self, data: Dict):
+        """ 从get_checkpoint导出的数据恢复引擎的运行状态 """
+        if data.get('thread_id'):
+            self.restore_state()
+            self.status = data['status']
+            self.reason = data['reason']
+            return
+
+        graph_checkpoint = data.get('graph')
+        if graph_checkpoint:
+            checkpoint = graph_checkpoint['checkpoint']
+            config = {'configurable': {**self.graph_config['configurable'], 'checkpoint_ns': ''}}
+            config = self.checkpointer.put(config, checkpoint, graph_checkpoint['metadata'],
+                                           checkpoint['channel_versions'])
+            task_writes = {}
+            for task_id, channel, value in graph_checkpoint['pending_writes']:
+                task_writes.setdefault(task_id, []).append((channel, value))
+            for task_id, writes in task_writes.items():
+                self.checkpointer.put_writes(config, writes, task_id)
+
+        self.graph_state.variables_pool = data['variables_pool']
+        if self.graph_state.history_memory:
+            self.graph_state.history_memory.chat_memory.messages = list(data['history'])
+        for node_id, node_checkpoint in data['nodes'].items():
+            if node_id in self.nodes_map:
+                self.nodes_map[node_id].load_checkpoint(node_checkpoint)
+        self.status = data['status']
+        self.reason = data['reason']
+
     def stop(self):
         for _, node_instance in self.nodes_map.items():
             node_instance.stop()
@@ -2,7 +2,7 @@ from typing import Any, Dict, Optional, List
 
 from langchain.memory import ConversationBufferWindowMemory
 from langchain_core.messages import AIMessage, HumanMessage, get_buffer_string, BaseMessage
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 
 class GraphState(BaseModel):
@@ -14,6 +14,9 @@ class GraphState(BaseModel):
     # 全局变量池
     variables_pool: Dict[str, Dict[str, Any]] = {}
 
+    # 上次持久化后发生变化的节点变量和聊天历史, 持久化时只写入这部分
+    _changed_keys: set = PrivateAttr(default_factory=set)
+
     def get_history_memory(self, count: int) -> str:
         """ 获取聊天历史记录
         因为不是1对1，所以重写 buffer_as_str"""
@@ -37,12 +40,20 @@ class GraphState(BaseModel):
             self.history_memory.chat_memory.add_messages([HumanMessage(content=content)])
         elif msg_sender == 'AI':
             self.history_memory.chat_memory.add_messages([AIMessage(content=content)])
+        self._changed_keys.add('history')
 
     def set_variable(self, node_id: str, key: str, value: Any):
         """ 将节点产生的数据放到全局变量里 """
         if node_id not in self.variables_pool:
             self.variables_pool[node_id] = {}
         self.variables_pool[node_id][key] = value
+        self._changed_keys.add(f'var:{node_id}')
+
+    def pop_changed_keys(self) -> set:
+        """ 返回上次调用后发生变化的key, var:{node_id} 或者 history """
+        changed_keys = self._changed_keys
+        self._changed_keys = set()
+        return changed_keys
 
     def get_variable(self, node_id: str, key: str, count: Optional[int] = None) -> Any:
         """ 从全局变量中获取数据 """
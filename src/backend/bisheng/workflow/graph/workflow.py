@@ -2,6 +2,8 @@ import json
 import time
 from typing import Dict
 
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
 from bisheng.workflow.callback.base_callback import BaseCallback
 from bisheng.workflow.common.workflow import WorkflowStatus
 from bisheng.workflow.graph.graph_engine import GraphEngine
@@ -16,7 +18,9 @@ class Workflow:
                  async_mode: bool = False,
                  max_steps: int = 0,
                  timeout: int = 0,
-                 callback: BaseCallback = None):
+                 callback: BaseCallback = None,
+                 checkpointer: BaseCheckpointSaver = None,
+                 thread_id: str = None):
 
         # 运行的唯一标识，保存到数据库的唯一ID
         self.workflow_id = workflow_id
@@ -31,7 +35,9 @@ class Workflow:
                                         workflow_id=workflow_id,
                                         workflow_data=workflow_data,
                                         max_steps=max_steps,
-                                        callback=callback)
+                                        callback=callback,
+                                        checkpointer=checkpointer,
+                                        thread_id=thread_id)
 
     def run(self, input_data: dict = None) -> (str, str):
         """
@@ -71,6 +77,20 @@ class Workflow:
             await self.graph_engine.acontinue_run()
         return self.graph_engine.status, self.graph_engine.reason
 
+    def get_checkpoint(self) -> Dict:
+        """ 导出workflow的运行状态 """
+        checkpoint = self.graph_engine.get_checkpoint()
+        checkpoint['current_time'] = self.current_time
+        return checkpoint
+
+    def load_checkpoint(self, checkpoint: Dict):
+        """ 恢复workflow的运行状态，之后调用run(input_data)继续执行 """
+        self.graph_engine.load_checkpoint(checkpoint)
+        self.current_time = checkpoint.get('current_time')
+
+    def clear_checkpoint(self):
+        self.graph_engine.clear_state()
+
     def stop(self):
         self.graph_engine.stop()
 
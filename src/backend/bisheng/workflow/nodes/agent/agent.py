@@ -8,7 +8,7 @@ from bisheng.interface.importing.utils import import_vectorstore
 from bisheng.interface.initialize.loading import instantiate_vectorstore
 from bisheng.utils.embedding import decide_embeddings
 from bisheng.workflow.callback.event import StreamMsgOverData
-from bisheng.workflow.nodes.base import BaseNode
+from bisheng.workflow.nodes.base import BaseNode, run_in_node_executor
 from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 from bisheng_langchain.gpts.assistant import ConfigurableAssistant
 from bisheng_langchain.gpts.load_tools import load_tools
@@ -209,7 +209,39 @@ class AgentNode(BaseNode):
         return instantiate_vectorstore('ElasticKeywordsSearch', class_object=class_obj, params=params)
 
     def _run(self, unique_id: str):
+        system_prompt = self._init_run()
+        self._init_agent(system_prompt)
+
+        ret = {}
+        if self._tab == 'single':
+            ret['output'] = self._run_once(None, unique_id, 'output')
+            self._on_output_over(unique_id, 'output', ret['output'])
+        else:
+            for index, one in enumerate(self.node_params['batch_variable']):
+                output_key = self.node_params['output'][index]['key']
+                ret[output_key] = self._run_once(one, unique_id, output_key)
+                self._on_output_over(unique_id, output_key, ret[output_key])
+        return self._handle_result(ret)
+
+    async def _arun(self, unique_id: str):
+        system_prompt = self._init_run()
+        # 初始化工具和知识库连接只有同步实现
+        await run_in_node_executor(self._init_agent, system_prompt)
+
         ret = {}
+        # 输出结束的回调需要写入数据库和redis, 放到线程池里执行
+        if self._tab == 'single':
+            ret['output'] = await self._arun_once(None, unique_id, 'output')
+            await run_in_node_executor(self._on_output_over, unique_id, 'output', ret['output'])
+        else:
+            for index, one in enumerate(self.node_params['batch_variable']):
+                output_key = self.node_params['output'][index]['key']
+                ret[output_key] = await self._arun_once(one, unique_id, output_key)
+                await run_in_node_executor(self._on_output_over, unique_id, output_key, ret[output_key])
+        return self._handle_result(ret)
+
+    def _init_run(self) -> str:
+        """ 重置运行日志, 返回格式化后的系统提示词 """
         variable_map = {}
 
         self._batch_variable_list = {}
@@ -221,23 +253,15 @@ class AgentNode(BaseNode):
             variable_map[one] = self.graph_state.get_variable_by_str(one)
         system_prompt = self._system_prompt.format(variable_map)
         self._system_prompt_list.append(system_prompt)
-        self._init_agent(system_prompt)
+        return system_prompt
 
-        if self._tab == 'single':
-            ret['output'] = self._run_once(None, unique_id, 'output')
-            self.callback_manager.on_stream_over(StreamMsgOverData(node_id=self.id,
-                                                                   msg=ret['output'],
-                                                                   unique_id=unique_id,
-                                                                   output_key='output'))
-        else:
-            for index, one in enumerate(self.node_params['batch_variable']):
-                output_key = self.node_params['output'][index]['key']
-                ret[output_key] = self._run_once(one, unique_id, output_key)
-                self.callback_manager.on_stream_over(StreamMsgOverData(node_id=self.id,
-                                                                       msg=ret[output_key],
-                                                                       unique_id=unique_id,
-                                                                       output_key=output_key))
+    def _on_output_over(self, unique_id: str, output_key: str, output: str):
+        self.callback_manager.on_stream_over(StreamMsgOverData(node_id=self.id,
+                                                               msg=output,
+                                                               unique_id=unique_id,
+                                                               output_key=output_key))
 
+    def _handle_result(self, ret: dict) -> dict:
         logger.debug('agent_over result={}', ret)
         if self._output_user:
             # 非stream 模式，处理结果
@@ -288,6 +312,16 @@ class AgentNode(BaseNode):
         """
         input_variable: 输入变量，如果是batch，则需要传入一个list，否则为None
         """
+        agent_input, config = self._init_agent_input(input_variable, unique_id, output_key)
+        result = self._agent.invoke(agent_input, config=config)
+        return self._parse_agent_output(result)
+
+    async def _arun_once(self, input_variable: str = None, unique_id: str = None, output_key: str = None):
+        agent_input, config = self._init_agent_input(input_variable, unique_id, output_key)
+        result = await self._agent.ainvoke(agent_input, config=config)
+        return self._parse_agent_output(result)
+
+    def _init_agent_input(self, input_variable: str = None, unique_id: str = None, output_key: str = None):
         # 说明是引用了批处理的变量, 需要把变量的值替换为用户选择的变量
         special_variable = f'{self.id}.batch_variable'
         variable_map = {}
@@ -323,16 +357,14 @@ class AgentNode(BaseNode):
         config = RunnableConfig(callbacks=[llm_callback])
 
         if self._agent_executor_type == 'ReAct':
-            result = self._agent.invoke({
-                'input': user,
-                'chat_history': chat_history
-            },
-                config=config)
+            return {'input': user, 'chat_history': chat_history}, config
+        chat_history.append(HumanMessage(content=user))
+        return chat_history, config
+
+    def _parse_agent_output(self, result: Any) -> str:
+        if self._agent_executor_type == 'ReAct':
             output = result['agent_outcome'].return_values['output']
             if isinstance(output, dict):
                 output = list(output.values())[0]
             return output
-        else:
-            chat_history.append(HumanMessage(content=user))
-            result = self._agent.invoke(chat_history, config=config)
-            return result[-1].content
+        return result[-1].content
@@ -1,8 +1,14 @@
+import asyncio
+import contextvars
 import copy
+import functools
+import threading
 import uuid
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List
 
+from bisheng.settings import settings
 from bisheng.utils.exceptions import IgnoreException
 from bisheng.workflow.callback.base_callback import BaseCallback
 from bisheng.workflow.callback.event import NodeEndData, NodeStartData
@@ -10,6 +16,27 @@ from bisheng.workflow.common.node import BaseNodeData, NodeType
 from bisheng.workflow.edges.edges import EdgeBase
 from bisheng.workflow.graph.graph_state import GraphState
 
+# 异步模式下执行同步节点逻辑的线程池, 限制同时运行的同步任务数量
+_node_executor: ThreadPoolExecutor | None = None
+_node_executor_lock = threading.Lock()
+
+
+def get_node_executor() -> ThreadPoolExecutor:
+    global _node_executor
+    if _node_executor is None:
+        with _node_executor_lock:
+            if _node_executor is None:
+                _node_executor = ThreadPoolExecutor(max_workers=settings.get_workflow_conf().node_max_workers,
+                                                    thread_name_prefix='workflow_node')
+    return _node_executor
+
+
+async def run_in_node_executor(func, *args) -> Any:
+    """ 在线程池里执行同步函数, 用于节点异步执行时调用只有同步实现的逻辑 """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_node_executor(),
+                                      functools.partial(contextvars.copy_context().run, func, *args))
+
 
 class BaseNode(ABC):
 
@@ -93,6 +120,14 @@ class BaseNode(ABC):
         # 将用户输入的数据更新到节点数里
         self.node_params.update(user_input)
 
+    def get_checkpoint(self) -> Dict[str, Any]:
+        """ 节点需要保存的运行状态，workflow挂起后恢复执行时使用 """
+        return {'current_step': self.current_step, 'node_params': self.node_params}
+
+    def load_checkpoint(self, checkpoint: Dict[str, Any]):
+        self.current_step = checkpoint['current_step']
+        self.node_params = checkpoint['node_params']
+
     def route_node(self, state: dict) -> str:
         """
         对应的langgraph的condition_edge的function，只有特殊节点需要
@@ -107,11 +142,14 @@ class BaseNode(ABC):
                 next_nodes.append(one.target)
         return next_nodes
 
-    def run(self, state: dict) -> Any:
+    async def _arun(self, unique_id: str) -> Dict[str, Any]:
         """
-        Run node entry
-        :return:
+        异步运行节点, 默认把同步的_run放到有界的线程池里执行，不阻塞事件循环
+        有原生异步实现的节点覆盖此函数
         """
+        return await run_in_node_executor(self._run, unique_id)
+
+    def _before_run(self) -> str:
         if self.stop_flag:
             raise IgnoreException('stop by user')
         if self.current_step >= self.max_steps:
@@ -121,29 +159,59 @@ class BaseNode(ABC):
         self.exec_unique_id = exec_id
         self.callback_manager.on_node_start(
             data=NodeStartData(unique_id=exec_id, node_id=self.id, name=self.name))
+        return exec_id
+
+    def _after_run(self, exec_id: str, result: Dict[str, Any]) -> Any:
+        log_data = self.parse_log(exec_id, result)
+        # 把节点输出存储到全局变量中
+        if result:
+            for key, value in result.items():
+                self.graph_state.set_variable(self.id, key, value)
+        self.current_step += 1
+        return log_data
+
+    def _on_node_end(self, exec_id: str, reason: str | None, log_data: Any):
+        # 输出节点的结束日志由fake节点输出
+        if reason or self.type != NodeType.OUTPUT.value:
+            self.callback_manager.on_node_end(data=NodeEndData(
+                unique_id=exec_id, node_id=self.id, name=self.name, reason=reason, log_data=log_data))
 
+    def run(self, state: dict) -> Any:
+        """
+        Run node entry
+        :return:
+        """
+        exec_id = self._before_run()
         reason = None
         log_data = None
         try:
             result = self._run(exec_id)
-            log_data = self.parse_log(exec_id, result)
-            # 把节点输出存储到全局变量中
-            if result:
-                for key, value in result.items():
-                    self.graph_state.set_variable(self.id, key, value)
-            self.current_step += 1
+            log_data = self._after_run(exec_id, result)
         except Exception as e:
             reason = str(e)
             raise e
         finally:
-            # 输出节点的结束日志由fake节点输出
-            if reason or self.type != NodeType.OUTPUT.value:
-                self.callback_manager.on_node_end(data=NodeEndData(
-                    unique_id=exec_id, node_id=self.id, name=self.name, reason=reason, log_data=log_data))
+            self._on_node_end(exec_id, reason, log_data)
         return state
 
     async def arun(self, state: dict) -> Any:
-        return self.run(state)
+        """
+        Async run node entry, langgraph可以并发执行没有依赖关系的分支
+        节点事件的回调是同步的redis和数据库操作, 放到线程池里执行, 不阻塞其他分支
+        :return:
+        """
+        exec_id = await run_in_node_executor(self._before_run)
+        reason = None
+        log_data = None
+        try:
+            result = await self._arun(exec_id)
+            log_data = self._after_run(exec_id, result)
+        except Exception as e:
+            reason = str(e)
+            raise e
+        finally:
+            await run_in_node_executor(self._on_node_end, exec_id, reason, log_data)
+        return state
 
     def stop(self):
         self.stop_flag = True
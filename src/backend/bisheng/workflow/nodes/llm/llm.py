@@ -36,9 +36,7 @@ class LLMNode(BaseNode):
                                                cache=False)
 
     def _run(self, unique_id: str):
-        self._system_prompt_list = []
-        self._user_prompt_list = []
-        self._batch_variable_list = {}
+        self._reset_log()
         result = {}
         if self._tab == 'single':
             result['output'] = self._run_once(None, unique_id, 'output')
@@ -46,7 +44,25 @@ class LLMNode(BaseNode):
             for index, one in enumerate(self.node_params['batch_variable']):
                 output_key = self.node_params['output'][index]['key']
                 result[output_key] = self._run_once(one, unique_id, output_key)
+        return self._handle_result(result)
+
+    async def _arun(self, unique_id: str):
+        self._reset_log()
+        result = {}
+        if self._tab == 'single':
+            result['output'] = await self._arun_once(None, unique_id, 'output')
+        else:
+            for index, one in enumerate(self.node_params['batch_variable']):
+                output_key = self.node_params['output'][index]['key']
+                result[output_key] = await self._arun_once(one, unique_id, output_key)
+        return self._handle_result(result)
+
+    def _reset_log(self):
+        self._system_prompt_list = []
+        self._user_prompt_list = []
+        self._batch_variable_list = {}
 
+    def _handle_result(self, result: dict) -> dict:
         if self._output_user:
             # 非stream 模式，处理结果
             for k, v in result.items():
@@ -68,6 +84,22 @@ class LLMNode(BaseNode):
                   input_variable: str = None,
                   unique_id: str = None,
                   output_key: str = None) -> str:
+        messages, config = self._init_llm_input(input_variable, unique_id, output_key)
+        result = self._llm.invoke(messages, config=config)
+        return result.content
+
+    async def _arun_once(self,
+                         input_variable: str = None,
+                         unique_id: str = None,
+                         output_key: str = None) -> str:
+        messages, config = self._init_llm_input(input_variable, unique_id, output_key)
+        result = await self._llm.ainvoke(messages, config=config)
+        return result.content
+
+    def _init_llm_input(self,
+                        input_variable: str = None,
+                        unique_id: str = None,
+                        output_key: str = None) -> (list, RunnableConfig):
         # 说明是引用了批处理的变量, 需要把变量的值替换为用户选择的变量
         special_variable = f'{self.id}.batch_variable'
         variable_map = {}
@@ -98,9 +130,4 @@ class LLMNode(BaseNode):
                                               output=self._output_user,
                                               output_key=output_key)
         config = RunnableConfig(callbacks=[llm_callback])
-
-        result = self._llm.invoke([SystemMessage(content=system),
-                                   HumanMessage(content=user)],
-                                  config=config)
-
-        return result.content
+        return [SystemMessage(content=system), HumanMessage(content=user)], config
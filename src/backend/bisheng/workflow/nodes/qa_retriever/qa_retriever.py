@@ -4,7 +4,7 @@ from typing import Any
 from bisheng.database.models.user import UserDao
 from bisheng.interface.initialize.loading import instantiate_vectorstore
 from bisheng.interface.vector_store.custom import MilvusWithPermissionCheck
-from bisheng.workflow.nodes.base import BaseNode
+from bisheng.workflow.nodes.base import BaseNode, run_in_node_executor
 from bisheng_langchain.chains.retrieval.retrieval_chain import RetrievalChain
 
 
@@ -43,6 +43,16 @@ class QARetrieverNode(BaseNode):
         self._init_retriever()
         question = self.graph_state.get_variable_by_str(self._user_question)
         result = self._retriever.invoke({'query': question})
+        return self._handle_result(result)
+
+    async def _arun(self, unique_id: str):
+        # 初始化向量库连接只有同步实现
+        await run_in_node_executor(self._init_retriever)
+        question = self.graph_state.get_variable_by_str(self._user_question)
+        result = await self._retriever.ainvoke({'query': question})
+        return self._handle_result(result)
+
+    def _handle_result(self, result: dict) -> dict:
         # qa 结果是document
         if result['result']:
             # 存检索结果的源文档，key左右加上$作为来源文档key去查询
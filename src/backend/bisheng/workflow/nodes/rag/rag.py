@@ -14,7 +14,7 @@ from bisheng.interface.importing.utils import import_vectorstore
 from bisheng.interface.initialize.loading import instantiate_vectorstore
 from bisheng.utils.minio_client import MinioClient
 from bisheng.workflow.callback.event import OutputMsgData, StreamMsgOverData
-from bisheng.workflow.nodes.base import BaseNode
+from bisheng.workflow.nodes.base import BaseNode, run_in_node_executor
 from bisheng.workflow.nodes.prompt_template import PromptTemplateParser
 from bisheng_langchain.rag.bisheng_rag_chain import BishengRetrievalQA
 
@@ -64,12 +64,37 @@ class RagNode(BaseNode):
         self._es = None
 
     def _run(self, unique_id: str):
+        retriever = self._init_retriever()
+        user_questions = self.init_user_question()
+        ret = {}
+        for index, question in enumerate(user_questions):
+            output_key = self.node_params['output_user_input'][index]['key']
+            llm_callback = self._init_llm_callback(unique_id, output_key)
+            result = retriever._call({'query': question}, run_manager=llm_callback)
+            ret[output_key] = self._handle_result(unique_id, output_key, retriever, llm_callback, result)
+        return ret
+
+    async def _arun(self, unique_id: str):
+        # 初始化向量库和es的连接只有同步实现
+        retriever = await run_in_node_executor(self._init_retriever)
+        user_questions = self.init_user_question()
+        ret = {}
+        for index, question in enumerate(user_questions):
+            output_key = self.node_params['output_user_input'][index]['key']
+            llm_callback = self._init_llm_callback(unique_id, output_key)
+            result = await retriever._acall({'query': question}, run_manager=llm_callback)
+            # 输出消息的回调需要写入数据库和redis
+            ret[output_key] = await run_in_node_executor(self._handle_result, unique_id, output_key, retriever,
+                                                         llm_callback, result)
+        return ret
+
+    def _init_retriever(self) -> BishengRetrievalQA:
         self.init_qa_prompt()
         self.init_milvus()
         self.init_es()
         self._log_source_documents = {}
 
-        retriever = BishengRetrievalQA.from_llm(
+        return BishengRetrievalQA.from_llm(
             llm=self._llm,
             vector_store=self._milvus,
             keyword_store=self._es,
@@ -78,40 +103,37 @@ class RagNode(BaseNode):
             sort_by_source_and_index=self._sort_chunks,
             return_source_documents=True,
         )
-        user_questions = self.init_user_question()
-        ret = {}
-        for index, question in enumerate(user_questions):
-            output_key = self.node_params['output_user_input'][index]['key']
-            # 因为rag需要溯源所以不能用通用llm callback来返回消息。需要拿到source_document之后在返回消息内容
-            llm_callback = LLMRagNodeCallbackHandler(callback=self.callback_manager,
-                                                     unique_id=unique_id,
-                                                     node_id=self.id,
-                                                     output=self._output_user,
-                                                     output_key=output_key)
 
-            result = retriever._call({'query': question}, run_manager=llm_callback)
+    def _init_llm_callback(self, unique_id: str, output_key: str) -> LLMRagNodeCallbackHandler:
+        # 因为rag需要溯源所以不能用通用llm callback来返回消息。需要拿到source_document之后在返回消息内容
+        return LLMRagNodeCallbackHandler(callback=self.callback_manager,
+                                         unique_id=unique_id,
+                                         node_id=self.id,
+                                         output=self._output_user,
+                                         output_key=output_key)
 
-            if self._output_user:
-                self.graph_state.save_context(content=result['result'], msg_sender='AI')
-                if llm_callback.output_len == 0:
-                    self.callback_manager.on_output_msg(
-                        OutputMsgData(node_id=self.id,
-                                      msg=result['result'],
-                                      unique_id=unique_id,
-                                      output_key=output_key,
-                                      source_documents=result['source_documents']))
-                else:
-                    # 说明有流式输出，则触发流式结束事件
-                    self.callback_manager.on_stream_over(StreamMsgOverData(
-                        node_id=self.id,
-                        msg=result['result'],
-                        unique_id=unique_id,
-                        source_documents=result['source_documents'],
-                        output_key=output_key,
-                    ))
-            ret[output_key] = result[retriever.output_key]
-            self._log_source_documents[output_key] = result['source_documents']
-        return ret
+    def _handle_result(self, unique_id: str, output_key: str, retriever: BishengRetrievalQA,
+                       llm_callback: LLMRagNodeCallbackHandler, result: dict) -> Any:
+        if self._output_user:
+            self.graph_state.save_context(content=result['result'], msg_sender='AI')
+            if llm_callback.output_len == 0:
+                self.callback_manager.on_output_msg(
+                    OutputMsgData(node_id=self.id,
+                                  msg=result['result'],
+                                  unique_id=unique_id,
+                                  output_key=output_key,
+                                  source_documents=result['source_documents']))
+            else:
+                # 说明有流式输出，则触发流式结束事件
+                self.callback_manager.on_stream_over(StreamMsgOverData(
+                    node_id=self.id,
+                    msg=result['result'],
+                    unique_id=unique_id,
+                    source_documents=result['source_documents'],
+                    output_key=output_key,
+                ))
+        self._log_source_documents[output_key] = result['source_documents']
+        return result[retriever.output_key]
 
     def parse_log(self, unique_id: str, result: dict) -> Any:
         output_keys = []
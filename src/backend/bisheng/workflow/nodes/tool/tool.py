@@ -26,6 +26,13 @@ class ToolNode(BaseNode):
             "output": output
         }
 
+    async def _arun(self, unique_id: str):
+        tool_input = self.parse_tool_input()
+        output = await self._tool.arun(tool_input=tool_input)
+        return {
+            "output": output
+        }
+
     def parse_log(self, unique_id: str, result: dict) -> Any:
         tool_input = self.parse_tool_input()
         ret = [
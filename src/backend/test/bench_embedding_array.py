@@ -0,0 +1,68 @@
+"""
+向量归一化和写入前处理的CPU和内存: 逐条归一化并转换成列表 vs 一次归一化的float32数组
+模拟模型返回的列表结果, 不依赖外部服务, 使用方式: python test/bench_embedding_array.py
+可以通过环境变量BENCH_ROWS、BENCH_DIM修改数据量, 默认100000 x 1024, 需要预留约8G内存
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.utils.embedding import normalize_embeddings  # noqa: E402
+
+ROWS = int(os.environ.get('BENCH_ROWS', 100000))
+DIM = int(os.environ.get('BENCH_DIM', 1024))
+# 模型单次请求的文本数
+MODEL_BATCH = 32
+# milvus单次insert的条数
+INSERT_BATCH = 1000
+
+
+def model_output():
+    # http接口返回的是列表, 分批返回
+    rng = np.random.default_rng(0)
+    return [rng.standard_normal((min(MODEL_BATCH, ROWS - i), DIM)).tolist() for i in range(0, ROWS, MODEL_BATCH)]
+
+
+def list_path(batches):
+    vectors = []
+    for ret in batches:
+        # 和之前BishengEmbedding.embed_documents一样逐条归一化
+        if np.linalg.norm(ret[0]) != 1:
+            ret = [(np.array(doc) / np.linalg.norm(doc)).tolist() for doc in ret]
+        vectors.extend(ret)
+    for i in range(0, len(vectors), INSERT_BATCH):
+        insert = vectors[i:i + INSERT_BATCH]
+    return len(vectors)
+
+
+def array_path(batches):
+    vectors = np.concatenate([normalize_embeddings(ret) for ret in batches])
+    for i in range(0, len(vectors), INSERT_BATCH):
+        # milvus写入时只转换当前批次
+        insert = vectors[i:i + INSERT_BATCH].tolist()
+    return len(vectors)
+
+
+def run_case(name: str, func, batches):
+    start, cpu_start = time.perf_counter(), time.process_time()
+    count = func(batches)
+    cost, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    # tracemalloc会明显拖慢python对象的分配, 内存单独跑一次
+    tracemalloc.start()
+    func(batches)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<8} rows={count} dim={DIM} wall={cost:.2f}s cpu={cpu:.2f}s '
+          f'peak_memory={peak / 1024 / 1024:.1f}MB')
+
+
+if __name__ == '__main__':
+    data = model_output()
+    run_case('list', list_path, data)
+    run_case('array', array_path, data)
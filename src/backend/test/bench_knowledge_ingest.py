@@ -0,0 +1,135 @@
+"""
+知识库文件入库的吞吐: 逐个文件串行处理 vs 解析、向量化、写入分阶段并发的流水线
+以及分块写入时milvus和es串行写入 vs KnowledgeSink并发写入
+解析、embedding、milvus/es写入用sleep模拟, 不依赖外部服务, 使用方式: python test/bench_knowledge_ingest.py
+"""
+import os
+import random
+import sys
+import time
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.api.services.knowledge_sink import ChunkBatch, KnowledgeSink  # noqa: E402
+from bisheng.utils.pipeline import PipelineStage, StagedPipeline  # noqa: E402
+
+FILE_NUM = 40
+# 每个文件的分块数范围
+CHUNK_RANGE = (20, 120)
+# 下载解析每个文件的耗时
+PARSE_TIME = 0.2
+# embedding每批的固定耗时和每个分块的耗时
+EMBED_BATCH_TIME = 0.02
+EMBED_CHUNK_TIME = 0.001
+EMBED_BATCH_SIZE = 32
+# 写入milvus和es每个文件的固定耗时和每个分块的耗时
+SINK_TIME = 0.05
+SINK_CHUNK_TIME = 0.0005
+
+
+class FakeFile:
+
+    def __init__(self, file_id: int, chunk_num: int):
+        self.file_id = file_id
+        self.chunk_num = chunk_num
+        self.texts = []
+        self.embeddings = None
+
+
+def parse(one: FakeFile) -> FakeFile:
+    time.sleep(PARSE_TIME)
+    one.texts = [f'file {one.file_id} chunk {i}' for i in range(one.chunk_num)]
+    return one
+
+
+def embed(one: FakeFile) -> FakeFile:
+    one.embeddings = []
+    for i in range(0, len(one.texts), EMBED_BATCH_SIZE):
+        batch = one.texts[i:i + EMBED_BATCH_SIZE]
+        time.sleep(EMBED_BATCH_TIME + EMBED_CHUNK_TIME * len(batch))
+        one.embeddings.extend([[0.0] * 8 for _ in batch])
+    return one
+
+
+def sink(one: FakeFile) -> FakeFile:
+    time.sleep(SINK_TIME + SINK_CHUNK_TIME * len(one.texts))
+    return one
+
+
+def run_serial(files):
+    for one in files:
+        sink(embed(parse(one)))
+
+
+def run_pipeline(files, parse_workers=4, embed_workers=2, sink_workers=2, queue_size=8):
+    stages = [
+        PipelineStage('parse', parse, parse_workers),
+        PipelineStage('embed', embed, embed_workers),
+        PipelineStage('sink', sink, sink_workers),
+    ]
+    StagedPipeline(stages, queue_size=queue_size).run(files)
+
+
+def run_case(name: str, func, **kwargs):
+    random.seed(0)
+    files = [FakeFile(i, random.randint(*CHUNK_RANGE)) for i in range(FILE_NUM)]
+    chunk_num = sum(one.chunk_num for one in files)
+    start = time.perf_counter()
+    func(files, **kwargs)
+    cost = time.perf_counter() - start
+    print(f'{name:<24} cost={cost:.2f}s files/min={FILE_NUM / cost * 60:.1f} '
+          f'chunks/s={chunk_num / cost:.1f}')
+
+
+class FakeEmbedding:
+    """ 第一次请求失败, 模拟embedding服务的偶发错误 """
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError('mock embedding error')
+        time.sleep(EMBED_BATCH_TIME + EMBED_CHUNK_TIME * len(texts))
+        return [[0.0] * 8 for _ in texts]
+
+
+class FakeStore:
+
+    def __init__(self, cost: float):
+        self.cost = cost
+        self.count = 0
+
+    def add_texts(self, texts, metadatas, **kwargs):
+        time.sleep(SINK_TIME + self.cost * len(texts))
+        self.count += len(texts)
+
+
+def run_sink_case(name: str, concurrent: bool):
+    texts = [f'chunk {i}' for i in range(CHUNK_RANGE[1])]
+    metadatas = [{'chunk_index': i} for i in range(len(texts))]
+    embedding, milvus, es = FakeEmbedding(), FakeStore(SINK_CHUNK_TIME), FakeStore(SINK_CHUNK_TIME)
+    sink = KnowledgeSink(milvus, es, embedding, EMBED_BATCH_SIZE, retry_interval=0.01)
+    start = time.perf_counter()
+    for _ in range(10):
+        batch = sink.embed(ChunkBatch(texts, metadatas))
+        if concurrent:
+            sink.write(batch)
+        else:
+            milvus.add_texts(batch.texts, batch.metadatas, embeddings=batch.embeddings)
+            es.add_texts(batch.texts, batch.metadatas)
+    cost = time.perf_counter() - start
+    assert milvus.count == es.count == len(texts) * 10
+    print(f'{name:<24} cost={cost:.2f}s chunks/s={milvus.count / cost:.1f} '
+          f'embed_calls={embedding.calls}')
+
+
+if __name__ == '__main__':
+    run_sink_case('sink sequential', concurrent=False)
+    run_sink_case('sink concurrent', concurrent=True)
+    run_case('serial', run_serial)
+    run_case('pipeline(1,1,1)', run_pipeline, parse_workers=1, embed_workers=1, sink_workers=1)
+    run_case('pipeline(4,2,2)', run_pipeline)
+    run_case('pipeline(8,4,4)', run_pipeline, parse_workers=8, embed_workers=4, sink_workers=4)
@@ -0,0 +1,67 @@
+"""
+扫描版pdf的OCR吞吐: 每个文本框单独识别 vs 所有页面的文本框裁剪后批量识别
+需要deepdoc的模型文件, 在CPU上运行, 使用方式: python test/bench_pdf_ocr.py scanned.pdf [页数]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pdfplumber
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.deepdoc.vision import OCR  # noqa: E402
+
+# 和RAGFlowPdfParser一样, 3倍缩放后再放大2倍
+ZOOMIN = 6
+
+
+def load_pages(file_path: str, page_num: int):
+    with pdfplumber.open(file_path) as pdf:
+        return [page.to_image(resolution=72 * ZOOMIN).annotated for page in pdf.pages[:page_num]]
+
+
+def detect_boxes(ocr: OCR, img: np.ndarray):
+    boxes = ocr.detect(img)
+    if not boxes:
+        return []
+    return [np.array(box, dtype=np.float32) for box, _ in boxes]
+
+
+def run_single(ocr: OCR, pages) -> int:
+    # 之前的实现: 每个文本框都重新转换整页图片, 单独跑一次识别模型
+    count = 0
+    for page in pages:
+        for box in detect_boxes(ocr, np.array(page)):
+            if ocr.recognize(np.array(page), box):
+                count += 1
+    return count
+
+
+def run_batch(ocr: OCR, pages) -> int:
+    crops = []
+    for page in pages:
+        img = np.array(page)
+        crops.extend(ocr.get_rotate_crop_image(img, box) for box in detect_boxes(ocr, img))
+    return sum(1 for text in ocr.recognize_batch(crops) if text)
+
+
+def run_case(name: str, func, ocr: OCR, pages):
+    start = time.perf_counter()
+    count = func(ocr, pages)
+    cost = time.perf_counter() - start
+    print(f'{name:<8} pages={len(pages)} boxes={count} cost={cost:.2f}s pages/s={len(pages) / cost:.2f}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python test/bench_pdf_ocr.py scanned.pdf [page_num]')
+        sys.exit(1)
+    pdf_pages = load_pages(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 20)
+    ocr_model = OCR()
+    # 预热, 排除模型加载的时间
+    run_batch(ocr_model, pdf_pages[:1])
+    run_case('single', run_single, ocr_model, pdf_pages)
+    run_case('batch', run_batch, ocr_model, pdf_pages)
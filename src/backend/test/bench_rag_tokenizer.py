@@ -0,0 +1,68 @@
+"""
+RagTokenizer分词: 递归枚举所有切分(dfs_ + sortTks_) vs 动态规划(bestSeg_)
+先在中英文混合的样例上校验两者结果一致, 再测试没有标点的长文本上的耗时是否随长度线性增长
+需要rag/res/huqie.txt词典, 使用方式: python test/bench_rag_tokenizer.py
+"""
+import os
+import re
+import sys
+import time
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.rag.nlp.rag_tokenizer import RagTokenizer, is_chinese  # noqa: E402
+
+SAMPLES = [
+    '公开征求意见稿提出，境外投资者可使用自有人民币或外汇投资。使用外汇投资的，可通过债券持有人在香港人民币业务清算行'
+    '及香港地区经批准可进入境内银行间外汇市场进行交易的境外人民币业务参加行（以下统称香港结算行）办理外汇资金兑换。',
+    '多校划片就是一个小区对应多个小学初中，让买了学区房的家庭也不确定到底能上哪个学校。目的是通过这种方式为学区房降温，'
+    '把就近入学落到实处。南京市长江大桥',
+    '实际上当时他们已经将业务中心偏移到安全部门和针对政府企业的部门 Scripts are compiled and cached aaaaaaaaa',
+    '虽然我不怎么玩',
+    '蓝月亮如何在外资夹击中生存,那是全宇宙最有意思的',
+    '涡轮增压发动机num最大功率,不像别的共享买车锁电子化的手段,我们接过来是否有意义,黄黄爱美食,不过，今天阿奇要讲到的'
+    '这家农贸市场，说实话，还真蛮有特色的！不仅环境好，还打出了',
+    '这周日你去吗？这周日你有空吗？',
+    'Unity3D开发经验 测试开发工程师 c++双11双11 985 211 ',
+    '数据分析项目经理|数据分析挖掘|数据分析方向|商品数据分析|搜索数据分析 sql python hive tableau Cocos2d-',
+    '哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈哈',
+]
+# dfs_ 的耗时随长度指数增长, 校验时只取这个长度以内的片段
+CHECK_LEN = 16
+LENGTHS = [1250, 2500, 5000, 10000]
+
+
+def check_same(tokenizer: RagTokenizer) -> int:
+    count = 0
+    for sample in SAMPLES:
+        line = tokenizer._tradi2simp(tokenizer._strQ2B(sample).lower())
+        for piece in re.split(tokenizer.SPLIT_CHAR, line):
+            if len(piece) < 2:
+                continue
+            for start in range(0, len(piece), CHECK_LEN // 2):
+                chars = piece[start:start + CHECK_LEN]
+                tkslist = []
+                tokenizer.dfs_(chars, 0, [], tkslist)
+                expect = tokenizer.sortTks_(tkslist)[0][0]
+                result = tokenizer.bestSeg_(chars)
+                assert expect == result, f'{chars}: {expect} != {result}'
+                count += 1
+    return count
+
+
+def long_text(length: int) -> str:
+    # 去掉标点和英文, 拼成一整段不会被切开的中文
+    chars = ''.join(c for c in ''.join(SAMPLES) if is_chinese(c))
+    return (chars * (length // len(chars) + 1))[:length]
+
+
+if __name__ == '__main__':
+    rag_tokenizer = RagTokenizer()
+    print(f'same result on {check_same(rag_tokenizer)} segments')
+    for n in LENGTHS:
+        text = long_text(n)
+        start = time.perf_counter()
+        tokens = rag_tokenizer.bestSeg_(text)
+        cost = time.perf_counter() - start
+        print(f'chars={n:<6} tokens={len(tokens):<6} cost={cost:.3f}s per_char={cost / n * 1e6:.1f}us')
@@ -0,0 +1,47 @@
+"""
+5000个分块的文档分词耗时: 逐个调用 tokenize + fine_grained_tokenize vs 多进程的 tokenize_batch
+校验两种方式的结果一致, 需要rag/res/huqie.txt词典, 使用方式: python test/bench_rag_tokenizer_batch.py [进程数]
+"""
+import os
+import random
+import sys
+import time
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.rag.nlp import rag_tokenizer  # noqa: E402
+from test.bench_rag_tokenizer import SAMPLES  # noqa: E402
+
+CHUNKS = 5000
+
+
+def make_chunks():
+    # 每个分块由几条样例随机拼成, 长度和知识库里常见的分块差不多
+    rng = random.Random(0)
+    return [''.join(rng.choices(SAMPLES, k=rng.randint(2, 6))) for _ in range(CHUNKS)]
+
+
+def run_sequential(chunks):
+    res = []
+    for chunk in chunks:
+        tks = rag_tokenizer.tokenize(chunk)
+        res.append((tks, rag_tokenizer.fine_grained_tokenize(tks)))
+    return res
+
+
+if __name__ == '__main__':
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    texts = make_chunks()
+
+    start = time.perf_counter()
+    expect = run_sequential(texts)
+    sequential_cost = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = rag_tokenizer.tokenize_batch(texts, workers=workers, fine_grained=True)
+    batch_cost = time.perf_counter() - start
+
+    assert result == expect, 'tokenize_batch result not equal to sequential result'
+    print(f'chunks={CHUNKS} chars={sum(len(one) for one in texts)} workers={workers}')
+    print(f'sequential={sequential_cost:.2f}s batch={batch_cost:.2f}s speedup={sequential_cost / batch_cost:.1f}x')
@@ -0,0 +1,42 @@
+"""
+1MB文本的全角转半角和繁体转简体: 原来逐字处理 vs str.translate
+使用方式: python test/bench_rag_tokenizer_normalize.py
+"""
+import os
+import sys
+import time
+
+from hanziconv import HanziConv
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.rag.nlp.rag_tokenizer import strQ2B, tradi2simp  # noqa: E402
+from test.bench_rag_tokenizer import SAMPLES  # noqa: E402
+from test.test_rag_tokenizer_normalize import str_q2b_reference  # noqa: E402
+
+TEXT_BYTES = 1024 * 1024
+
+
+def make_text() -> str:
+    # 样例里混入繁体字和全角字符
+    chunk = ''.join(SAMPLES) + '繁體中文與ＦＵＬＬＷＩＤＴＨ　１２３，'
+    text = chunk * (TEXT_BYTES // len(chunk.encode('utf-8')) + 1)
+    while len(text.encode('utf-8')) > TEXT_BYTES:
+        text = text[:-1024]
+    return text
+
+
+def run_case(name: str, func, text: str) -> str:
+    start = time.perf_counter()
+    result = func(text)
+    print(f'{name:<20} cost={time.perf_counter() - start:.3f}s')
+    return result
+
+
+if __name__ == '__main__':
+    data = make_text()
+    print(f'text chars={len(data)} bytes={len(data.encode("utf-8"))}')
+    assert run_case('strQ2B loop', str_q2b_reference, data) == run_case('strQ2B translate', strQ2B, data)
+    assert run_case('tradi2simp hanziconv', HanziConv.toSimplified, data) == \
+        run_case('tradi2simp translate', tradi2simp, data)
@@ -0,0 +1,50 @@
+"""
+RagTokenizer启动时加载词典: 从词典文本构建trie vs 加载按词典hash缓存的trie快照
+词典复制到临时目录里测试, 不影响已有的快照, 校验两种方式的分词结果一致
+需要rag/res/huqie.txt词典, 使用方式: python test/bench_rag_tokenizer_snapshot.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.rag.nlp.rag_tokenizer import RagTokenizer  # noqa: E402
+from test.bench_rag_tokenizer import SAMPLES  # noqa: E402
+
+
+def load(dict_file: str):
+    tokenizer = RagTokenizer()
+    start = time.perf_counter()
+    tokenizer.loadUserDict(dict_file)
+    return tokenizer, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        dict_file = os.path.join(tmp_dir, 'huqie.txt')
+        shutil.copy(RagTokenizer().DIR_ + '.txt', dict_file)
+
+        built, build_cost = load(dict_file)
+        assert os.path.exists(built.snapshot_(dict_file)), 'snapshot not saved'
+        loaded, load_cost = load(dict_file)
+        for sample in SAMPLES:
+            assert built.tokenize(sample) == loaded.tokenize(sample), sample
+            assert built.fine_grained_tokenize(built.tokenize(sample)) == \
+                loaded.fine_grained_tokenize(loaded.tokenize(sample)), sample
+        print(f'same result on {len(SAMPLES)} samples')
+        print(f'build={build_cost:.2f}s snapshot_load={load_cost:.2f}s speedup={build_cost / load_cost:.1f}x')
+
+        # 词典修改后重新构建, 旧的快照被清理
+        with open(dict_file, 'a', encoding='utf-8') as f:
+            f.write('毕昇知识库 10 n\n')
+        changed, _ = load(dict_file)
+        assert changed.freq('毕昇知识库') > 0
+        assert len([one for one in os.listdir(tmp_dir) if one.endswith('.trie')]) == 1
+        print('rebuild on dict change ok')
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,47 @@
+"""
+系统配置读取的吞吐: 每次从redis读取并解析yaml vs 进程内的版本化缓存
+需要本地可访问的redis和mysql, 使用方式: python test/bench_settings_config.py
+"""
+import os
+import sys
+import time
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+os.environ['config'] = os.path.join(parent_dir, 'bisheng/config.dev.yaml')
+
+from bisheng.cache.redis import redis_client  # noqa: E402
+from bisheng.settings import CONFIG_VERSION_KEY, settings  # noqa: E402
+
+DURATION = 3
+
+
+def read_without_cache():
+    # 和之前的get_all_config一样, 每次读取redis并解析yaml
+    settings._load_all_config(redis_client.get(CONFIG_VERSION_KEY))
+
+
+def read_with_cache():
+    settings.get_all_config()
+
+
+def read_knowledge():
+    # MinioClient初始化时会调用十几次get_knowledge
+    settings.get_knowledge()
+
+
+def run_case(name: str, func):
+    func()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        func()
+        count += 1
+    cost = time.perf_counter() - start
+    print(f'{name:<16} reads/s={count / cost:.0f} avg={cost / count * 1000000:.1f}us')
+
+
+if __name__ == '__main__':
+    run_case('no_cache', read_without_cache)
+    run_case('versioned_cache', read_with_cache)
+    run_case('get_knowledge', read_knowledge)
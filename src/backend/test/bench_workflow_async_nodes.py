@@ -0,0 +1,211 @@
+"""
+workflow并行分支的执行耗时: 同步模式(langgraph线程池) vs 异步模式(节点原生异步)
+用GraphEngine执行真实的workflow: start节点后并行N个LLM节点, 最后汇总到end节点
+LLM节点请求本地的fake LLM服务(固定延迟, 流式返回), 不需要数据库里的模型配置
+async_executor是LLMNode不使用原生异步时(BaseNode._arun放到线程池里执行)的耗时
+使用方式: python test/bench_workflow_async_nodes.py
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from langchain_openai import ChatOpenAI
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+os.environ['config'] = os.path.join(parent_dir, 'bisheng/config.dev.yaml')
+
+from bisheng.api.services.llm import LLMService  # noqa: E402
+from bisheng.workflow.callback.base_callback import BaseCallback  # noqa: E402
+from bisheng.workflow.common.workflow import WorkflowStatus  # noqa: E402
+from bisheng.workflow.graph.graph_engine import GraphEngine  # noqa: E402
+from bisheng.workflow.nodes.base import BaseNode  # noqa: E402
+from bisheng.workflow.nodes.llm.llm import LLMNode  # noqa: E402
+
+FAKE_LLM_HOST = '127.0.0.1'
+FAKE_LLM_PORT = 18080
+FAKE_LLM_URL = f'http://{FAKE_LLM_HOST}:{FAKE_LLM_PORT}/v1'
+# 模拟LLM的首token耗时和流式输出的token
+FAKE_LLM_DELAY = 0.5
+FAKE_LLM_TOKENS = ['o', 'k']
+MAX_STEPS = 10
+
+app = FastAPI()
+
+
+def completion_chunk(content: str, finish_reason: str = None) -> str:
+    chunk = {
+        'id': 'chatcmpl-bench',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': 'fake-llm',
+        'choices': [{
+            'index': 0,
+            'delta': {
+                'role': 'assistant',
+                'content': content
+            },
+            'finish_reason': finish_reason
+        }]
+    }
+    return f'data: {json.dumps(chunk)}\n\n'
+
+
+@app.post('/v1/chat/completions')
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(FAKE_LLM_DELAY)
+    if body.get('stream'):
+
+        async def stream():
+            for token in FAKE_LLM_TOKENS:
+                yield completion_chunk(token)
+            yield completion_chunk('', 'stop')
+            yield 'data: [DONE]\n\n'
+
+        return StreamingResponse(stream(), media_type='text/event-stream')
+    return {
+        'id': 'chatcmpl-bench',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': 'fake-llm',
+        'choices': [{
+            'index': 0,
+            'message': {
+                'role': 'assistant',
+                'content': ''.join(FAKE_LLM_TOKENS)
+            },
+            'finish_reason': 'stop'
+        }],
+        'usage': {
+            'prompt_tokens': 10,
+            'total_tokens': 12,
+            'completion_tokens': 2
+        }
+    }
+
+
+def start_fake_llm_server():
+    server = uvicorn.Server(uvicorn.Config(app, host=FAKE_LLM_HOST, port=FAKE_LLM_PORT, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+
+def get_fake_llm(**kwargs) -> ChatOpenAI:
+    """ 替换LLMNode里根据model_id从数据库获取模型的逻辑 """
+    return ChatOpenAI(model='fake-llm',
+                      base_url=FAKE_LLM_URL,
+                      api_key='fake',
+                      streaming=kwargs.get('params', {}).get('stream', False),
+                      max_retries=0)
+
+
+def edge(source: str, target: str) -> dict:
+    return {
+        'id': f'xy-edge__{source}right_handle-{target}left_handle',
+        'source': source,
+        'sourceHandle': 'right_handle',
+        'target': target,
+        'targetHandle': 'left_handle'
+    }
+
+
+def build_workflow_data(branch_num: int) -> dict:
+    start = {
+        'id': 'start_bench',
+        'type': 'start',
+        'name': '开始',
+        'group_params': [{
+            'params': [
+                {'key': 'guide_word', 'value': ''},
+                {'key': 'guide_question', 'value': []},
+                {'key': 'chat_history', 'value': 10},
+                {'key': 'preset_question', 'value': []},
+            ]
+        }]
+    }
+    end = {'id': 'end_bench', 'type': 'end', 'name': '结束', 'group_params': []}
+    nodes = [{'data': start}, {'data': end}]
+    edges = []
+    for i in range(branch_num):
+        llm_id = f'llm_{i}'
+        nodes.append({
+            'data': {
+                'id': llm_id,
+                'type': 'llm',
+                'name': llm_id,
+                'tab': {'value': 'single'},
+                'group_params': [{
+                    'params': [
+                        {'key': 'model_id', 'value': 0},
+                        {'key': 'system_prompt', 'value': '友好的助手'},
+                        {'key': 'user_prompt', 'value': f'分支{i}, 当前时间: {{{{#start_bench.current_time#}}}}'},
+                        {'key': 'output_user', 'value': False},
+                        {'key': 'output', 'value': []},
+                    ]
+                }]
+            }
+        })
+        edges.append(edge(start['id'], llm_id))
+        edges.append(edge(llm_id, end['id']))
+    return {'nodes': nodes, 'edges': edges}
+
+
+def build_engine(branch_num: int, async_mode: bool) -> GraphEngine:
+    return GraphEngine(user_id='1',
+                       workflow_id='bench_workflow',
+                       workflow_data=build_workflow_data(branch_num),
+                       async_mode=async_mode,
+                       max_steps=MAX_STEPS,
+                       callback=BaseCallback())
+
+
+def check_engine(engine: GraphEngine):
+    if engine.status != WorkflowStatus.SUCCESS.value:
+        raise Exception(f'workflow run failed status={engine.status} reason={engine.reason}')
+
+
+def run_sync(branch_num: int) -> float:
+    engine = build_engine(branch_num, False)
+    start = time.perf_counter()
+    engine.run()
+    cost = time.perf_counter() - start
+    check_engine(engine)
+    return cost
+
+
+async def run_async(branch_num: int) -> float:
+    engine = build_engine(branch_num, True)
+    start = time.perf_counter()
+    await engine.arun()
+    cost = time.perf_counter() - start
+    check_engine(engine)
+    return cost
+
+
+def run_async_executor(branch_num: int) -> float:
+    """ LLMNode使用BaseNode默认的_arun, 同步的_run在有界线程池里执行 """
+    native_arun = LLMNode._arun
+    LLMNode._arun = BaseNode._arun
+    try:
+        return asyncio.run(run_async(branch_num))
+    finally:
+        LLMNode._arun = native_arun
+
+
+if __name__ == '__main__':
+    start_fake_llm_server()
+    LLMService.get_bisheng_llm = classmethod(lambda cls, **kwargs: get_fake_llm(**kwargs))
+    for branch_num in [4, 16, 64]:
+        sync_cost = run_sync(branch_num)
+        executor_cost = run_async_executor(branch_num)
+        async_cost = asyncio.run(run_async(branch_num))
+        print(f'branches={branch_num:<4} llm_delay={FAKE_LLM_DELAY}s '
+              f'sync={sync_cost:.3f}s async_executor={executor_cost:.3f}s async_native={async_cost:.3f}s')
@@ -0,0 +1,120 @@
+"""
+workflow checkpoint 每步写入和恢复读取的耗时
+串行的N个节点, 每个节点往GraphState里写入一个变量, 对比增量写入和每步写入全量快照
+使用方式: python test/bench_workflow_checkpoint.py [memory|redis|sql]
+"""
+import operator
+import os
+import sys
+import time
+import uuid
+from typing import Annotated, Dict
+
+from langgraph.graph import StateGraph
+from typing_extensions import TypedDict
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+os.environ['config'] = os.path.join(parent_dir, 'bisheng/config.dev.yaml')
+
+from bisheng.workflow.checkpoint.base_checkpoint import (BaseCheckpointStore, MemoryCheckpointStore,  # noqa: E402
+                                                         WorkflowCheckpointer, dumps)
+from bisheng.workflow.graph.graph_state import GraphState  # noqa: E402
+
+NODE_OUTPUT = '节点输出的内容' * 200
+
+
+class TempState(TypedDict):
+    flag: Annotated[bool, operator.add]
+
+
+class TimingStore(BaseCheckpointStore):
+    """ 统计存储后端的读写耗时和写入的数据量 """
+
+    def __init__(self, store: BaseCheckpointStore):
+        self.store = store
+        self.write_time = 0
+        self.write_bytes = 0
+        self.read_time = 0
+
+    def get_fields(self, thread_id: str) -> Dict[str, bytes]:
+        start = time.perf_counter()
+        ret = self.store.get_fields(thread_id)
+        self.read_time += time.perf_counter() - start
+        return ret
+
+    def put_fields(self, thread_id: str, items: Dict[str, bytes]):
+        start = time.perf_counter()
+        self.store.put_fields(thread_id, items)
+        self.write_time += time.perf_counter() - start
+        self.write_bytes += sum(len(v) for v in items.values())
+
+    def delete_thread(self, thread_id: str):
+        self.store.delete_thread(thread_id)
+
+
+def init_store(store_type: str) -> BaseCheckpointStore:
+    if store_type == 'redis':
+        from bisheng.workflow.checkpoint.redis_checkpoint import RedisCheckpointStore
+        return RedisCheckpointStore()
+    elif store_type == 'sql':
+        from bisheng.workflow.checkpoint.sql_checkpoint import SqlCheckpointStore
+        return SqlCheckpointStore()
+    return MemoryCheckpointStore()
+
+
+def build_graph(node_num: int, graph_state: GraphState, checkpointer: WorkflowCheckpointer):
+    builder = StateGraph(TempState)
+
+    def make_node(node_id: str):
+        def run(state: dict):
+            graph_state.set_variable(node_id, 'output', NODE_OUTPUT)
+            return state
+
+        return run
+
+    node_ids = [f'node_{i}' for i in range(node_num)]
+    for node_id in node_ids:
+        builder.add_node(node_id, make_node(node_id))
+    builder.set_entry_point(node_ids[0])
+    for i in range(node_num - 1):
+        builder.add_edge(node_ids[i], node_ids[i + 1])
+    builder.set_finish_point(node_ids[-1])
+    return builder.compile(checkpointer=checkpointer)
+
+
+def run_case(store_type: str, node_num: int, full_snapshot: bool):
+    store = TimingStore(init_store(store_type))
+    checkpointer = WorkflowCheckpointer(store)
+    graph_state = GraphState()
+    graph = build_graph(node_num, graph_state, checkpointer)
+    thread_id = uuid.uuid4().hex
+    config = {'configurable': {'thread_id': thread_id}, 'recursion_limit': node_num + 10}
+
+    for _ in graph.stream({'flag': True}, config=config):
+        changed_keys = graph_state.pop_changed_keys()
+        if full_snapshot:
+            store.put_fields(thread_id, {'state:variables_pool': dumps(graph_state.variables_pool)})
+        else:
+            checkpointer.put_state(thread_id, {
+                key: graph_state.variables_pool[key.split(':', 1)[1]] for key in changed_keys
+            })
+
+    # 恢复执行时的读取
+    store.read_time = 0
+    checkpointer.get_tuple(config)
+    checkpointer.get_state(thread_id)
+    checkpointer.delete_thread(thread_id)
+
+    mode = 'snapshot' if full_snapshot else 'delta'
+    print(f'{store_type:<6} nodes={node_num:<4} {mode:<8} '
+          f'write/step={store.write_time / node_num * 1000:.3f}ms '
+          f'bytes/step={store.write_bytes // node_num} '
+          f'restore_read={store.read_time * 1000:.3f}ms')
+
+
+if __name__ == '__main__':
+    store_type = sys.argv[1] if len(sys.argv) > 1 else 'memory'
+    for node_num in [10, 50, 200]:
+        run_case(store_type, node_num, full_snapshot=True)
+        run_case(store_type, node_num, full_snapshot=False)
@@ -0,0 +1,77 @@
+"""
+workflow事件推送延迟对比: 旧的lpop + sleep(1)轮询 vs blpop阻塞读取 + 批量获取
+需要本地可访问的redis, 使用方式: python test/bench_workflow_event.py
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+os.environ['config'] = os.path.join(parent_dir, 'bisheng/config.dev.yaml')
+
+from bisheng.cache.redis import redis_client  # noqa: E402
+
+EVENT_NUM = 200
+# 模拟LLM流式输出的token间隔
+EVENT_INTERVAL = 0.02
+# 模拟节点启动前的等待时间
+FIRST_EVENT_DELAY = 0.3
+
+
+def producer(key: str):
+    time.sleep(FIRST_EVENT_DELAY)
+    for i in range(EVENT_NUM):
+        redis_client.rpush(key, json.dumps({'index': i, 'send_time': time.time()}), expiration=600)
+        time.sleep(EVENT_INTERVAL)
+
+
+async def consume_polling(key: str) -> list:
+    delays = []
+    while len(delays) < EVENT_NUM:
+        response = redis_client.lpop(key)
+        if not response:
+            await asyncio.sleep(1)
+            continue
+        delays.append(time.time() - json.loads(response)['send_time'])
+    return delays
+
+
+async def consume_blocking(key: str) -> list:
+    delays = []
+    try:
+        while len(delays) < EVENT_NUM:
+            responses = await redis_client.ablpop(key, timeout=5, count=50)
+            now = time.time()
+            for one in responses:
+                delays.append(now - json.loads(one)['send_time'])
+    finally:
+        # asyncio.run结束时事件循环会关闭
+        await redis_client.aclose_async_connection()
+    return delays
+
+
+def run_case(name: str, consumer):
+    key = f'bench:workflow:{uuid.uuid4().hex}:event'
+    thread = threading.Thread(target=producer, args=(key,))
+    thread.start()
+    delays = asyncio.run(consumer(key))
+    thread.join()
+    redis_client.delete(key)
+    # 首个事件从任务开始到被websocket收到的时间
+    ttft = FIRST_EVENT_DELAY + delays[0]
+    delays.sort()
+    print(f'{name:<10} ttft={ttft:.3f}s '
+          f'avg={sum(delays) / len(delays) * 1000:.1f}ms '
+          f'p50={delays[len(delays) // 2] * 1000:.1f}ms '
+          f'p99={delays[int(len(delays) * 0.99)] * 1000:.1f}ms '
+          f'max={delays[-1] * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    run_case('polling', consume_polling)
+    run_case('blocking', consume_blocking)
@@ -0,0 +1,87 @@
+"""
+RagTokenizer.tokenize_batch 用进程池分词的结果和逐个调用 tokenize + fine_grained_tokenize 一致
+使用临时目录里的小词典, 使用方式: pytest test/test_rag_tokenizer_batch.py
+"""
+import os
+import sys
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.rag.nlp import rag_tokenizer as tokenizer_module  # noqa: E402
+from bisheng.rag.nlp.rag_tokenizer import RagTokenizer  # noqa: E402
+
+DICT_LINES = [
+    '南京 50000 ns',
+    '南京市 30000 ns',
+    '市长 20000 n',
+    '长江 40000 ns',
+    '大桥 30000 n',
+    '长江大桥 20000 ns',
+    '数据 60000 n',
+    '分析 50000 vn',
+    '数据分析 10000 n',
+    '知识库 8000 n',
+    '知识 30000 n',
+    '毕昇 500 nz',
+]
+TEXTS = [
+    '南京市长江大桥',
+    '数据分析项目经理 sql python',
+    '毕昇知识库的数据分析',
+    'Unity3D开发经验 c++双11 985',
+]
+
+
+def load_tokenizer(tmp_path) -> RagTokenizer:
+    dict_file = tmp_path / 'fixture.txt'
+    dict_file.write_text('\n'.join(DICT_LINES) + '\n', encoding='utf-8')
+    tokenizer = RagTokenizer()
+    tokenizer.loadUserDict(str(dict_file))
+    assert tokenizer.trie_file_ == tokenizer.snapshot_(str(dict_file))
+    return tokenizer
+
+
+def test_tokenize_batch_same_as_sequential(tmp_path):
+    tokenizer = load_tokenizer(tmp_path)
+    texts = TEXTS * tokenizer_module.BATCH_MIN_TEXTS
+    try:
+        result = tokenizer.tokenize_batch(texts, workers=2)
+        assert tokenizer_module._batch_pool is not None
+        assert result == [tokenizer.tokenize(text) for text in texts]
+
+        result = tokenizer.tokenize_batch(texts, workers=2, fine_grained=True)
+        expect = []
+        for text in texts:
+            tks = tokenizer.tokenize(text)
+            expect.append((tks, tokenizer.fine_grained_tokenize(tks)))
+        assert result == expect
+    finally:
+        tokenizer_module._close_batch_pool()
+
+
+def test_tokenize_batch_in_process_without_snapshot(tmp_path):
+    tokenizer = load_tokenizer(tmp_path)
+    # 内存里修改过的trie没有快照, 只能在当前进程分词
+    tokenizer.addUserDict(str(tmp_path / 'fixture.txt'))
+    texts = TEXTS * tokenizer_module.BATCH_MIN_TEXTS
+    assert tokenizer.tokenize_batch(texts, workers=2) == [tokenizer.tokenize(text) for text in texts]
+    assert tokenizer_module._batch_pool is None
+
+
+def test_init_batch_worker_reuses_module_tokenizer(tmp_path, monkeypatch):
+    tokenizer = load_tokenizer(tmp_path)
+    module_tokenizer = tokenizer_module.tokenizer
+    trie, trie_file = module_tokenizer.trie_, module_tokenizer.trie_file_
+
+    def build_again(*args, **kwargs):
+        raise AssertionError('worker built another RagTokenizer')
+
+    monkeypatch.setattr(RagTokenizer, '__init__', build_again)
+    try:
+        tokenizer_module._init_batch_worker(tokenizer.trie_file_)
+        assert module_tokenizer.trie_file_ == tokenizer.trie_file_
+        assert [tokenizer_module._tokenize_worker(text) for text in TEXTS] == \
+            [tokenizer.tokenize(text) for text in TEXTS]
+    finally:
+        module_tokenizer.trie_, module_tokenizer.trie_file_ = trie, trie_file
@@ -0,0 +1,46 @@
+"""
+RagTokenizer的全角转半角、繁体转简体改成 str.translate 之后, 和原来逐字处理的结果一致
+覆盖所有BMP字符, 使用方式: pytest test/test_rag_tokenizer_normalize.py
+"""
+import os
+import sys
+
+from hanziconv import HanziConv
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.rag.nlp.rag_tokenizer import strQ2B, tradi2simp  # noqa: E402
+
+# 所有BMP字符, 包括代理项
+BMP_CHARS = ''.join(chr(c) for c in range(0x10000))
+
+
+def str_q2b_reference(ustring):
+    """原来逐字拼接的实现"""
+    rstring = ""
+    for uchar in ustring:
+        inside_code = ord(uchar)
+        if inside_code == 0x3000:
+            inside_code = 0x0020
+        else:
+            inside_code -= 0xfee0
+        if inside_code < 0x0020 or inside_code > 0x7e:  # 转完之后不是半角字符返回原来的字符
+            rstring += uchar
+        else:
+            rstring += chr(inside_code)
+    return rstring
+
+
+def test_str_q2b_all_bmp():
+    assert strQ2B(BMP_CHARS) == str_q2b_reference(BMP_CHARS)
+
+
+def test_tradi2simp_all_bmp():
+    assert tradi2simp(BMP_CHARS) == HanziConv.toSimplified(BMP_CHARS)
+
+
+def test_mixed_text():
+    text = '繁簡轉換器ＡＢＣ１２３　全角空格，English text 123 龍與地下城'
+    assert strQ2B(text) == str_q2b_reference(text)
+    assert tradi2simp(text) == HanziConv.toSimplified(text)
@@ -0,0 +1,71 @@
+"""
+RagTokenizer按词典hash缓存trie快照: 从快照加载和从词典构建的分词结果一致, 加载比构建快
+词典解析失败时不保存快照, 使用临时目录里生成的词典, 使用方式: pytest test/test_rag_tokenizer_snapshot.py
+"""
+import os
+import random
+import sys
+import time
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.rag.nlp.rag_tokenizer import RagTokenizer, is_chinese  # noqa: E402
+
+SAMPLES = [
+    '南京市长江大桥',
+    '数据分析项目经理 sql python',
+    '毕昇知识库的数据分析',
+    '这周日你去吗？这周日你有空吗？',
+]
+# 随机生成的词, 让构建trie的耗时明显大于加载快照
+WORD_NUM = 20000
+
+
+def write_dict(dict_file):
+    rng = random.Random(0)
+    chars = [chr(0x4e00 + i) for i in range(500)] + [c for c in ''.join(SAMPLES) if is_chinese(c)]
+    lines = ['南京 50000 ns', '南京市 30000 ns', '长江大桥 20000 ns', '数据分析 10000 n', '知识库 8000 n']
+    for _ in range(WORD_NUM):
+        word = ''.join(rng.choices(chars, k=rng.randint(2, 4)))
+        lines.append(f'{word} {rng.randint(1, 100000)} n')
+    dict_file.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+
+def parse_again(self, fnm):
+    raise AssertionError(f'dict {fnm} parsed again')
+
+
+def load(dict_file):
+    tokenizer = RagTokenizer()
+    start = time.perf_counter()
+    tokenizer.loadUserDict(str(dict_file))
+    return tokenizer, time.perf_counter() - start
+
+
+def test_snapshot_same_tokens_and_faster(tmp_path, monkeypatch):
+    dict_file = tmp_path / 'fixture.txt'
+    write_dict(dict_file)
+
+    built, build_cost = load(dict_file)
+    snapshot = built.snapshot_(str(dict_file))
+    assert built.trie_file_ == snapshot and os.path.exists(snapshot)
+
+    # 有快照时不再解析词典
+    monkeypatch.setattr(RagTokenizer, 'loadDict_', parse_again)
+    loaded, load_cost = load(dict_file)
+    assert loaded.trie_file_ == snapshot
+    for sample in SAMPLES:
+        assert built.tokenize(sample) == loaded.tokenize(sample)
+        assert built.fine_grained_tokenize(built.tokenize(sample)) == \
+            loaded.fine_grained_tokenize(loaded.tokenize(sample))
+    assert load_cost < build_cost
+
+
+def test_no_snapshot_on_parse_error(tmp_path):
+    dict_file = tmp_path / 'broken.txt'
+    dict_file.write_text('南京 50000 ns\n长江 not_a_number n\n', encoding='utf-8')
+
+    tokenizer, _ = load(dict_file)
+    assert tokenizer.trie_file_ is None
+    assert not [one for one in os.listdir(tmp_path) if one.endswith('.trie')]
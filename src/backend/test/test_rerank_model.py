@@ -0,0 +1,96 @@
+"""
+DefaultRerank 的分数缓存和按token数分批, 用确定性的假模型代替 FlagReranker
+使用方式: pytest test/test_rerank_model.py
+"""
+import os
+import sys
+
+import numpy as np
+
+parent_dir = os.path.dirname(os.path.abspath(__file__)).replace('test', '')
+sys.path.append(parent_dir)
+
+from bisheng.rag.llm.rerank_model import DefaultRerank, sigmoid  # noqa: E402
+
+
+class FakeReranker:
+    """ 分数只和分块内容有关, 记录每次送入的分块 """
+
+    def __init__(self):
+        self.batches = []
+
+    @staticmethod
+    def score(text: str) -> float:
+        return (sum(map(ord, text)) % 97) / 10 - 5
+
+    def compute_score(self, pairs, max_length=512):
+        self.batches.append([t for _, t in pairs])
+        scores = [self.score(t) for _, t in pairs]
+        return scores[0] if len(scores) == 1 else scores
+
+
+def new_rerank(model_name: str = 'fake-reranker', batch_tokens: int = 64) -> DefaultRerank:
+    DefaultRerank.score_cache.clear()
+    rerank = DefaultRerank.__new__(DefaultRerank)
+    rerank._model = FakeReranker()
+    rerank.model_name = model_name
+    rerank.batch_tokens = batch_tokens
+    return rerank
+
+
+def expected(texts):
+    return sigmoid(np.array([FakeReranker.score(t) for t in texts]))
+
+
+TEXTS = ['知识库' * (i % 7 + 1) + f'分块{i}' for i in range(30)]
+
+
+def test_scores_in_input_order():
+    rerank = new_rerank()
+    scores, token_count = rerank.similarity('毕昇是什么', TEXTS)
+    assert np.allclose(scores, expected(TEXTS))
+    assert token_count > 0
+    # 分了多批, 每批按长度升序送入模型
+    sent = [t for batch in rerank._model.batches for t in batch]
+    assert len(rerank._model.batches) > 1
+    assert sorted(sent) == sorted(TEXTS)
+    assert [len(t) for t in sent] == sorted(len(t) for t in sent)
+
+
+def test_cache_hit_skips_model():
+    rerank = new_rerank()
+    first, _ = rerank.similarity('毕昇是什么', TEXTS)
+    rerank._model.batches.clear()
+    second, token_count = rerank.similarity('毕昇是什么', TEXTS)
+    assert rerank._model.batches == []
+    assert token_count == 0
+    assert np.array_equal(first, second)
+
+    # 翻页时只计算新的分块
+    page = TEXTS[20:] + ['新的分块']
+    scores, _ = rerank.similarity('毕昇是什么', page)
+    assert rerank._model.batches == [['新的分块']]
+    assert np.allclose(scores, expected(page))
+
+
+def test_cache_key_includes_query_and_model():
+    rerank = new_rerank()
+    rerank.similarity('毕昇是什么', TEXTS[:5])
+    rerank._model.batches.clear()
+    rerank.similarity('另一个问题', TEXTS[:5])
+    assert sum(len(batch) for batch in rerank._model.batches) == 5
+
+    other = DefaultRerank.__new__(DefaultRerank)
+    other._model = FakeReranker()
+    other.model_name = 'other-reranker'
+    other.similarity('毕昇是什么', TEXTS[:5])
+    assert sum(len(batch) for batch in other._model.batches) == 5
+
+
+def test_duplicate_texts_scored_once():
+    rerank = new_rerank()
+    texts = ['重复的分块', '另一个分块', '重复的分块']
+    scores, _ = rerank.similarity('毕昇是什么', texts)
+    assert sum(len(batch) for batch in rerank._model.batches) == 2
+    assert np.allclose(scores, expected(texts))
+    assert rerank.similarity('毕昇是什么', [])[0].shape == (0,)
@@ -153,7 +153,11 @@ class BishengRetrievalQA(Chain):
         question = inputs[self.input_key]
 
         if self.return_source_documents:
-            answer, docs = await self.bisheng_rag_tool.arun(question, return_only_outputs=False)
+            answer, docs = await self.bisheng_rag_tool.arun(
+                question,
+                return_only_outputs=False,
+                run_manager=run_manager,
+            )
             return {self.output_key: answer, 'source_documents': docs}
         else:
             answer = await self.bisheng_rag_tool.arun(question, return_only_outputs=True)
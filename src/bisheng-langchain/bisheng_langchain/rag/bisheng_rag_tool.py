@@ -1,3 +1,4 @@
+import asyncio
 import os
 from typing import Any, Dict, Optional, Tuple, Union
 
@@ -12,7 +13,7 @@ from bisheng_langchain.vectorstores import ElasticKeywordsSearch, Milvus
 from langchain.chains.llm import LLMChain
 from langchain.chains.question_answering import load_qa_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.callbacks import CallbackManagerForChainRun
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
 from langchain_core.language_models.base import LanguageModelLike
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
@@ -212,6 +213,19 @@ class BishengRAGTool:
         # EnsembleRetriever直接检索召回会默认去重
         docs = self.retriever.get_relevant_documents(query=query,
                                                      collection_name=self.collection_name)
+        return self._post_retrieval(docs)
+
+    async def aretrieval_and_rerank(self, query):
+        """
+        async retrieval and rerank
+        """
+        # 子检索器只实现了同步检索且需要额外的collection_name参数，放到线程里执行避免阻塞事件循环
+        docs = await asyncio.to_thread(self.retriever.get_relevant_documents,
+                                       query=query,
+                                       collection_name=self.collection_name)
+        return self._post_retrieval(docs)
+
+    def _post_retrieval(self, docs):
         logger.info(f'retrieval docs origin: {len(docs)}')
 
         # delete redundancy according to max_content
@@ -236,14 +250,7 @@ class BishengRAGTool:
             run_manager: Optional[CallbackManagerForChainRun] = None) -> Any:
         docs = self.retrieval_and_rerank(query)
         try:
-            kwargs = {}
-            if run_manager:
-                kwargs['config'] = RunnableConfig(callbacks=[run_manager])
-            tmp_input = {
-                'context': docs,
-            }
-            if 'question' in self.prompt_inputs:
-                tmp_input['question'] = query
+            tmp_input, kwargs = self._init_qa_input(query, docs, run_manager)
             ans = self.qa_chain.invoke(tmp_input, **kwargs)
         except Exception as e:
             logger.exception(f'question: {query}\nerror: {e}')
@@ -253,9 +260,32 @@ class BishengRAGTool:
         else:
             return ans, docs
 
-    async def arun(self, query: str, return_only_outputs=True) -> str:
-        rag_answer = self.run(query, return_only_outputs)
-        return rag_answer
+    async def arun(self,
+                   query: str,
+                   return_only_outputs=True,
+                   run_manager: Optional[AsyncCallbackManagerForChainRun] = None) -> Any:
+        docs = await self.aretrieval_and_rerank(query)
+        try:
+            tmp_input, kwargs = self._init_qa_input(query, docs, run_manager)
+            ans = await self.qa_chain.ainvoke(tmp_input, **kwargs)
+        except Exception as e:
+            logger.exception(f'question: {query}\nerror: {e}')
+            ans = str(e)
+        if return_only_outputs:
+            return ans
+        else:
+            return ans, docs
+
+    def _init_qa_input(self, query, docs, run_manager=None) -> Tuple[Dict, Dict]:
+        kwargs = {}
+        if run_manager:
+            kwargs['config'] = RunnableConfig(callbacks=[run_manager])
+        tmp_input = {
+            'context': docs,
+        }
+        if 'question' in self.prompt_inputs:
+            tmp_input['question'] = query
+        return tmp_input, kwargs
 
     @classmethod
     def get_rag_tool(cls, name, description, **kwargs: Any) -> BaseTool:
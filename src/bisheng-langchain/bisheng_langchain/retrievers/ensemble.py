@@ -3,7 +3,8 @@ Ensemble retriever that ensemble the results of
 multiple retrievers by using weighted  Reciprocal Rank Fusion
 """
 
-from typing import Any, Dict, List
+import functools
+from typing import Any, Dict, List, Optional
 
 from langchain_core.documents import Document
 from langchain_core.pydantic_v1 import root_validator
@@ -14,6 +15,9 @@ from langchain.callbacks.manager import (
     CallbackManagerForRetrieverRun,
 )
 
+from bisheng_langchain.retrievers.fusion import weighted_reciprocal_rank, weighted_score_fusion
+from bisheng_langchain.retrievers.utils import arun_retrievers, run_retrievers
+
 
 class EnsembleRetriever(BaseRetriever):
     """Retriever that ensembles the multiple retrievers.
@@ -27,11 +31,21 @@ class EnsembleRetriever(BaseRetriever):
         c: A constant added to the rank, controlling the balance between the importance
             of high-ranked items and the consideration given to lower-ranked items.
             Default is 60.
+        timeout: Max seconds to wait for the retrievers which run concurrently.
+            Default is None, wait until all finished.
+        allow_partial: If some retrievers fail or time out, fuse the results of the others.
+        fusion_type: "rrf" fuses by rank, "score" fuses the min-max normalized scores in
+            document metadata. Default is "rrf".
+        score_key: The metadata key of the score used by score fusion.
     """
 
     retrievers: List[BaseRetriever]
     weights: List[float]
     c: int = 60
+    timeout: Optional[float] = None
+    allow_partial: bool = True
+    fusion_type: str = "rrf"
+    score_key: str = "score"
 
     @root_validator(pre=True)
     def set_weights(cls, values: Dict[str, Any]) -> Dict[str, Any]:
@@ -102,17 +116,23 @@ class EnsembleRetriever(BaseRetriever):
         """
 
         # Get the results of all retrievers.
-        retriever_docs = [
-            retriever.get_relevant_documents(
-                query,
-                callbacks=run_manager.get_child(tag=f"retriever_{i+1}"),
-                **kwagrs,
-            )
-            for i, retriever in enumerate(self.retrievers)
-        ]
+        retriever_docs = run_retrievers(
+            [
+                functools.partial(
+                    retriever.get_relevant_documents,
+                    query,
+                    callbacks=run_manager.get_child(tag=f"retriever_{i+1}"),
+                    **kwagrs,
+                )
+                for i, retriever in enumerate(self.retrievers)
+            ],
+            names=[f"retriever_{i+1}" for i in range(len(self.retrievers))],
+            timeout=self.timeout,
+            allow_partial=self.allow_partial,
+        )
 
         # apply rank fusion
-        fused_documents = self.weighted_reciprocal_rank(retriever_docs)
+        fused_documents = self.fuse(retriever_docs)
 
         return fused_documents
 
@@ -134,26 +154,44 @@ class EnsembleRetriever(BaseRetriever):
         """
 
         # Get the results of all retrievers.
-        retriever_docs = [
-            await retriever.aget_relevant_documents(
-                query,
-                callbacks=run_manager.get_child(tag=f"retriever_{i+1}"),
-                **kwagrs,
-            )
-            for i, retriever in enumerate(self.retrievers)
-        ]
+        retriever_docs = await arun_retrievers(
+            [
+                retriever.aget_relevant_documents(
+                    query,
+                    callbacks=run_manager.get_child(tag=f"retriever_{i+1}"),
+                    **kwagrs,
+                )
+                for i, retriever in enumerate(self.retrievers)
+            ],
+            names=[f"retriever_{i+1}" for i in range(len(self.retrievers))],
+            timeout=self.timeout,
+            allow_partial=self.allow_partial,
+        )
 
         # apply rank fusion
-        fused_documents = self.weighted_reciprocal_rank(retriever_docs)
+        fused_documents = self.fuse(retriever_docs)
 
         return fused_documents
 
+    def fuse(self, doc_lists: List[List[Document]]) -> List[Document]:
+        """
+        Fuse the rank lists according to fusion_type.
+        """
+        if self.fusion_type == "rrf":
+            return self.weighted_reciprocal_rank(doc_lists)
+        elif self.fusion_type == "score":
+            return weighted_score_fusion(doc_lists, self.weights, score_key=self.score_key)
+        raise ValueError(f"Expected fusion_type to be one of (rrf, score), instead found {self.fusion_type}")
+
     def weighted_reciprocal_rank(self, doc_lists: List[List[Document]]) -> List[Document]:
         """
         Perform weighted Reciprocal Rank Fusion on multiple rank lists.
         You can find more details about RRF here:
         https://plg.uwaterloo.ca/~gvcormac/cormacksigir09-rrf.pdf
 
+        Documents are deduplicated by file_id and chunk_index in metadata if present,
+        otherwise by page_content.
+
         Args:
             doc_lists: A list of rank lists, where each rank list contains unique items.
 
@@ -161,29 +199,4 @@ class EnsembleRetriever(BaseRetriever):
             list: The final aggregated list of items sorted by their weighted RRF
                     scores in descending order.
         """
-        if len(doc_lists) != len(self.weights):
-            raise ValueError("Number of rank lists must be equal to the number of weights.")
-
-        # Create a union of all unique documents in the input doc_lists
-        all_documents = set()
-        for doc_list in doc_lists:
-            for doc in doc_list:
-                all_documents.add(doc.page_content)
-
-        # Initialize the RRF score dictionary for each document
-        rrf_score_dic = {doc: 0.0 for doc in all_documents}
-
-        # Calculate RRF scores for each document
-        for doc_list, weight in zip(doc_lists, self.weights):
-            for rank, doc in enumerate(doc_list, start=1):
-                rrf_score = weight * (1 / (rank + self.c))
-                rrf_score_dic[doc.page_content] += rrf_score
-
-        # Sort documents by their RRF scores in descending order
-        sorted_documents = sorted(rrf_score_dic.keys(), key=lambda x: rrf_score_dic[x], reverse=True)
-
-        # Map the sorted page_content back to the original document objects
-        page_content_to_doc_map = {doc.page_content: doc for doc_list in doc_lists for doc in doc_list}
-        sorted_docs = [page_content_to_doc_map[page_content] for page_content in sorted_documents]
-
-        return sorted_docs
+        return weighted_reciprocal_rank(doc_lists, self.weights, self.c)
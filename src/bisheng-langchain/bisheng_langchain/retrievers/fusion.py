@@ -0,0 +1,121 @@
+"""
+Fusion of the results of multiple retrievers.
+
+Documents are identified by stable chunk ids (file_id + chunk_index) when the
+metadata has them, so deduplication does not need to hash long page contents.
+Scores are computed with numpy arrays instead of python loops.
+"""
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+def doc_key(doc: Document) -> Hashable:
+    """ 文档的唯一标识, 知识库的chunk使用file_id和chunk_index, 否则使用文本内容 """
+    metadata = doc.metadata
+    file_id = metadata.get('file_id')
+    chunk_index = metadata.get('chunk_index')
+    if file_id is not None and chunk_index is not None:
+        return file_id, chunk_index
+    return doc.page_content
+
+
+def index_documents(doc_lists: Sequence[Sequence[Document]]) -> Tuple[List[Document], List[np.ndarray]]:
+    """
+    给所有不重复的文档分配从0开始的序号
+
+    Returns:
+        unique_docs: 不重复的文档, 按第一次出现的顺序
+        doc_indexes: 每个文档列表里的文档对应的序号
+    """
+    key_index: Dict[Hashable, int] = {}
+    unique_docs: List[Document] = []
+    indexes = []
+    for doc_list in doc_lists:
+        for doc in doc_list:
+            key = doc_key(doc)
+            index = key_index.get(key)
+            if index is None:
+                index = key_index[key] = len(unique_docs)
+                unique_docs.append(doc)
+            indexes.append(index)
+    # 逐个写入numpy数组比python列表慢, 最后一次性转换
+    indexes = np.array(indexes, dtype=np.int64)
+    doc_indexes = np.split(indexes, np.cumsum([len(doc_list) for doc_list in doc_lists])[:-1])
+    return unique_docs, doc_indexes
+
+
+def _sort_by_scores(unique_docs: List[Document], scores: np.ndarray) -> List[Document]:
+    # 分数相同时保持第一次出现的顺序
+    order = np.argsort(-scores, kind='stable')
+    return [unique_docs[i] for i in order]
+
+
+def weighted_reciprocal_rank(doc_lists: Sequence[Sequence[Document]],
+                             weights: Sequence[float],
+                             c: int = 60) -> List[Document]:
+    """
+    Weighted Reciprocal Rank Fusion, the score of a document is sum(weight / (rank + c)).
+    """
+    if len(doc_lists) != len(weights):
+        raise ValueError('Number of rank lists must be equal to the number of weights.')
+    unique_docs, doc_indexes = index_documents(doc_lists)
+    contributions = [
+        weight / (np.arange(1, len(indexes) + 1, dtype=np.float64) + c)
+        for indexes, weight in zip(doc_indexes, weights)
+    ]
+    # bincount按序号累加各个列表的分数, 同一个列表里有重复文档时也会累加
+    scores = np.bincount(np.concatenate(doc_indexes),
+                         weights=np.concatenate(contributions),
+                         minlength=len(unique_docs))
+    return _sort_by_scores(unique_docs, scores)
+
+
+def weighted_score_fusion(doc_lists: Sequence[Sequence[Document]],
+                          weights: Sequence[float],
+                          score_key: str = 'score',
+                          higher_is_better: Optional[Sequence[bool]] = None) -> List[Document]:
+    """
+    Weighted fusion of the retrieval scores in doc.metadata[score_key].
+    The scores of each list are min-max normalized to [0, 1] before weighting, a document
+    missing from a list gets 0 from that list.
+
+    Args:
+        higher_is_better: for each list, whether a higher score means more relevant,
+            e.g. False for L2 distance. Default True for all lists.
+    """
+    if len(doc_lists) != len(weights):
+        raise ValueError('Number of rank lists must be equal to the number of weights.')
+    if higher_is_better is None:
+        higher_is_better = [True] * len(doc_lists)
+    unique_docs, doc_indexes = index_documents(doc_lists)
+    scores = np.zeros(len(unique_docs), dtype=np.float64)
+    for doc_list, indexes, weight, higher in zip(doc_lists, doc_indexes, weights, higher_is_better):
+        if not doc_list:
+            continue
+        try:
+            raw = np.fromiter((doc.metadata[score_key] for doc in doc_list), dtype=np.float64, count=len(doc_list))
+        except KeyError:
+            raise ValueError(f'score fusion need document metadata contains {score_key}')
+        if not higher:
+            raw = -raw
+        span = raw.max() - raw.min()
+        normalized = (raw - raw.min()) / span if span > 0 else np.ones_like(raw)
+        # 同一个列表里的重复文档只取最高分
+        list_scores = np.zeros(len(unique_docs), dtype=np.float64)
+        np.maximum.at(list_scores, indexes, normalized)
+        scores += weight * list_scores
+    return _sort_by_scores(unique_docs, scores)
+
+
+def interleave_dedup(first_docs: Sequence[Document], second_docs: Sequence[Document]) -> List[Document]:
+    """ 两个列表交替合并并去重, 重复的文档保留第一次出现的位置 """
+    merged = []
+    for i in range(max(len(first_docs), len(second_docs))):
+        if i < len(first_docs):
+            merged.append(first_docs[i])
+        if i < len(second_docs):
+            merged.append(second_docs[i])
+    unique_docs, _ = index_documents([merged])
+    return unique_docs
@@ -1,5 +1,7 @@
-from typing import List
+from typing import List, Optional
 
+from bisheng_langchain.retrievers.fusion import interleave_dedup
+from bisheng_langchain.retrievers.utils import arun_retrievers, run_retrievers
 from langchain.callbacks.manager import (AsyncCallbackManagerForRetrieverRun,
                                          CallbackManagerForRetrieverRun)
 from langchain.schema import BaseRetriever, Document
@@ -16,11 +18,16 @@ class MixEsVectorRetriever(BaseRetriever):
         c: A constant added to the rank, controlling the balance between the importance
             of high-ranked items and the consideration given to lower-ranked items.
             Default is 60.
+        timeout: Max seconds to wait for the two retrievers which run concurrently.
+            Default is None, wait until both finished.
+        allow_partial: If one retriever fails or times out, return the results of the other.
     """
 
     vector_retriever: BaseRetriever
     keyword_retriever: BaseRetriever
     combine_strategy: str = 'keyword_front'  # "keyword_front, vector_front, mix"
+    timeout: Optional[float] = None
+    allow_partial: bool = True
 
     def _get_relevant_documents(
         self,
@@ -39,29 +46,29 @@ class MixEsVectorRetriever(BaseRetriever):
         """
 
         # Get fused result of the retrievers.
-        vector_docs = self.vector_retriever.get_relevant_documents(
-            query, callbacks=run_manager.get_child())
-        keyword_docs = self.keyword_retriever.get_relevant_documents(
-            query, callbacks=run_manager.get_child())
-
+        # 向量检索和关键词检索并发执行
+        vector_docs, keyword_docs = run_retrievers(
+            [
+                lambda: self.vector_retriever.get_relevant_documents(
+                    query, callbacks=run_manager.get_child()),
+                lambda: self.keyword_retriever.get_relevant_documents(
+                    query, callbacks=run_manager.get_child()),
+            ],
+            names=['vector', 'keyword'],
+            timeout=self.timeout,
+            allow_partial=self.allow_partial,
+        )
+        return self._combine_docs(vector_docs, keyword_docs)
+
+    def _combine_docs(self, vector_docs: List[Document],
+                      keyword_docs: List[Document]) -> List[Document]:
         if self.combine_strategy == 'keyword_front':
             return keyword_docs + vector_docs
         elif self.combine_strategy == 'vector_front':
             return vector_docs + keyword_docs
         elif self.combine_strategy == 'mix':
-            combine_docs_dict = {}
-            min_len = min(len(keyword_docs), len(vector_docs))
-            for i in range(min_len):
-                combine_docs_dict[keyword_docs[i].page_content] = keyword_docs[i]
-                combine_docs_dict[vector_docs[i].page_content] = vector_docs[i]
-            for doc in keyword_docs[min_len:]:
-                combine_docs_dict[doc.page_content] = doc
-            for doc in vector_docs[min_len:]:
-                combine_docs_dict[doc.page_content] = doc
-
-            # 将字典的值转换为列表
-            combine_docs = list(combine_docs_dict.values())
-            return combine_docs
+            # 交替合并, 按chunk id去重
+            return interleave_dedup(keyword_docs, vector_docs)
         else:
             raise ValueError(f'Expected combine_strategy to be one of '
                              f'(keyword_front, vector_front, mix),'
@@ -84,29 +91,15 @@ class MixEsVectorRetriever(BaseRetriever):
         """
 
         # Get fused result of the retrievers.
-        vector_docs = await self.vector_retriever.aget_relevant_documents(
-            query, callbacks=run_manager.get_child())
-        keyword_docs = await self.keyword_retriever.aget_relevant_documents(
-            query, callbacks=run_manager.get_child())
-        if self.combine_strategy == 'keyword_front':
-            return keyword_docs + vector_docs
-        elif self.combine_strategy == 'vector_front':
-            return vector_docs + keyword_docs
-        elif self.combine_strategy == 'mix':
-            combine_docs_dict = {}
-            min_len = min(len(keyword_docs), len(vector_docs))
-            for i in range(min_len):
-                combine_docs_dict[keyword_docs[i].page_content] = keyword_docs[i]
-                combine_docs_dict[vector_docs[i].page_content] = vector_docs[i]
-            for doc in keyword_docs[min_len:]:
-                combine_docs_dict[doc.page_content] = doc
-            for doc in vector_docs[min_len:]:
-                combine_docs_dict[doc.page_content] = doc
-
-            # 将字典的值转换为列表
-            combine_docs = list(combine_docs_dict.values())
-            return combine_docs
-        else:
-            raise ValueError(f'Expected combine_strategy to be one of '
-                             f'(keyword_front, vector_front, mix),'
-                             f'instead found {self.combine_strategy}')
+        vector_docs, keyword_docs = await arun_retrievers(
+            [
+                self.vector_retriever.aget_relevant_documents(query,
+                                                              callbacks=run_manager.get_child()),
+                self.keyword_retriever.aget_relevant_documents(query,
+                                                               callbacks=run_manager.get_child()),
+            ],
+            names=['vector', 'keyword'],
+            timeout=self.timeout,
+            allow_partial=self.allow_partial,
+        )
+        return self._combine_docs(vector_docs, keyword_docs)
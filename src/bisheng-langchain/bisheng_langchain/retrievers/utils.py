@@ -0,0 +1,106 @@
+"""
+Run multiple retrievers concurrently, with a per retriever timeout and
+degraded mode which returns the results of the retrievers that succeeded.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, List, Optional
+
+from langchain_core.documents import Document
+from loguru import logger
+
+# 检索主要是等待milvus、es等外部服务, 多个请求共享一个线程池
+_RETRIEVER_THREAD_PREFIX = 'retriever'
+_retriever_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix=_RETRIEVER_THREAD_PREFIX)
+
+
+def _handle_results(names: List[str],
+                    results: List[Optional[List[Document]]],
+                    errors: List[Optional[BaseException]],
+                    allow_partial: bool) -> List[List[Document]]:
+    failed = [i for i, error in enumerate(errors) if error is not None]
+    if not failed:
+        return results
+    for i in failed:
+        logger.warning(f'retriever {names[i]} failed: {errors[i]!r}')
+    if not allow_partial or len(failed) == len(results):
+        raise errors[failed[0]]
+    # 降级: 失败或者超时的检索器返回空结果
+    return [[] if result is None else result for result in results]
+
+
+def run_retrievers(funcs: List[Callable[[], List[Document]]],
+                   names: List[str],
+                   timeout: Optional[float] = None,
+                   allow_partial: bool = True) -> List[List[Document]]:
+    """
+    Run sync retrieval functions in threads.
+
+    Args:
+        funcs: retrieval functions without arguments.
+        names: name of each retriever, used in the log.
+        timeout: max seconds to wait for all retrievers, None means no limit.
+        allow_partial: if True, return empty documents for the retrievers which failed or
+            timed out as long as one retriever succeeded, otherwise raise the error.
+
+    Returns:
+        The documents of each retriever, in the same order as funcs.
+    """
+    if len(funcs) == 1:
+        return [funcs[0]()]
+    if threading.current_thread().name.startswith(_RETRIEVER_THREAD_PREFIX):
+        # Nested retrievers (e.g. a mix retriever inside an ensemble) are run inline,
+        # waiting on the shared pool from one of its own threads can deadlock when it is full.
+        # The timeout of the outer call still applies.
+        results, errors = [], []
+        for func in funcs:
+            try:
+                results.append(func())
+                errors.append(None)
+            except Exception as e:
+                results.append(None)
+                errors.append(e)
+        return _handle_results(names, results, errors, allow_partial)
+    futures = [
+        _retriever_executor.submit(functools.partial(contextvars.copy_context().run, func))
+        for func in funcs
+    ]
+    wait(futures, timeout=timeout)
+    results, errors = [], []
+    for future in futures:
+        if not future.done():
+            # 超时的请求不能中断, 结果直接丢弃
+            future.cancel()
+            results.append(None)
+            errors.append(TimeoutError(f'retrieval timeout after {timeout}s'))
+        elif future.exception() is not None:
+            results.append(None)
+            errors.append(future.exception())
+        else:
+            results.append(future.result())
+            errors.append(None)
+    return _handle_results(names, results, errors, allow_partial)
+
+
+async def arun_retrievers(coros: List[Awaitable[List[Document]]],
+                          names: List[str],
+                          timeout: Optional[float] = None,
+                          allow_partial: bool = True) -> List[List[Document]]:
+    """ Async version of run_retrievers, coroutines are run with asyncio.gather. """
+    outputs = await asyncio.gather(*[asyncio.wait_for(coro, timeout) for coro in coros],
+                                   return_exceptions=True)
+    results, errors = [], []
+    for output in outputs:
+        if isinstance(output, asyncio.TimeoutError):
+            results.append(None)
+            errors.append(TimeoutError(f'retrieval timeout after {timeout}s'))
+        elif isinstance(output, BaseException):
+            results.append(None)
+            errors.append(output)
+        else:
+            results.append(output)
+            errors.append(None)
+    return _handle_results(names, results, errors, allow_partial)
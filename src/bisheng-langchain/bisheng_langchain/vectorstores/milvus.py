@@ -453,6 +453,7 @@ class Milvus(MilvusLangchain):
         timeout: Optional[int] = None,
         batch_size: int = 1000,
         no_embedding: bool = False,
+        embeddings: Optional[Union[List[List[float]], np.ndarray]] = None,
         **kwargs: Any,
     ) -> List[str]:
         """Insert text data into Milvus.
@@ -473,6 +474,10 @@ class Milvus(MilvusLangchain):
                 to None.
             batch_size (int, optional): Batch size to use for insertion.
                 Defaults to 1000.
+            embeddings (Optional[Union[List[List[float]], np.ndarray]]): Precomputed
+                embeddings of the texts, the texts are not embedded again if provided.
+                A 2-d array is sliced per insert batch instead of being converted to
+                lists up front. Defaults to None.
 
         Raises:
             MilvusException: Failure to add texts
@@ -483,7 +488,13 @@ class Milvus(MilvusLangchain):
         from pymilvus import Collection, MilvusException
 
         texts = list(texts)
-        if not no_embedding:
+        if embeddings is not None:
+            if len(embeddings) != len(texts):
+                raise ValueError('Number of embeddings must be equal to the number of texts.')
+            if len(embeddings) == 0:
+                logger.debug('Nothing to insert, skipping.')
+                return []
+        elif not no_embedding:
             try:
                 embeddings = self.embedding_func.embed_documents(texts)
             except NotImplementedError:
@@ -527,6 +538,8 @@ class Milvus(MilvusLangchain):
             end = min(i + batch_size, total_count)
             # Convert dict to list of lists batch for insertion
             insert_list = [insert_dict[x][i:end] for x in self.fields if x in insert_dict]
+            # 向量是numpy数组时只转换当前批次
+            insert_list = [one.tolist() if isinstance(one, np.ndarray) else one for one in insert_list]
             # Insert into the collection.
             try:
                 res = self.col.insert(insert_list, timeout=timeout, **kwargs)
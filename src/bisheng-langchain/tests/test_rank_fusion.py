@@ -0,0 +1,118 @@
+"""
+多路检索结果融合: 按chunk id去重的numpy版RRF和原来按文本内容去重的实现对比
+使用方式: python tests/test_rank_fusion.py
+"""
+import random
+import time
+from typing import List
+
+from langchain.schema import Document
+
+from bisheng_langchain.retrievers import EnsembleRetriever
+from bisheng_langchain.retrievers.fusion import (interleave_dedup, weighted_reciprocal_rank,
+                                                 weighted_score_fusion)
+
+
+def legacy_weighted_reciprocal_rank(doc_lists: List[List[Document]], weights: List[float],
+                                    c: int = 60) -> List[Document]:
+    all_documents = set()
+    for doc_list in doc_lists:
+        for doc in doc_list:
+            all_documents.add(doc.page_content)
+    rrf_score_dic = {doc: 0.0 for doc in all_documents}
+    for doc_list, weight in zip(doc_lists, weights):
+        for rank, doc in enumerate(doc_list, start=1):
+            rrf_score_dic[doc.page_content] += weight * (1 / (rank + c))
+    sorted_documents = sorted(rrf_score_dic.keys(), key=lambda x: rrf_score_dic[x], reverse=True)
+    page_content_to_doc_map = {doc.page_content: doc for doc_list in doc_lists for doc in doc_list}
+    return [page_content_to_doc_map[page_content] for page_content in sorted_documents]
+
+
+def make_doc_lists(k: int, list_num: int = 3, content_len: int = 1000) -> List[List[Document]]:
+    """ 每一路返回k个chunk, 各路之间有一半重合 """
+    random.seed(k)
+    pool = [
+        Document(page_content=f'{i}' + 'x' * content_len,
+                 metadata={'file_id': i // 10, 'chunk_index': i % 10, 'score': random.random()})
+        for i in range(k * 2)
+    ]
+    return [random.sample(pool, k) for _ in range(list_num)]
+
+
+def rrf_scores(docs: List[Document], doc_lists: List[List[Document]], weights: List[float],
+               c: int = 60) -> List[float]:
+    score = {}
+    for doc_list, weight in zip(doc_lists, weights):
+        for rank, doc in enumerate(doc_list, start=1):
+            score[doc.page_content] = score.get(doc.page_content, 0) + weight / (rank + c)
+    return [round(score[doc.page_content], 12) for doc in docs]
+
+
+def bench(name: str, func, repeat: int = 20) -> float:
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    cost = (time.perf_counter() - start) / repeat * 1000
+    print(f'{name:<12} {cost:.3f}ms')
+    return cost
+
+
+def test_rrf_same_as_legacy():
+    doc_lists = make_doc_lists(200)
+    weights = [0.5, 0.3, 0.2]
+    # 文本内容唯一时两种去重方式结果一致, 分数相同的文档原来的实现顺序不固定, 只比较分数序列
+    expected = legacy_weighted_reciprocal_rank(doc_lists, weights)
+    result = weighted_reciprocal_rank(doc_lists, weights)
+    assert {doc.page_content for doc in result} == {doc.page_content for doc in expected}
+    assert rrf_scores(result, doc_lists, weights) == rrf_scores(expected, doc_lists, weights)
+
+
+def test_chunk_id_dedup():
+    # 同一个chunk在两路检索里文本不同(例如关键词检索返回了高亮内容), 仍然视为同一个文档
+    doc_a = Document(page_content='a', metadata={'file_id': 1, 'chunk_index': 0})
+    doc_a_highlight = Document(page_content='<em>a</em>', metadata={'file_id': 1, 'chunk_index': 0})
+    doc_b = Document(page_content='b', metadata={'file_id': 1, 'chunk_index': 1})
+    # 没有chunk id时按文本内容去重
+    doc_c = Document(page_content='c')
+    doc_c_copy = Document(page_content='c', metadata={'source': 'other'})
+    result = weighted_reciprocal_rank([[doc_b, doc_a, doc_c], [doc_a_highlight, doc_c_copy]], [0.5, 0.5])
+    assert result == [doc_a, doc_c, doc_b]
+
+    merged = interleave_dedup([doc_a, doc_b], [doc_a_highlight, doc_c])
+    assert merged == [doc_a, doc_b, doc_c]
+
+
+def test_score_fusion():
+    doc_a = Document(page_content='a', metadata={'score': 0.9})
+    doc_b = Document(page_content='b', metadata={'score': 0.1})
+    doc_c = Document(page_content='c', metadata={'score': 20})
+    doc_b_keyword = Document(page_content='b', metadata={'score': 30})
+    result = weighted_score_fusion([[doc_a, doc_b], [doc_b_keyword, doc_c]], [0.4, 0.6])
+    assert result == [doc_b, doc_a, doc_c]
+    try:
+        weighted_score_fusion([[Document(page_content='a')]], [1])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('missing score should raise ValueError')
+
+    retriever = EnsembleRetriever(retrievers=[], weights=[0.4, 0.6], fusion_type='score')
+    assert retriever.fuse([[doc_a, doc_b], [doc_b_keyword, doc_c]]) == [doc_b, doc_a, doc_c]
+
+
+def test_benchmark():
+    weights = [0.5, 0.3, 0.2]
+    for k in (50, 200, 1000):
+        doc_lists = make_doc_lists(k)
+        print(f'k={k} lists={len(doc_lists)}')
+        bench('legacy', lambda: legacy_weighted_reciprocal_rank(doc_lists, weights))
+        bench('numpy', lambda: weighted_reciprocal_rank(doc_lists, weights))
+        bench('score', lambda: weighted_score_fusion(doc_lists, weights))
+
+
+if __name__ == '__main__':
+    test_rrf_same_as_legacy()
+    test_chunk_id_dedup()
+    test_score_fusion()
+    test_benchmark()
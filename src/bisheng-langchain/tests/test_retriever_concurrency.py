@@ -0,0 +1,76 @@
+"""
+混合检索的延迟: 向量检索和关键词检索并发执行, 以及其中一个检索慢时的降级
+用注入延迟的fake检索器代替milvus和es, 使用方式: python tests/test_retriever_concurrency.py
+"""
+import asyncio
+import time
+from typing import List
+
+from langchain.callbacks.manager import (AsyncCallbackManagerForRetrieverRun,
+                                         CallbackManagerForRetrieverRun)
+from langchain.schema import BaseRetriever, Document
+
+from bisheng_langchain.retrievers import EnsembleRetriever, MixEsVectorRetriever
+
+VECTOR_DELAY = 0.3
+KEYWORD_DELAY = 0.2
+SLOW_DELAY = 3
+
+
+class FakeRetriever(BaseRetriever):
+    name: str
+    delay: float
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        time.sleep(self.delay)
+        return [Document(page_content=f'{self.name}_{i}') for i in range(5)]
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        await asyncio.sleep(self.delay)
+        return [Document(page_content=f'{self.name}_{i}') for i in range(5)]
+
+
+def timeit(name: str, func):
+    start = time.perf_counter()
+    docs = func()
+    print(f'{name:<28} latency={time.perf_counter() - start:.3f}s docs={len(docs)}')
+    return docs
+
+
+def test_mix_es_vector():
+    retriever = MixEsVectorRetriever(vector_retriever=FakeRetriever(name='vector', delay=VECTOR_DELAY),
+                                     keyword_retriever=FakeRetriever(name='keyword', delay=KEYWORD_DELAY),
+                                     combine_strategy='mix')
+    print(f'serial latency would be {VECTOR_DELAY + KEYWORD_DELAY:.3f}s')
+    docs = timeit('mix sync', lambda: retriever.get_relevant_documents('query'))
+    assert len(docs) == 10
+    docs = timeit('mix async', lambda: asyncio.run(retriever.aget_relevant_documents('query')))
+    assert len(docs) == 10
+
+
+def test_degraded():
+    retriever = MixEsVectorRetriever(vector_retriever=FakeRetriever(name='vector', delay=SLOW_DELAY),
+                                     keyword_retriever=FakeRetriever(name='keyword', delay=KEYWORD_DELAY),
+                                     timeout=0.5)
+    docs = timeit('mix sync slow vector', lambda: retriever.get_relevant_documents('query'))
+    assert [one.page_content.split('_')[0] for one in docs] == ['keyword'] * 5
+    docs = timeit('mix async slow vector', lambda: asyncio.run(retriever.aget_relevant_documents('query')))
+    assert [one.page_content.split('_')[0] for one in docs] == ['keyword'] * 5
+
+
+def test_ensemble():
+    retrievers = [FakeRetriever(name=f'retriever{i}', delay=VECTOR_DELAY) for i in range(4)]
+    retriever = EnsembleRetriever(retrievers=retrievers)
+    print(f'serial latency would be {VECTOR_DELAY * len(retrievers):.3f}s')
+    docs = timeit('ensemble sync', lambda: retriever.get_relevant_documents('query'))
+    assert len(docs) == 20
+    docs = timeit('ensemble async', lambda: asyncio.run(retriever.aget_relevant_documents('query')))
+    assert len(docs) == 20
+
+
+if __name__ == '__main__':
+    test_mix_es_vector()
+    test_degraded()
+    test_ensemble()